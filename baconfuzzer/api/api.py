@@ -1,7 +1,112 @@
-from flask import Blueprint
+from http import HTTPStatus
+
+from flask import Blueprint, jsonify, request
+
+from ..bacon_fuzzer_app import app
+from ..message_formats.crash_store import ContextFrame, CrashStore
 
 api_bp = Blueprint(
     "api",
     __name__,
     url_prefix="/api",
 )
+
+# most crashes returned by one query
+MAX_CRASHES = 1000
+
+
+def _crash_json(crash: dict) -> dict:
+    crash = dict(crash)
+    for name in ("raw_msg", "response"):
+        if crash.get(name) is not None:
+            crash[name] = bytes(crash[name]).hex()
+    if "context" in crash:
+        crash["context"] = [_context_json(frame) for frame in crash["context"]]
+    return crash
+
+
+def _context_json(frame: ContextFrame) -> dict:
+    frame = frame._asdict()
+    for name in ("raw_msg", "response"):
+        if frame[name] is not None:
+            frame[name] = bytes(frame[name]).hex()
+    return frame
+
+
+def _arg(name: str, convert=str, default=None):
+    """
+    A query argument; raises ValueError if it can't be converted (unlike
+    request.args.get, which falls back to the default)
+    """
+    value = request.args.get(name)
+    return default if value is None else convert(value)
+
+
+def _error(message: str, status=HTTPStatus.BAD_REQUEST):
+    return jsonify({"error": message}), status
+
+
+@api_bp.route("/crashes", methods=["GET"])
+def query_crashes():
+    """
+    Query the crash store. Arguments: job_id (a dashboard job) or job (a crash
+    directory), kind, msg_name, function_code (e.g. 21 or 0x15), signature, since
+    and until (epoch seconds), min_latency (seconds), limit and offset.
+    """
+    try:
+        filters = {
+            "job": _arg("job"),
+            "kind": _arg("kind"),
+            "msg_name": _arg("msg_name"),
+            "function_code": _arg("function_code", lambda code: int(code, 0)),
+            "signature": _arg("signature"),
+            "since": _arg("since", float),
+            "until": _arg("until", float),
+            "min_latency": _arg("min_latency", float),
+        }
+        job_id = _arg("job_id", int)
+        if job_id is not None:
+            filters["job"] = app.fuzzer.get_crash_path(job_id)
+            if filters["job"] is None:
+                return _error("The job hasn't started yet")
+        limit = max(0, min(_arg("limit", int, 100), MAX_CRASHES))
+        offset = max(0, _arg("offset", int, 0))
+    except (ValueError, IndexError) as e:
+        return _error(f"Invalid query: {e}")
+    store = CrashStore()
+    try:
+        return jsonify(
+            {
+                "total": store.count(**filters),
+                "crashes": [
+                    _crash_json(crash)
+                    for crash in store.query(limit, offset, **filters)
+                ],
+            }
+        )
+    finally:
+        store.close()
+
+
+@api_bp.route("/crashes/<int:crash_id>", methods=["GET"])
+def get_crash(crash_id: int):
+    store = CrashStore()
+    try:
+        crash = store.get(crash_id)
+    finally:
+        store.close()
+    if crash is None:
+        return _error(f"No crash {crash_id}", HTTPStatus.NOT_FOUND)
+    return jsonify(_crash_json(crash))
+
+
+@api_bp.route("/crashes/jobs", methods=["GET"])
+def crash_jobs():
+    """
+    The jobs in the crash store, with their number of crashes
+    """
+    store = CrashStore()
+    try:
+        return jsonify(store.jobs())
+    finally:
+        store.close()
@@ -8,20 +8,27 @@ import werkzeug
 import werkzeug.exceptions
 from flask import (
     Blueprint,
+    Response,
     redirect,
     render_template,
     request,
     send_file,
     url_for,
-    send_from_directory,
 )
 
 from baconfuzzer.devices import DEVICES
-from baconfuzzer.fuzzer.fuzzer import JOB_STAGE, JOB_STAGE_DESCRIPTIONS, STATUS_ICON_MAP
-from baconfuzzer.io import IOINTERFACES
+from baconfuzzer.fuzzer.fuzzer import (
+    JOB_STAGE,
+    JOB_STAGE_DESCRIPTIONS,
+    STATUS_ICON_MAP,
+    get_job_config_opts,
+)
+from baconfuzzer.io import IOINTERFACES, get_protocol_interface
 
 from ..bacon_fuzzer_app import app
-from ..message_formats import PROTOCOLS
+from ..message_formats import PROTOCOLS, create_protocol
+from ..message_formats.config import BaconConfig
+from ..message_formats.crash_store import CrashStore
 
 dashboard_bp = Blueprint(
     "dashboard",
@@ -53,9 +60,9 @@ messages_with_validation_logic = []
 
 # determine which message types implement validation
 def identify_validation_configs():
-    for p_name, p in PROTOCOLS.items():
+    for p_name in PROTOCOLS:
         try:
-            p.validate_msg(None, None)
+            create_protocol(p_name).validate_msg(None, None)
         except NotImplementedError:
             continue  # don't add it
         except Exception:
@@ -105,6 +112,15 @@ def inject_app_ctx():
     )
 
 
+def get_job_config(io_interface_name, selected_msgs, protocol) -> BaconConfig:
+    """
+    Protocol + interface configuration plus the options common to every job
+    """
+    config = IOINTERFACES[io_interface_name].get_config_opts(selected_msgs, protocol)
+    config.extend(get_job_config_opts())
+    return config
+
+
 def generic_error_handler(e):
     try:
         return build_error_page(
@@ -124,6 +140,7 @@ def dashboard_main():
         job["num_msgs_sent"] = app.fuzzer.get_num_msgs_sent(job_id)
         job["exit_reason"] = app.fuzzer.get_exit_reason(job_id)
         job["status"] = app.fuzzer.get_status(job_id)
+        job["stats"] = app.fuzzer.get_stats(job_id)
     job_data_values = list(app.job_data.values())
     return render_template(
         "index.html", job_data=job_data_values, is_running=app.fuzzer.is_running()
@@ -153,7 +170,7 @@ def message_config():
         return build_error_page(
             "Invalid protocol name provided.", HTTPStatus.BAD_REQUEST
         )
-    protocol = PROTOCOLS[protocol_name]
+    protocol = create_protocol(protocol_name)
     io_interface_name = request.form.get("io_interface")
     if io_interface_name not in IOINTERFACES:
         return build_error_page("Invalid interface provided.")
@@ -169,6 +186,7 @@ def message_config():
         protocol=protocol,
         protocol_name=protocol_name,
         io_interface_name=io_interface_name,
+        protocol_interface_name=get_protocol_interface(io_interface_name),
         device_name=device_name,
         validate=validate,
         comment=comment,
@@ -193,7 +211,7 @@ def protocol_config():
     if device_name not in DEVICES:
         return build_error_page("Invalid device provided.", HTTPStatus.BAD_REQUEST)
 
-    protocol = PROTOCOLS[protocol_name]
+    protocol = create_protocol(protocol_name)
     selected_msgs = []
     for msg_name in protocol.get_msg_names():
         msg_check_value = request.form.get(msg_name)
@@ -205,7 +223,7 @@ def protocol_config():
     comment = request.form.get("comment", "")
 
     validate = request.form.get("validate")
-    io_config = IOINTERFACES[io_interface_name].get_config_opts(selected_msgs, protocol)
+    io_config = get_job_config(io_interface_name, selected_msgs, protocol)
     return render_template(
         "protocol_config.html",
         selected_msgs=selected_msgs,
@@ -269,7 +287,7 @@ def start():
     if device_name not in DEVICES:
         return build_error_page("Invalid device provided.", HTTPStatus.BAD_REQUEST)
 
-    protocol = PROTOCOLS[protocol_name]
+    protocol = create_protocol(protocol_name)
     validate = request.form.get("validate") == "on"
     selected_msgs = request.form.get("_selected_msgs").split(",")
     if len(selected_msgs) == 0:
@@ -277,7 +295,7 @@ def start():
 
     comment = request.form.get("comment", "")
 
-    io_config = IOINTERFACES[io_interface_name].get_config_opts(selected_msgs, protocol)
+    io_config = get_job_config(io_interface_name, selected_msgs, protocol)
     config_values = io_config.parse_form(request.form)
     start_fuzzer_job(
         protocol_name,
@@ -320,7 +338,7 @@ def validate_job_config(config: dict) -> bool:
 
     if "msg_types" not in config or not isinstance(config["msg_types"], list):
         return False
-    protocol_obj = PROTOCOLS[protocol_name]
+    protocol_obj = create_protocol(protocol_name)
     all_msg_types = protocol_obj.get_msg_names()
     msg_types = config["msg_types"]
     if len(msg_types) == 0:
@@ -334,8 +352,12 @@ def validate_job_config(config: dict) -> bool:
     ):
         return False
     proto_config = config["protocol_config"]
-    for config_item in protocol_obj.get_config(msg_types, io_interface).item_names:
-        if config_item not in proto_config:
+    protocol_interface = get_protocol_interface(io_interface)
+    for config_item in protocol_obj.get_config(msg_types, protocol_interface).items:
+        # optional items may be missing from configs saved by older versions
+        if config_item.name not in proto_config and getattr(
+            config_item, "required", True
+        ):
             return False
     return True
 
@@ -430,13 +452,24 @@ app.config["CRASHES_FOLDER"] = crashes_folder
 @dashboard_bp.route("/crashes/<id>", methods=["GET"])
 def get_crashes(id: int):
     try:
-        # get job thread info:
-        my_thread = app.fuzzer._threads[int(id)]
-        return send_from_directory(
-            "../" + my_thread.get_crash_path() + "/",
-            "crashes.log",
-        )
+        crash_path = app.fuzzer.get_crash_path(int(id))
+        if crash_path is None:
+            raise ValueError("The job hasn't started yet")
+        store = CrashStore()
     except Exception as e:
         return build_error_page(
             "Could not fetch crash info", HTTPStatus.BAD_REQUEST, str(e)
         )
+
+    # the job's crashes in the crash log format, exported from the crash store
+    def export():
+        try:
+            yield from store.export_log(job=crash_path)
+        finally:
+            store.close()
+
+    return Response(
+        export(),
+        mimetype="text/plain",
+        headers={"Content-Disposition": "attachment; filename=crashes.log"},
+    )
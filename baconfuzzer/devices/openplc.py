@@ -19,7 +19,7 @@ class OpenPlcDevice(BaseDevice):
         self.log = logging.getLogger(__name__)
 
     def handle_io_exception(self, io_ifc: BaconIOInterface, ex: Exception):
-        if io_ifc.name == "TCP Socket":
+        if io_ifc.name in ("TCP Socket", "Async TCP Socket"):
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
                 sock.settimeout(5)
                 try:
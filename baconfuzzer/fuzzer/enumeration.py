@@ -0,0 +1,132 @@
+import bisect
+import json
+import logging
+import math
+import random
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+from ..message_formats.compiler import FieldSpace
+
+log = logging.getLogger(__name__)
+
+
+class AffinePermutation:
+    """
+    Full-period permutation of range(size): i -> (a * i + c) mod size with a coprime
+    to size. Any index can be mapped without state, which is what makes an
+    enumeration resumable from just its position.
+    """
+
+    def __init__(self, size: int, seed: int):
+        rng = random.Random(seed)
+        self.size = size
+        # start near the golden ratio so consecutive indexes land far apart
+        a = int(size * 0.6180339887) + rng.randrange(max(1, size // 64))
+        while math.gcd(a, size) != 1:
+            a += 1
+        self.a = a % size if size > 1 else 0
+        self.c = rng.randrange(size)
+
+    def __getitem__(self, index: int) -> int:
+        return (self.a * index + self.c) % self.size
+
+
+class Enumeration:
+    """
+    Visits every point of the selected messages' field spaces exactly once, in a
+    pseudo-random order. The state is the seed and the position of the first
+    index that hasn't been sent yet, plus the (few) indexes currently in flight.
+    """
+
+    def __init__(self, spaces: Dict[str, FieldSpace], seed=None, position=0):
+        if not spaces:
+            raise ValueError("Nothing to enumerate")
+        self.spaces = spaces
+        self.names = list(spaces)
+        self.offsets = []
+        self.size = 0
+        for name in self.names:
+            self.offsets.append(self.size)
+            self.size += spaces[name].size
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self._permutation = AffinePermutation(self.size, self.seed)
+        self._lock = threading.Lock()
+        self._next = position
+        self._in_flight: Set[int] = set()
+        self._done = position
+        self._skipped = 0
+
+    def next(self) -> Optional[Tuple[int, str, dict]]:
+        """
+        :returns: (index, message name, field values) of the next point; None once
+        every point has been handed out
+        """
+        with self._lock:
+            if self._next >= self.size:
+                return None
+            index = self._next
+            self._next += 1
+            self._in_flight.add(index)
+        point = self._permutation[index]
+        i = bisect.bisect_right(self.offsets, point) - 1
+        name = self.names[i]
+        return index, name, self.spaces[name].values(point - self.offsets[i])
+
+    def done(self, index: int, sent=True):
+        """
+        Mark a point as covered, either sent or skipped (e.g. failed validation)
+        """
+        with self._lock:
+            self._in_flight.discard(index)
+            self._done += 1
+            if not sent:
+                self._skipped += 1
+
+    @property
+    def complete(self) -> bool:
+        with self._lock:
+            return self._done >= self.size
+
+    @property
+    def position(self) -> int:
+        """
+        Index to resume from; points in flight are visited again after a resume
+        """
+        with self._lock:
+            return min(self._in_flight) if self._in_flight else self._next
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "space": self.size,
+                "covered": self._done,
+                "covered (%)": round(100 * self._done / self.size, 2),
+                "skipped (invalid)": self._skipped,
+            }
+
+    def save(self, path):
+        checkpoint = {
+            "seed": self.seed,
+            "position": self.position,
+            "messages": {name: space.size for name, space in self.spaces.items()},
+        }
+        with open(path, mode="w") as f:
+            json.dump(checkpoint, f)
+
+    @classmethod
+    def load(cls, path, spaces: Dict[str, FieldSpace]) -> "Enumeration":
+        """
+        Resume an enumeration of the same messages from a checkpoint file
+        """
+        with open(path) as f:
+            checkpoint = json.load(f)
+        sizes = {name: space.size for name, space in spaces.items()}
+        if checkpoint["messages"] != sizes:
+            raise ValueError(
+                f"Enumeration checkpoint {path} doesn't match the selected messages"
+            )
+        log.info(f"Resuming enumeration at {checkpoint['position']} from {path}")
+        # the order of the messages decides the permutation
+        spaces = {name: spaces[name] for name in checkpoint["messages"]}
+        return cls(spaces, checkpoint["seed"], checkpoint["position"])
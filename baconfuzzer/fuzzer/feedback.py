@@ -0,0 +1,208 @@
+"""
+Response feedback: each reply gets a cheap signature (length bucket, protocol
+fields such as the Modbus function/exception code and a hash of its first bytes).
+An input whose reply has a signature not seen before is promoted into the seed
+corpus with a higher weight and saved to disk by a background writer, so the
+fuzzer explores the inputs that made the target do something new. The index and
+the promotions are capped, so a target whose replies echo random request bytes
+can't fill memory or the disk.
+"""
+import hashlib
+import logging
+import queue
+import threading
+from pathlib import Path
+from time import monotonic
+from typing import Dict, Optional, Set
+
+from ..message_formats import Protocol
+from .mutation import SeedCorpus, corpus_dir_name
+
+log = logging.getLogger(__name__)
+
+# default number of bytes of the reply body that go into its signature
+SIGNATURE_PREFIX = 4
+# seed weight of promoted inputs (plain seeds have 1)
+PROMOTED_WEIGHT = 4
+# signatures remembered per job; once full, no reply counts as new
+MAX_SIGNATURES = 65536
+# inputs promoted per job
+MAX_PROMOTED = 1024
+# seconds a job waits for its promoted inputs to be saved when it ends
+CLOSE_TIMEOUT = 10
+
+NO_RESPONSE = ("no response",)
+
+
+def _bucket(value: int) -> int:
+    """
+    Logarithmic bucket: 0, 1, 2-3, 4-7, ...
+    """
+    return value.bit_length()
+
+
+def response_signature(
+    protocol: Protocol,
+    rxd: Optional[bytes],
+    io_interface,
+    prefix=SIGNATURE_PREFIX,
+) -> tuple:
+    """
+    :param prefix: Bytes of the body to hash. Bodies that echo request fields
+    (e.g. register addresses) make every reply look new if this is too long.
+    """
+    if rxd is None:
+        return NO_RESPONSE
+    fields, body = protocol.response_key(rxd, io_interface)
+    return _bucket(len(rxd)), fields, hash(bytes(body[:prefix]))
+
+
+class NoveltyIndex:
+    """
+    Signatures seen so far (up to max_signatures), with how often and which message
+    type found them first
+    """
+
+    def __init__(self, max_signatures=MAX_SIGNATURES):
+        self.max_signatures = max_signatures
+        self._counts: Dict[tuple, int] = {}
+        # message name -> signatures it found first
+        self.novel_by_msg: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._observed = 0
+        self._last_novel = 0
+        self._last_novel_time = monotonic()
+
+    def observe(self, msg_name: str, signature: tuple) -> bool:
+        """
+        :returns: True if the signature is new
+        """
+        with self._lock:
+            self._observed += 1
+            count = self._counts.get(signature)
+            if count is not None:
+                self._counts[signature] = count + 1
+                return False
+            if len(self._counts) >= self.max_signatures:
+                return False
+            self._counts[signature] = 1
+            self.novel_by_msg[msg_name] = self.novel_by_msg.get(msg_name, 0) + 1
+            self._last_novel = self._observed
+            self._last_novel_time = monotonic()
+            return True
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "signatures": len(self._counts),
+                "index full": len(self._counts) >= self.max_signatures,
+                "responses since new signature": self._observed - self._last_novel,
+                "seconds since new signature": round(
+                    monotonic() - self._last_novel_time
+                ),
+            }
+
+
+class CorpusWriter(threading.Thread):
+    """
+    Saves promoted inputs to a corpus directory, off the fuzz thread
+    """
+
+    def __init__(self, corpus_dir):
+        super().__init__(name="corpus-writer", daemon=True)
+        self.corpus_dir = Path(corpus_dir)
+        self._queue: "queue.SimpleQueue[Optional[tuple]]" = queue.SimpleQueue()
+        # message directories created so far
+        self._dirs: Set[Path] = set()
+        self.num_saved = 0
+
+    def save(self, msg_name: str, raw_msg: bytes):
+        self._queue.put((msg_name, raw_msg))
+
+    def close(self, timeout: Optional[float] = CLOSE_TIMEOUT):
+        """
+        Save the inputs queued so far and stop
+        """
+        self._queue.put(None)
+        self.join(timeout)
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            msg_name, raw_msg = item
+            msg_dir = self.corpus_dir / corpus_dir_name(msg_name)
+            try:
+                if msg_dir not in self._dirs:
+                    msg_dir.mkdir(parents=True, exist_ok=True)
+                    self._dirs.add(msg_dir)
+                (msg_dir / hashlib.sha1(raw_msg).hexdigest()[:16]).write_bytes(raw_msg)
+                self.num_saved += 1
+            except OSError:
+                log.exception(f"Couldn't save a promoted input to {msg_dir}")
+
+
+class ResponseFeedback:
+    """
+    Observer of a job's responses (see Protocol.observe_responses). Novel responses
+    promote their input (up to max_promoted of them) into the corpus (if the job
+    mutates seeds) and into corpus_dir, which can seed later jobs. Closed when the
+    job ends.
+    """
+
+    def __init__(
+        self,
+        protocol: Protocol,
+        io_interface,
+        corpus: Optional[SeedCorpus] = None,
+        corpus_dir=None,
+        prefix=SIGNATURE_PREFIX,
+        max_signatures=MAX_SIGNATURES,
+        max_promoted=MAX_PROMOTED,
+    ):
+        self.protocol = protocol
+        self.io_interface = io_interface
+        self.corpus = corpus
+        self.prefix = prefix
+        self.max_promoted = max_promoted
+        self.index = NoveltyIndex(max_signatures)
+        self._writer: Optional[CorpusWriter] = None
+        if corpus_dir:
+            self._writer = CorpusWriter(corpus_dir)
+            self._writer.start()
+        self._num_promoted = 0
+
+    def __call__(
+        self, msg_name: str, raw_msg: bytes, rxd: Optional[bytes], latency
+    ) -> bool:
+        """
+        :returns: True if the response has a new signature
+        """
+        signature = response_signature(
+            self.protocol, rxd, self.io_interface, self.prefix
+        )
+        if not self.index.observe(msg_name, signature):
+            return False
+        # no reply is a crash candidate, logged as such rather than explored
+        if rxd is not None and self._num_promoted < self.max_promoted:
+            self._num_promoted += 1
+            if self.corpus is not None:
+                self.corpus.add(msg_name, raw_msg, PROMOTED_WEIGHT)
+            if self._writer is not None:
+                self._writer.save(msg_name, bytes(raw_msg))
+        return True
+
+    def close(self):
+        """
+        Wait until the promoted inputs are saved
+        """
+        if self._writer is not None:
+            self._writer.close()
+
+    def get_stats(self) -> dict:
+        stats = self.index.get_stats()
+        stats["promoted inputs"] = self._num_promoted
+        if self._writer is not None:
+            stats["saved inputs"] = self._writer.num_saved
+        return stats
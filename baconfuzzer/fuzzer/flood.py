@@ -0,0 +1,146 @@
+"""
+Flood mode: fuzzed frames are written back to back in batches without waiting
+for replies, so the link rather than the target's latency limits the rate. The
+target's liveness is checked with a known-good probe message every so many
+frames or milliseconds (or, while a health monitor runs, by asking it); when a
+probe goes unanswered the frames sent before it are recorded as the crash's
+context.
+"""
+import logging
+from collections import deque
+from time import monotonic
+from typing import Deque, List, Optional, Tuple
+
+from ..message_formats import Protocol
+from .health import HealthMonitor
+
+log = logging.getLogger(__name__)
+
+
+class FloodSender:
+    def __init__(
+        self,
+        protocol: Protocol,
+        io_interface,
+        config_values: dict,
+        probe_msg: Optional[bytes] = None,
+        probe_every=1000,
+        probe_interval=0.1,
+        batch_bytes=4096,
+        window=1000,
+        health: Optional[HealthMonitor] = None,
+    ):
+        """
+        :param probe_msg: Raw probe; None asks the protocol for one every probe
+        :param probe_every: Frames between probes; 0 probes on the interval only
+        :param probe_interval: Seconds between probes; 0 probes every few frames only
+        :param batch_bytes: Frames are written once this many bytes are pending
+        :param window: Recent frames recorded with a failed probe
+        :param health: The job's health monitor; checked instead of probing
+        """
+        if (
+            probe_msg is None
+            and protocol.get_probe_msg(config_values, io_interface) is None
+        ):
+            raise ValueError("Flood mode needs a probe frame for this protocol")
+        if not probe_every and not probe_interval:
+            raise ValueError("Flood mode needs a probe frame count or interval")
+        self.protocol = protocol
+        self.io_interface = io_interface
+        self.config_values = config_values
+        self.probe_msg = probe_msg
+        self.probe_every = probe_every
+        self.probe_interval = probe_interval
+        self.batch_bytes = batch_bytes
+        self.health = health
+        self._batch: List[bytes] = []
+        self._batch_size = 0
+        # (message name, raw frame) of the frames sent since the last failed probe
+        self._recent: Deque[Tuple[str, bytes]] = deque(maxlen=max(1, window))
+        self._since_probe = 0
+        self._last_probe = monotonic()
+        self._started = monotonic()
+        self._num_frames = 0
+        self._num_bytes = 0
+        self._num_batches = 0
+        self._num_probes = 0
+        self._num_failed = 0
+
+    def send(self, msg_name: str, raw_msg: bytes) -> int:
+        """
+        Queue a frame, writing the batch when it is full and probing when due
+        :returns: Number of crashes detected (failed probes)
+        """
+        self._batch.append(raw_msg)
+        self._batch_size += len(raw_msg)
+        self._recent.append((msg_name, raw_msg))
+        self._since_probe += 1
+        if self._batch_size >= self.batch_bytes:
+            self._flush()
+        due = self.probe_every and self._since_probe >= self.probe_every
+        if not due and self.probe_interval:
+            due = monotonic() - self._last_probe >= self.probe_interval
+        if due:
+            return int(not self._probe())
+        return 0
+
+    def finish(self) -> int:
+        """
+        Write the pending frames and probe the target once more, so the last
+        frames can't crash it unnoticed
+        :returns: Number of crashes detected
+        """
+        if not self._since_probe:
+            return 0
+        return int(not self._probe())
+
+    def _flush(self):
+        if not self._batch:
+            return
+        self.io_interface.send_batch(self._batch)
+        self._num_frames += len(self._batch)
+        self._num_bytes += self._batch_size
+        self._num_batches += 1
+        self._batch = []
+        self._batch_size = 0
+
+    def _probe(self) -> bool:
+        """
+        :returns: True if the target answered the probe
+        """
+        self._flush()
+        if self.health is not None:
+            alive = not self.health.failed_since(self._last_probe)
+            probe_msg = self.health.last_probe_msg or b""
+        else:
+            probe_msg = self.probe_msg
+            if probe_msg is None:
+                probe_msg = self.protocol.get_probe_msg(
+                    self.config_values, self.io_interface
+                )
+            alive = self.protocol.probe(
+                probe_msg, self.config_values, self.io_interface
+            )
+        self._num_probes += 1
+        self._since_probe = 0
+        if not alive:
+            log.warning(f"Liveness probe failed after {len(self._recent)} frames")
+            self._num_failed += 1
+            self.protocol.record_probe_crash(
+                self.io_interface, probe_msg, list(self._recent)
+            )
+            self._recent.clear()
+        # the interval runs from the answer, so a slow target isn't probed back to back
+        self._last_probe = monotonic()
+        return alive
+
+    def get_stats(self) -> dict:
+        elapsed = max(monotonic() - self._started, 1e-9)
+        return {
+            "frames written": self._num_frames,
+            "frames/s": round(self._num_frames / elapsed),
+            "kB/s": round(self._num_bytes / elapsed / 1000, 1),
+            "frames per batch": round(self._num_frames / max(self._num_batches, 1), 1),
+            "probes": self._num_probes,
+            "failed probes": self._num_failed,
+        }
@@ -1,19 +1,41 @@
 import json
 import logging
+import multiprocessing
 import os
 from pathlib import Path
-import random
 import threading
 from enum import Enum
-from time import sleep
+from time import monotonic, sleep, time
 from typing import List, Optional, Type
 
 from ..devices import BaseDevice
+from ..io.flight_recorder import FlightRecorder
 from ..io.io_handler import BaconIOInterface
-from ..message_formats import GET_PROTO_STRING_FROM_TYPE, PROTOCOLS, Protocol
+from ..io.records import REPLY, SENT, RecordWriter
+from ..message_formats import GET_PROTO_STRING_FROM_TYPE, Protocol, create_protocol
+from ..message_formats.config import (
+    ConfigItem,
+    DropDown,
+    FloatValue,
+    IntValue,
+    TextValue,
+)
+from .enumeration import Enumeration
+from .feedback import ResponseFeedback
+from .flood import FloodSender
+from .health import HealthMonitor, MonitoredDevice
+from .mutation import MutationEngine
+from .pipeline import FuzzedFrame, MessagePipeline
+from .scheduler import SCHEDULERS, Scheduler, UniformScheduler
 
 log = logging.getLogger(__name__)
 
+"""
+Worker processes are spawned rather than forked so they don't inherit the
+web server's threads and locks.
+"""
+_mp = multiprocessing.get_context("spawn")
+
 
 class JOB_STAGE(Enum):
     """
@@ -70,6 +92,14 @@ STATUS_ICON_MAP = {
 }
 
 
+def get_job_opt(config_values: dict, name: str, default):
+    """
+    Get a job option, falling back to the default if it is missing or left blank
+    """
+    value = config_values.get(name)
+    return default if value is None else value
+
+
 class FuzzerThread(threading.Thread):
     def __init__(
         self,
@@ -79,12 +109,16 @@ class FuzzerThread(threading.Thread):
         config_values: dict,
         io_ifc: Type[BaconIOInterface],
         device: Type[BaseDevice],
+        job_ident: Optional[int] = None,
     ):
         super().__init__()
         self.protocol = protocol
+        self.job_ident = job_ident
         self.selected_msgs = selected_msgs
         self.validate = validate
         self.config_values = config_values
+        self._io_ifc = io_ifc
+        self._device = device
         self._io_interface = io_ifc(self.config_values, device)
         self._stop_flag = False
         self.num_crashes = 0
@@ -92,6 +126,19 @@ class FuzzerThread(threading.Thread):
         self.exit_reason = ""
         self.lock = threading.Lock()
         self.status = TASK_STATUS.NOT_STARTED
+        self._pipeline: Optional[MessagePipeline] = None
+        self._enumeration: Optional[Enumeration] = None
+        self._checkpoint_path = None
+        self._mutation: Optional[MutationEngine] = None
+        self._feedback: Optional[ResponseFeedback] = None
+        self._scheduler: Optional[Scheduler] = None
+        self._flood: Optional[FloodSender] = None
+        self._health: Optional[HealthMonitor] = None
+        # the health monitor's stats when it stopped
+        self._health_stats: Optional[dict] = None
+        self._traffic: Optional[RecordWriter] = None
+        self._traffic_job = ""
+        self._flights: Optional[FlightRecorder] = None
 
     def stop_flag(self):
         """
@@ -105,7 +152,7 @@ class FuzzerThread(threading.Thread):
             "crashes/"
             + f"{GET_PROTO_STRING_FROM_TYPE(self.protocol)}/"
             + f"{self._io_interface.name}/"
-            + f"{self.ident}"
+            + f"{self.ident if self.job_ident is None else self.job_ident}"
         ).lower()
         return os.path.normpath(p.replace(" ", "_"))
 
@@ -120,6 +167,200 @@ class FuzzerThread(threading.Thread):
         config_json = json.dumps(config)
         return config_json
 
+    def _generate(self) -> Optional[FuzzedFrame]:
+        if self._enumeration is not None:
+            return self._generate_enumerated()
+        msg_name = self._scheduler.choose()
+        started = monotonic()
+        if self._mutation is not None:
+            built = self._mutation.build_msg(msg_name, self.validate, self.stop_flag)
+        else:
+            built = self.protocol.build_msg(
+                msg_name,
+                self.validate,
+                self.config_values,
+                self._io_interface,
+                self.stop_flag,
+            )
+        self._scheduler.record_generation(msg_name, monotonic() - started)
+        if built is None:
+            return None
+        return FuzzedFrame(msg_name, *built)
+
+    def _generate_enumerated(self) -> Optional[FuzzedFrame]:
+        point = self._enumeration.next()
+        if point is None:
+            # everything handed out; wait for the frames in flight
+            sleep(0.05)
+            return None
+        index, msg_name, values = point
+        built = self.protocol.build_enumerated_msg(
+            msg_name, values, self.validate, self.config_values, self._io_interface
+        )
+        if built is None:
+            self._covered(index, sent=False)
+            return None
+        return FuzzedFrame(msg_name, *built, index=index)
+
+    def _covered(self, index: int, sent=True):
+        self._enumeration.done(index, sent)
+        if self._enumeration.complete:
+            self._stop_flag = True
+
+    def _create_enumeration(self) -> Enumeration:
+        spaces = {}
+        for msg_name in self.selected_msgs:
+            space = self.protocol.get_field_space(msg_name)
+            if space is None:
+                log.warning(f"{msg_name} can't be enumerated, leaving it out")
+            else:
+                spaces[msg_name] = space
+        if not spaces:
+            raise ValueError("None of the selected messages can be enumerated")
+        checkpoint = self.config_values.get("Enumeration Checkpoint")
+        if checkpoint and os.path.exists(checkpoint):
+            enumeration = Enumeration.load(checkpoint, spaces)
+        else:
+            enumeration = Enumeration(spaces)
+        self._checkpoint_path = checkpoint or os.path.normpath(
+            self.get_crash_path() + "/enumeration.json"
+        )
+        return enumeration
+
+    def _create_mutation_engine(self) -> MutationEngine:
+        return MutationEngine.create(
+            self.protocol,
+            self.selected_msgs,
+            self.validate,
+            self.config_values,
+            self._io_interface,
+            self.stop_flag,
+            corpus_dir=self.config_values.get("Seed Corpus"),
+            seeds_per_msg=get_job_opt(self.config_values, "Seeds per Message", 16),
+            stack=get_job_opt(self.config_values, "Mutation Stack", 4),
+            fix_up=get_job_opt(self.config_values, "Mutant Fix-ups", "Yes") == "Yes",
+        )
+
+    def _on_response(self, msg_name, raw_msg, rxd, latency):
+        if self._traffic is not None:
+            now = time()
+            self._record_traffic(SENT, msg_name, raw_msg, now - latency)
+            if rxd is not None:
+                self._record_traffic(REPLY, msg_name, rxd, now)
+        novel = self._feedback is not None and self._feedback(
+            msg_name, raw_msg, rxd, latency
+        )
+        if self._scheduler is not None:
+            self._scheduler.record_response(msg_name, latency, rxd is None, novel)
+
+    def _use_feedback(self) -> bool:
+        """
+        Auto feeds novel responses back when they are used: to mutate seeds, or
+        to weight the message types
+        """
+        feedback = get_job_opt(self.config_values, "Response Feedback", "Auto")
+        if feedback != "Auto":
+            return feedback == "Yes"
+        return self._mutation is not None or (
+            self._scheduler is not None
+            and not isinstance(self._scheduler, UniformScheduler)
+        )
+
+    def _record_traffic(self, kind: int, msg_name: str, frame: bytes, created=None):
+        self._traffic.write(kind, self._traffic_job, msg_name, frame, created)
+
+    def _get_probe_msg(self) -> Optional[bytes]:
+        probe_msg = self.config_values.get("Probe Frame")
+        return bytes.fromhex(probe_msg) if probe_msg else None
+
+    def _create_flood_sender(self) -> FloodSender:
+        interval = get_job_opt(self.config_values, "Probe Interval", 100)
+        return FloodSender(
+            self.protocol,
+            self._io_interface,
+            self.config_values,
+            self._get_probe_msg(),
+            probe_every=get_job_opt(self.config_values, "Probe Every", 1000),
+            probe_interval=interval / 1000,
+            batch_bytes=get_job_opt(self.config_values, "Flood Batch Bytes", 4096),
+            window=get_job_opt(self.config_values, "Flood Window", 1000),
+            health=self._health,
+        )
+
+    def _create_health_monitor(self) -> Optional[HealthMonitor]:
+        if get_job_opt(self.config_values, "Health Monitor", "Yes") != "Yes":
+            return None
+        if self._io_interface.exclusive:
+            log.info(
+                f"{self._io_interface.name} can't be probed alongside the job, "
+                + "missing replies count as crashes right away"
+            )
+            return None
+        probe_msg = self._get_probe_msg()
+        if (
+            probe_msg is None
+            and self.protocol.get_probe_msg(self.config_values, self._io_interface)
+            is None
+        ):
+            log.warning("No probe frame for the health monitor, not starting it")
+            return None
+        # one connection (or session) is enough for probing
+        config_values = dict(
+            self.config_values, **{"Connection Pool Size": 1, "Concurrent Sessions": 1}
+        )
+        io_interface = self._io_ifc(config_values, BaseDevice)
+        io_interface.configure(config_values)
+        io_interface.framer = self.protocol.get_framer(config_values, io_interface)
+        interval = get_job_opt(self.config_values, "Health Probe Interval", 250)
+        monitor = HealthMonitor(
+            self.protocol,
+            io_interface,
+            self._device(),
+            config_values,
+            probe_msg,
+            interval=interval / 1000,
+            down_after=get_job_opt(self.config_values, "Down After", 2),
+            on_crash=self._on_confirmed_crash,
+        )
+        # recovery moves to the monitor's thread
+        self._io_interface.device = MonitoredDevice(monitor)
+        self.protocol.confirm_crashes(self._io_interface, monitor.report)
+        monitor.start()
+        return monitor
+
+    def _on_confirmed_crash(self):
+        with self.lock:
+            self.num_crashes += 1
+
+    def _stop_health_monitor(self):
+        # stopped once the loop ends, and again (doing nothing) on the way out
+        health, self._health = self._health, None
+        if health is None:
+            return
+        health.stop()
+        self._health_stats = health.get_stats()
+        self.protocol.confirm_crashes(self._io_interface, None)
+        health.io_interface.teardown()
+
+    def _save_checkpoint(self):
+        if self._enumeration is not None:
+            self._enumeration.save(self._checkpoint_path)
+
+    def _create_pipeline(self) -> Optional[MessagePipeline]:
+        depth = get_job_opt(self.config_values, "Prefetch Depth", 16)
+        if depth <= 0:
+            return None
+        return MessagePipeline(
+            self._generate,
+            self.stop_flag,
+            depth=depth,
+            producers=max(1, get_job_opt(self.config_values, "Generator Threads", 1)),
+            # dropping frames would leave holes in an enumeration
+            back_pressure="Block"
+            if self._enumeration is not None
+            else get_job_opt(self.config_values, "Back-pressure", "Block"),
+        )
+
     def run(self):
         try:
             if self.protocol is None:
@@ -136,33 +377,140 @@ class FuzzerThread(threading.Thread):
 
             # setup IO
             self._io_interface.configure(self.config_values)
-            self.protocol.set_logger(self.get_crash_path() + "/crashes.log")
-            while not self._stop_flag:
-                msg_name = random.choice(self.selected_msgs)
-                crash = self.protocol.fuzz_msg(
-                    msg_name,
-                    self.validate,
-                    self.config_values,
+            self._io_interface.framer = self.protocol.get_framer(
+                self.config_values, self._io_interface
+            )
+            self.protocol.set_logger(self.get_crash_path())
+            if get_job_opt(self.config_values, "Record Traffic", "No") == "Yes":
+                self._traffic_job = self.get_crash_path()
+                self._traffic = RecordWriter(
+                    os.path.normpath(self.get_crash_path() + "/traffic.bin")
+                )
+            strategy = get_job_opt(self.config_values, "Generation Strategy", "Random")
+            enumerate_msgs = strategy == "Enumerate"
+            # enumeration always needs the compiled plans' field spaces
+            if (
+                enumerate_msgs
+                or get_job_opt(self.config_values, "Frame Builder", "Compiled")
+                == "Compiled"
+            ):
+                self.protocol.compile_msgs(
+                    get_job_opt(self.config_values, "Builder Self-check", 64)
+                )
+            if enumerate_msgs:
+                self._enumeration = self._create_enumeration()
+            else:
+                if strategy == "Mutate":
+                    self._mutation = self._create_mutation_engine()
+                scheduler = get_job_opt(self.config_values, "Scheduler", "Uniform")
+                self._scheduler = SCHEDULERS[scheduler](
+                    self._mutation.msg_names
+                    if self._mutation is not None
+                    else self.selected_msgs
+                )
+            if self._use_feedback():
+                # inputs with novel responses are promoted to seeds, and saved so
+                # later jobs can use them as their seed corpus
+                self._feedback = ResponseFeedback(
+                    self.protocol,
                     self._io_interface,
-                    self.stop_flag,
+                    self._mutation.corpus if self._mutation is not None else None,
+                    os.path.normpath(self.get_crash_path() + "/corpus"),
+                    get_job_opt(self.config_values, "Response Signature Bytes", 4),
                 )
+            self.protocol.observe_responses(self._io_interface, self._on_response)
+            flights = get_job_opt(self.config_values, "Flight Recorder", 32)
+            if flights > 0:
+                self._flights = FlightRecorder(flights)
+                self.protocol.record_flights(self._io_interface, self._flights)
+            self._health = self._create_health_monitor()
+            if get_job_opt(self.config_values, "Send Mode", "Exchange") == "Flood":
+                self._flood = self._create_flood_sender()
+            self._pipeline = self._create_pipeline()
+            if self._pipeline is not None:
+                self._pipeline.start()
+            last_checkpoint = monotonic()
+            while not self._stop_flag:
+                if self._pipeline is not None:
+                    frame = self._pipeline.get()
+                else:
+                    frame = self._generate()
+                if frame is None:
+                    continue
+                # hold the frame while the monitor recovers the target
+                while (
+                    self._health is not None
+                    and not self._stop_flag
+                    and not self._health.wait_until_up(0.5)
+                ):
+                    pass
+                if self._stop_flag:
+                    break
+                if self._flood is not None:
+                    crashes = self._flood.send(frame.msg_name, frame.raw_msg)
+                    if self._traffic is not None:
+                        self._record_traffic(SENT, frame.msg_name, frame.raw_msg)
+                else:
+                    crashes = self.protocol.send_msg(
+                        frame.msg_name,
+                        frame.msg,
+                        frame.raw_msg,
+                        self.config_values,
+                        self._io_interface,
+                    )
                 with self.lock:
                     self.num_msgs_sent += 1
-                    if crash:
-                        self.num_crashes += 1
+                    self.num_crashes += int(crashes)
+                if frame.index is not None:
+                    self._covered(frame.index)
+                    if monotonic() - last_checkpoint >= 5:
+                        last_checkpoint = monotonic()
+                        self._save_checkpoint()
+            if self._flood is not None:
+                crashes = self._flood.finish()
+            else:
+                crashes = self.protocol.finish(self.config_values, self._io_interface)
+            with self.lock:
+                self.num_crashes += crashes
+            # settles the crash candidates
+            self._stop_health_monitor()
             with self.lock:
                 self._stop_flag = True
-                self.status = TASK_STATUS.EXITED_BY_USER
-                self.exit_reason = "Job stopped by user"
+                if self._enumeration is not None and self._enumeration.complete:
+                    self.status = TASK_STATUS.EXIT_SUCCESS
+                    self.exit_reason = "Enumerated every message"
+                else:
+                    self.status = TASK_STATUS.EXITED_BY_USER
+                    self.exit_reason = "Job stopped by user"
         except Exception as e:
             self.exit_reason = f"{e}"
             self.status = TASK_STATUS.EXIT_ERROR
         finally:
+            self._stop_flag = True
+            if self._pipeline is not None:
+                self._pipeline.stop()
+            if self.protocol is not None:
+                self.protocol.observe_responses(self._io_interface, None)
+                self.protocol.record_flights(self._io_interface, None)
+            try:
+                self._stop_health_monitor()
+            except Exception:
+                log.exception("Couldn't stop the health monitor")
+            try:
+                self._save_checkpoint()
+            except OSError:
+                log.exception("Couldn't save the enumeration checkpoint")
             try:
                 # tear down IO
                 self._io_interface.teardown()
             except Exception:
                 self.status = TASK_STATUS.EXIT_ERROR
+            if self._feedback is not None:
+                self._feedback.close()
+            if self._traffic is not None:
+                self._traffic.close()
+            if self.protocol is not None:
+                self.protocol.close()
 
     def stop(self):
         if self.is_alive():
@@ -186,6 +534,389 @@ class FuzzerThread(threading.Thread):
         with self.lock:
             return self.status
 
+    def get_stats(self) -> dict:
+        """
+        Job statistics for display; keys are labels, values are scalars or dicts of scalars
+        """
+        stats = {}
+        if self._pipeline is not None:
+            stats["Prefetch queue"] = self._pipeline.get_stats()
+        if self._enumeration is not None:
+            stats["Enumeration"] = self._enumeration.get_stats()
+        if self._mutation is not None:
+            stats["Mutation"] = self._mutation.get_stats()
+        if self._feedback is not None:
+            stats["Response feedback"] = self._feedback.get_stats()
+        if self._flood is not None:
+            stats["Flood"] = self._flood.get_stats()
+        health = self._health
+        if health is not None:
+            stats["Target health"] = health.get_stats()
+        elif self._health_stats is not None:
+            stats["Target health"] = self._health_stats
+        if self._flights is not None:
+            stats["Flight recorder"] = self._flights.get_stats()
+        if self._scheduler is not None:
+            stats[f"{self._scheduler.name} scheduler weights (%)"] = (
+                self._scheduler.get_stats()
+            )
+        if self.protocol is not None:
+            stats.update(self.protocol.get_stats(self._io_interface))
+        return stats
+
+
+def _run_fuzzer_process(
+    protocol_name: str,
+    selected_msgs: List[str],
+    validate: bool,
+    config_values: dict,
+    io_ifc: Type[BaconIOInterface],
+    device: Type[BaseDevice],
+    stop_event,
+    counters,
+    status,
+    conn,
+):
+    """
+    Entry point of a job worker process. Runs a FuzzerThread against a protocol
+    instance owned by this process and mirrors its state back to the parent.
+    """
+    thread = FuzzerThread(
+        create_protocol(protocol_name),
+        selected_msgs,
+        validate,
+        config_values,
+        io_ifc,
+        device,
+        job_ident=os.getpid(),
+    )
+    conn.send({"crash_path": thread.get_crash_path()})
+    exit_reason = ""
+    last_stats = 0.0
+
+    def sync(final=False):
+        nonlocal exit_reason, last_stats
+        counters[0] = thread.get_num_msgs_sent()
+        counters[1] = thread.get_num_crashes()
+        status.value = thread.get_status().value
+        if thread.get_exit_reason() != exit_reason:
+            exit_reason = thread.get_exit_reason()
+            conn.send({"exit_reason": exit_reason})
+        if final or monotonic() - last_stats >= 1:
+            last_stats = monotonic()
+            conn.send({"stats": thread.get_stats()})
+
+    thread.start()
+    while thread.is_alive():
+        if stop_event.is_set():
+            thread.stop()
+        thread.join(0.1)
+        sync()
+    sync(final=True)
+    conn.close()
+
+
+class FuzzerProcess:
+    """
+    Runs a fuzz job in its own worker process so Scapy generation isn't bound by the
+    GIL. Counters and status are shared memory, everything else arrives over a pipe.
+    Exposes the same interface as FuzzerThread.
+    """
+
+    def __init__(
+        self,
+        protocol_name: str,
+        selected_msgs: List[str],
+        validate: bool,
+        config_values: dict,
+        io_ifc: Type[BaconIOInterface],
+        device: Type[BaseDevice],
+    ):
+        self._stop_event = _mp.Event()
+        self._counters = _mp.Array("q", 2)
+        self._status = _mp.Value("i", TASK_STATUS.NOT_STARTED.value)
+        self._conn, child_conn = _mp.Pipe(duplex=False)
+        self._info = {"crash_path": None, "exit_reason": "", "stats": {}}
+        self.lock = threading.Lock()
+        self._process = _mp.Process(
+            target=_run_fuzzer_process,
+            args=(
+                protocol_name,
+                selected_msgs,
+                validate,
+                config_values,
+                io_ifc,
+                device,
+                self._stop_event,
+                self._counters,
+                self._status,
+                child_conn,
+            ),
+            daemon=True,
+        )
+
+    def start(self):
+        self._process.start()
+
+    def is_alive(self) -> bool:
+        return self._process.is_alive()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _poll(self):
+        with self.lock:
+            try:
+                while self._conn.poll():
+                    self._info.update(self._conn.recv())
+            except (EOFError, OSError):
+                pass
+
+    def get_crash_path(self):
+        if self._info["crash_path"] is None:
+            self._poll()
+        return self._info["crash_path"]
+
+    def get_num_crashes(self) -> int:
+        return self._counters[1]
+
+    def get_num_msgs_sent(self) -> int:
+        return self._counters[0]
+
+    def get_exit_reason(self) -> str:
+        self._poll()
+        if not self._info["exit_reason"] and self._worker_died():
+            return f"Worker process exited with code {self._process.exitcode}"
+        return self._info["exit_reason"]
+
+    def get_status(self) -> TASK_STATUS:
+        status = TASK_STATUS(self._status.value)
+        if status in (TASK_STATUS.NOT_STARTED, TASK_STATUS.RUNNING) and self._worker_died():
+            return TASK_STATUS.EXIT_UNKNOWN
+        return status
+
+    def get_stats(self) -> dict:
+        self._poll()
+        return self._info["stats"]
+
+    def _worker_died(self) -> bool:
+        return not self._process.is_alive() and self._process.exitcode is not None
+
+
+JOB_EXECUTORS = ["Process", "Thread"]
+
+
+def get_job_config_opts() -> List[ConfigItem]:
+    """
+    Helper to return the options that apply to every job regardless of protocol or interface
+    """
+    return [
+        DropDown(
+            "Executor",
+            list(JOB_EXECUTORS),
+            default="Process",
+            help_text="Run the job in its own worker process or in a thread of the UI process",
+        ),
+        IntValue(
+            "Prefetch Depth",
+            default=16,
+            required=False,
+            help_text="Messages generated ahead of the I/O stage; 0 generates inline",
+        ),
+        IntValue(
+            "Generator Threads",
+            default=1,
+            required=False,
+            help_text="Threads generating messages into the prefetch queue",
+        ),
+        DropDown(
+            "Back-pressure",
+            list(MessagePipeline.BACK_PRESSURE),
+            default="Block",
+            help_text="What generators do when the prefetch queue is full",
+        ),
+        DropDown(
+            "Frame Builder",
+            ["Compiled", "Scapy"],
+            default="Compiled",
+            help_text="Build messages from precompiled plans (falls back to Scapy per "
+            + "message) or always with Scapy",
+        ),
+        DropDown(
+            "Generation Strategy",
+            ["Random", "Enumerate", "Mutate"],
+            default="Random",
+            help_text="Sample messages at random, visit every value of each message's "
+            + "fields exactly once and finish, or mutate seed frames at the "
+            + "byte level",
+        ),
+        TextValue(
+            "Enumeration Checkpoint",
+            required=False,
+            help_text="File to resume an enumeration from and save its progress to; "
+            + "blank starts over and saves to the job's crash directory",
+        ),
+        DropDown(
+            "Scheduler",
+            list(SCHEDULERS),
+            default="Uniform",
+            help_text="How message types are chosen: equally often, favouring types "
+            + "that recently found new responses or crashes (Bandit), or "
+            + "favouring the most of those per second spent generating and "
+            + "sending (Cost-Aware)",
+        ),
+        TextValue(
+            "Seed Corpus",
+            required=False,
+            help_text="Directory of seed frames to mutate, one sub-directory per "
+            + "message (e.g. read_coils_request) with one raw frame per file",
+        ),
+        IntValue(
+            "Seeds per Message",
+            default=16,
+            required=False,
+            help_text="Frames built as seeds for each message without seeds in the "
+            + "corpus directory",
+        ),
+        IntValue(
+            "Mutation Stack",
+            default=4,
+            required=False,
+            help_text="Byte-level mutations applied to a seed, up to this many per frame",
+        ),
+        DropDown(
+            "Mutant Fix-ups",
+            ["Yes", "No"],
+            default="Yes",
+            help_text="Restore lengths, checksums and parity the protocol checks after mutating",
+        ),
+        DropDown(
+            "Response Feedback",
+            ["Auto", "Yes", "No"],
+            default="Auto",
+            help_text="Promote inputs whose responses have a new signature to seeds "
+            + "and save them to the job's corpus directory; Auto does when mutating "
+            + "seeds or with the Bandit and Cost-Aware schedulers",
+        ),
+        IntValue(
+            "Response Signature Bytes",
+            default=4,
+            required=False,
+            help_text="Leading bytes of each response body hashed into its signature "
+            + "(see Response Feedback)",
+        ),
+        DropDown(
+            "Adaptive Timeout",
+            ["Yes", "No"],
+            default="Yes",
+            help_text="Wait for each reply about as long as the target's recent round "
+            + "trips for that message type suggest (the interface's timeout "
+            + "at most), resending to confirm a miss; No always waits the "
+            + "interface's timeout once",
+        ),
+        FloatValue(
+            "Timeout Floor",
+            default=0.05,
+            required=False,
+            help_text="Shortest adaptive timeout in seconds",
+        ),
+        IntValue(
+            "Confirmation Retries",
+            default=1,
+            required=False,
+            help_text="Times an unanswered message is resent, with a doubled timeout "
+            + "each time, before it counts as a crash",
+        ),
+        DropDown(
+            "Send Mode",
+            ["Exchange", "Flood"],
+            default="Exchange",
+            help_text="Wait for the reply to every message, or write messages back to "
+            + "back without waiting and check the target is alive with a "
+            + "probe message",
+        ),
+        IntValue(
+            "Probe Every",
+            default=1000,
+            required=False,
+            help_text="Frames flooded between liveness probes; 0 probes on the "
+            + "interval only",
+        ),
+        IntValue(
+            "Probe Interval",
+            default=100,
+            required=False,
+            help_text="Milliseconds between liveness probes in flood mode; 0 probes "
+            + "every so many frames only",
+        ),
+        TextValue(
+            "Probe Frame",
+            required=False,
+            help_text="Hex bytes of the liveness probe; blank uses the protocol's own "
+            + "(needed for protocols without one)",
+        ),
+        IntValue(
+            "Flood Batch Bytes",
+            default=4096,
+            required=False,
+            help_text="Flooded frames are written to the interface once this many "
+            + "bytes are pending",
+        ),
+        IntValue(
+            "Flood Window",
+            default=1000,
+            required=False,
+            help_text="Frames sent before a failed liveness probe that are recorded "
+            + "with the crash",
+        ),
+        DropDown(
+            "Health Monitor",
+            ["Yes", "No"],
+            default="Yes",
+            help_text="Probe the target with a known-good message on a connection of "
+            + "its own in the background; a missing reply only counts as a "
+            + "crash if a probe failed after it, and recovering the target "
+            + "doesn't stall fuzzing (not available on serial ports)",
+        ),
+        IntValue(
+            "Health Probe Interval",
+            default=250,
+            required=False,
+            help_text="Milliseconds between the health monitor's probes",
+        ),
+        IntValue(
+            "Down After",
+            default=2,
+            required=False,
+            help_text="Failed probes in a row before the target counts as down; "
+            + "fuzzing pauses while it is recovered",
+        ),
+        IntValue(
+            "Flight Recorder",
+            default=32,
+            required=False,
+            help_text="Last messages sent (with when, and the start of their replies) "
+            + "stored with each crash, to find a trigger sent before the "
+            + "message that went unanswered; 0 turns the recorder off. Flood "
+            + "mode records its own window instead (see Flood Window)",
+        ),
+        DropDown(
+            "Record Traffic",
+            ["No", "Yes"],
+            default="No",
+            help_text="Append every frame sent and reply received to traffic.bin in "
+            + "the job's crash directory, a compact binary record file "
+            + "(bacon-records converts it to JSON or pcap)",
+        ),
+        IntValue(
+            "Builder Self-check",
+            default=64,
+            required=False,
+            help_text="Random frames each compiled plan must reproduce byte for byte "
+            + "against Scapy; 0 skips the check",
+        ),
+    ]
+
 
 class Fuzzer:
     def __init__(self):
@@ -209,6 +940,16 @@ class Fuzzer:
     def get_exit_reason(self, job_id) -> str:
         return self._threads[job_id].get_exit_reason()
 
+    def get_stats(self, job_id: int) -> dict:
+        return self._threads[job_id].get_stats()
+
+    def get_crash_path(self, job_id: int) -> Optional[str]:
+        """
+        :returns: The job's crash directory, which also identifies its crashes in
+        the crash store; None until a job's worker process reports it
+        """
+        return self._threads[job_id].get_crash_path()
+
     def start_job(
         self,
         protocol_name: str,
@@ -221,12 +962,21 @@ class Fuzzer:
         """
         Fuzz the specified protocol
         """
-        protocol = PROTOCOLS[protocol_name]
         job_id = len(self._threads)
         log.info(f"Starting job for protocol {protocol_name} with ID {job_id}")
-        thread = FuzzerThread(
-            protocol, selected_msgs, validate, config_values, io_ifc, device
-        )
+        if config_values.get("Executor") == "Thread":
+            thread = FuzzerThread(
+                create_protocol(protocol_name),
+                selected_msgs,
+                validate,
+                config_values,
+                io_ifc,
+                device,
+            )
+        else:
+            thread = FuzzerProcess(
+                protocol_name, selected_msgs, validate, config_values, io_ifc, device
+            )
         thread.start()
         self._threads.append(thread)
         return job_id
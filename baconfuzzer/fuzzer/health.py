@@ -0,0 +1,237 @@
+"""
+Target health monitor: a thread per job probes the target with a known-good
+message on an interface (connection) of its own and keeps its state: up,
+degraded (probes failing) or down (failing for several probes in a row). A
+missing reply on the fuzzing interface is only a crash candidate; it is
+confirmed if a probe failed after the message was sent, and discarded if the
+target kept answering probes. Recovering a target that is down runs on the
+monitor's thread, so the fuzz loop never stalls in a device's handler.
+"""
+import logging
+import threading
+from enum import Enum
+from time import monotonic
+from typing import Callable, List, NamedTuple, Optional
+
+from ..devices import BaseDevice
+from ..message_formats import Protocol
+
+log = logging.getLogger(__name__)
+
+
+class TargetState(Enum):
+    UP = "up"
+    DEGRADED = "degraded"
+    DOWN = "down"
+
+
+class _Candidate(NamedTuple):
+    # when the unanswered message was sent and reported missing
+    sent: float
+    reported: float
+    # records the crash once it is confirmed
+    record: Callable[[], None]
+
+
+class HealthMonitor(threading.Thread):
+    def __init__(
+        self,
+        protocol: Protocol,
+        io_interface,
+        device: BaseDevice,
+        config_values: dict,
+        probe_msg: Optional[bytes] = None,
+        interval=0.25,
+        down_after=2,
+        on_crash: Optional[Callable[[], None]] = None,
+    ):
+        """
+        :param io_interface: A configured interface of the monitor's own, whose
+        device doesn't recover the target: a recovery inside a probe would hide
+        the failure from it
+        :param device: Recovers the target when it goes down
+        :param probe_msg: Raw probe; None asks the protocol for one every probe
+        :param interval: Seconds between probes
+        :param down_after: Failed probes in a row before the target is down
+        :param on_crash: Called for every confirmed crash
+        """
+        super().__init__(name="health-monitor", daemon=True)
+        self.protocol = protocol
+        self.io_interface = io_interface
+        self.device = device
+        self.config_values = config_values
+        self.probe_msg = probe_msg
+        self.interval = interval
+        self.down_after = max(1, down_after)
+        self.on_crash = on_crash
+        self.last_probe_msg = probe_msg
+        self.state = TargetState.UP
+        self._lock = threading.Lock()
+        self._state_changed = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._stopping = False
+        self._failures = 0
+        # when the last failed probe ended
+        self._last_failure = float("-inf")
+        self._candidates: List[_Candidate] = []
+        self._num_probes = 0
+        self._num_failed = 0
+        self._num_changes = 0
+        self._num_confirmed = 0
+        self._num_discarded = 0
+        self._down_since: Optional[float] = None
+        self._time_down = 0.0
+
+    def run(self):
+        while not self._stopping:
+            self._probe()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+        # settles the candidates reported before stop()
+        self._probe()
+
+    def stop(self):
+        """
+        Probe once more to settle the outstanding crash candidates, and stop
+        """
+        self._stopping = True
+        self._wake.set()
+        if self.is_alive():
+            self.join()
+
+    def poke(self):
+        """
+        Probe now rather than at the next interval (e.g. after an I/O error)
+        """
+        self._wake.set()
+
+    def report(self, sent: float, record: Callable[[], None]):
+        """
+        A message sent at `sent` went unanswered; record(s) it if the target
+        turns out to have failed since
+        """
+        with self._lock:
+            self._candidates.append(_Candidate(sent, monotonic(), record))
+        self.poke()
+
+    def failed_since(self, since: float) -> bool:
+        """
+        :returns: True if a probe failed after `since`
+        """
+        with self._lock:
+            return self._last_failure >= since
+
+    def wait_until_up(self, timeout: float) -> bool:
+        """
+        Wait (up to timeout seconds) while the target is down
+        :returns: True unless the target is still down
+        """
+        with self._state_changed:
+            if self.state is TargetState.DOWN:
+                self._state_changed.wait(timeout)
+            return self.state is not TargetState.DOWN
+
+    def _probe(self):
+        started = monotonic()
+        try:
+            probe_msg = self.probe_msg
+            if probe_msg is None:
+                probe_msg = self.protocol.get_probe_msg(
+                    self.config_values, self.io_interface
+                )
+            self.last_probe_msg = probe_msg
+            alive = self.protocol.probe(
+                probe_msg, self.config_values, self.io_interface
+            )
+        except Exception:
+            log.exception("Liveness probe failed")
+            alive = False
+        ended = monotonic()
+        with self._lock:
+            self._num_probes += 1
+            if alive:
+                self._failures = 0
+                state = TargetState.UP
+            else:
+                self._num_failed += 1
+                self._failures += 1
+                self._last_failure = ended
+                state = (
+                    TargetState.DOWN
+                    if self._failures >= self.down_after
+                    else TargetState.DEGRADED
+                )
+            went_down = self._set_state(state, ended)
+            # candidates reported before this probe started are settled by it
+            settled = [c for c in self._candidates if c.reported <= started]
+            self._candidates = [c for c in self._candidates if c.reported > started]
+            confirmed = [c for c in settled if self._last_failure >= c.sent]
+            self._num_confirmed += len(confirmed)
+            self._num_discarded += len(settled) - len(confirmed)
+        if len(settled) > len(confirmed):
+            log.info(
+                f"Discarded {len(settled) - len(confirmed)} crash candidates, "
+                + "the target kept answering probes"
+            )
+        for candidate in confirmed:
+            candidate.record()
+            if self.on_crash is not None:
+                self.on_crash()
+        if went_down:
+            log.warning("Target down, recovering it")
+            try:
+                self.device.handle_io_exception(
+                    self.io_interface,
+                    ConnectionError("Target not answering liveness probes"),
+                )
+            except Exception:
+                log.exception("Recovering the target failed")
+
+    def _set_state(self, state: TargetState, now: float) -> bool:
+        """
+        :returns: True if the target just went down
+        """
+        if state is self.state:
+            return False
+        log.info(f"Target {self.state.value} -> {state.value}")
+        if self.state is TargetState.DOWN:
+            self._time_down += now - self._down_since
+            self._down_since = None
+        elif state is TargetState.DOWN:
+            self._down_since = now
+        self.state = state
+        self._num_changes += 1
+        self._state_changed.notify_all()
+        return state is TargetState.DOWN
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            time_down = self._time_down
+            if self._down_since is not None:
+                time_down += monotonic() - self._down_since
+            return {
+                "state": self.state.value,
+                "state changes": self._num_changes,
+                "probes": self._num_probes,
+                "failed probes": self._num_failed,
+                "confirmed crashes": self._num_confirmed,
+                "discarded candidates": self._num_discarded,
+                "pending candidates": len(self._candidates),
+                "time down (s)": round(time_down, 1),
+            }
+
+
+class MonitoredDevice(BaseDevice):
+    """
+    Device of the fuzzing interface while a health monitor runs: I/O errors only
+    make the monitor probe right away, and the monitor recovers the target if it
+    is down
+    """
+
+    def __init__(self, monitor: HealthMonitor):
+        super().__init__()
+        self.monitor = monitor
+
+    def handle_io_exception(self, io_ifc, ex: Exception):
+        log.debug(f"I/O error on the fuzzing interface: {ex}")
+        self.monitor.poke()
@@ -0,0 +1,326 @@
+"""
+Mutation-based generation: raw seed frames are mutated at the byte level in a
+reusable buffer, then the protocol fixes up the fields a mutation breaks (lengths,
+checksums, parity) with Protocol.fix_raw.
+"""
+import logging
+import random
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from scapy.packet import Packet, Raw
+
+from ..message_formats import Protocol
+from ..message_formats.compiler import LazyPacket
+
+log = logging.getLogger(__name__)
+
+INTERESTING_8 = (-128, -1, 0, 1, 16, 32, 64, 100, 127)
+INTERESTING_16 = INTERESTING_8 + (
+    -32768,
+    -129,
+    128,
+    255,
+    256,
+    512,
+    1000,
+    1024,
+    4096,
+    32767,
+)
+# largest value added to or subtracted from a byte or short
+ARITH_MAX = 35
+MAX_EXTEND = 16
+
+
+def corpus_dir_name(msg_name: str) -> str:
+    """
+    Name of the corpus sub-directory holding the seeds of a message
+    """
+    return msg_name.lower().replace(" ", "_")
+
+
+class SeedCorpus:
+    """
+    Raw seed frames of each message, picked in proportion to their weight. A
+    corpus directory holds one sub-directory per message (see corpus_dir_name)
+    with one frame per file.
+    """
+
+    def __init__(self):
+        self._seeds: Dict[str, List[bytes]] = {}
+        # cumulative weights, parallel to _seeds
+        self._cum_weights: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, msg_name: str, raw_msg: bytes, weight=1.0):
+        with self._lock:
+            cum_weights = self._cum_weights.setdefault(msg_name, [])
+            cum_weights.append((cum_weights[-1] if cum_weights else 0) + weight)
+            self._seeds.setdefault(msg_name, []).append(bytes(raw_msg))
+
+    def load_dir(self, path, msg_names: List[str]) -> int:
+        """
+        Add the seeds of the given messages found in a corpus directory
+        :returns: Number of seeds loaded
+        """
+        loaded = 0
+        for msg_name in msg_names:
+            msg_dir = Path(path) / corpus_dir_name(msg_name)
+            if not msg_dir.is_dir():
+                continue
+            for seed_file in sorted(msg_dir.iterdir()):
+                if seed_file.is_file() and seed_file.stat().st_size:
+                    self.add(msg_name, seed_file.read_bytes())
+                    loaded += 1
+        return loaded
+
+    def count(self, msg_name: Optional[str] = None) -> int:
+        with self._lock:
+            if msg_name is not None:
+                return len(self._seeds.get(msg_name, ()))
+            return sum(len(seeds) for seeds in self._seeds.values())
+
+    def msg_names(self) -> List[str]:
+        with self._lock:
+            return [name for name, seeds in self._seeds.items() if seeds]
+
+    def choice(self, msg_name: str) -> bytes:
+        with self._lock:
+            seeds = self._seeds[msg_name]
+            return random.choices(seeds, cum_weights=self._cum_weights[msg_name])[0]
+
+
+class Mutator:
+    """
+    Applies a stack of random byte-level mutations to a copy of a seed frame in a
+    buffer allocated once. Not thread-safe; use one per generator thread.
+    """
+
+    def __init__(self, max_size=1024, rng: Optional[random.Random] = None):
+        self.max_size = max_size
+        self._buf = bytearray(max_size)
+        self._rng = rng or random.Random()
+        self._ops = (
+            self._flip_bit,
+            self._flip_bit,
+            self._arith_8,
+            self._arith_16,
+            self._interesting_8,
+            self._interesting_16,
+            self._random_byte,
+            self._splice,
+            self._truncate,
+            self._extend,
+        )
+
+    def mutate(self, seed: bytes, other: Optional[bytes] = None, stack=4) -> memoryview:
+        """
+        :param other: Seed to splice with; None splices the seed with itself
+        :param stack: Mutations are applied 1 to stack times
+        :returns: A view of the mutated frame in the buffer, valid until the next call
+        """
+        n = min(len(seed), self.max_size)
+        self._buf[:n] = seed[:n]
+        self._other = seed if other is None else other
+        choice = self._rng.choice
+        for _ in range(self._rng.randint(1, max(1, stack))):
+            n = choice(self._ops)(n)
+        return memoryview(self._buf)[:n]
+
+    def _pos(self, n: int, width=1) -> int:
+        return self._rng.randrange(n - width + 1)
+
+    def _flip_bit(self, n: int) -> int:
+        if n:
+            self._buf[self._pos(n)] ^= 1 << self._rng.randrange(8)
+        return n
+
+    def _arith_8(self, n: int) -> int:
+        if n:
+            i = self._pos(n)
+            delta = self._rng.randint(1, ARITH_MAX)
+            self._buf[i] = (self._buf[i] + self._rng.choice((delta, -delta))) & 0xFF
+        return n
+
+    def _arith_16(self, n: int) -> int:
+        if n >= 2:
+            i = self._pos(n, 2)
+            fmt = self._rng.choice((">H", "<H"))
+            delta = self._rng.randint(1, ARITH_MAX)
+            value = struct.unpack_from(fmt, self._buf, i)[0]
+            value += self._rng.choice((delta, -delta))
+            struct.pack_into(fmt, self._buf, i, value & 0xFFFF)
+        return n
+
+    def _interesting_8(self, n: int) -> int:
+        if n:
+            self._buf[self._pos(n)] = self._rng.choice(INTERESTING_8) & 0xFF
+        return n
+
+    def _interesting_16(self, n: int) -> int:
+        if n >= 2:
+            fmt = self._rng.choice((">H", "<H"))
+            value = self._rng.choice(INTERESTING_16) & 0xFFFF
+            struct.pack_into(fmt, self._buf, self._pos(n, 2), value)
+        return n
+
+    def _random_byte(self, n: int) -> int:
+        if n:
+            self._buf[self._pos(n)] = self._rng.getrandbits(8)
+        return n
+
+    def _splice(self, n: int) -> int:
+        """
+        Keep a prefix of the frame and continue it with a suffix of the other seed
+        """
+        other = self._other
+        if not n or not other:
+            return n
+        cut = self._pos(n)
+        start = self._rng.randrange(len(other))
+        tail = other[start : start + self.max_size - cut]
+        self._buf[cut : cut + len(tail)] = tail
+        return cut + len(tail)
+
+    def _truncate(self, n: int) -> int:
+        return self._rng.randint(1, n - 1) if n > 1 else n
+
+    def _extend(self, n: int) -> int:
+        count = min(self._rng.randint(1, MAX_EXTEND), self.max_size - n)
+        if count > 0:
+            self._buf[n : n + count] = self._rng.getrandbits(8 * count).to_bytes(
+                count, "big"
+            )
+        return n + max(count, 0)
+
+
+class MutationEngine:
+    """
+    Generates a job's messages by mutating seed frames: the job's corpus directory,
+    plus frames built by the protocol for messages the corpus has no seeds for.
+    """
+
+    def __init__(
+        self,
+        protocol: Protocol,
+        corpus: SeedCorpus,
+        packet_classes: Dict[str, type],
+        config_values: dict,
+        io_interface,
+        stack=4,
+        fix_up=True,
+    ):
+        self.protocol = protocol
+        self.corpus = corpus
+        self.msg_names = corpus.msg_names()
+        if not self.msg_names:
+            raise ValueError("No seeds to mutate")
+        self._packet_classes = packet_classes
+        self.config_values = config_values
+        self.io_interface = io_interface
+        self.stack = stack
+        self.fix_up = fix_up
+        self._validates = True
+        # mutators are reused, one per generator thread
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._num_mutants = 0
+        self._num_rejected = 0
+
+    @classmethod
+    def create(
+        cls,
+        protocol: Protocol,
+        msg_names: List[str],
+        validate: bool,
+        config_values: dict,
+        io_interface,
+        stop_flag,
+        corpus_dir=None,
+        seeds_per_msg=16,
+        **kwargs,
+    ) -> "MutationEngine":
+        """
+        Load the corpus directory (if any) and build seeds for the messages it has
+        none for
+        """
+        corpus = SeedCorpus()
+        if corpus_dir:
+            loaded = corpus.load_dir(corpus_dir, msg_names)
+            log.info(f"Loaded {loaded} seeds from {corpus_dir}")
+        packet_classes = {}
+        for msg_name in msg_names:
+            from_dir = corpus.count(msg_name)
+            # a built example also tells the message's packet class
+            for _ in range(1 if from_dir else max(1, seeds_per_msg)):
+                built = protocol.build_msg(
+                    msg_name, validate, config_values, io_interface, stop_flag
+                )
+                if built is None:
+                    break
+                msg, raw_msg = built
+                packet_classes[msg_name] = (
+                    msg.packet_class if isinstance(msg, LazyPacket) else type(msg)
+                )
+                if not from_dir:
+                    corpus.add(msg_name, raw_msg)
+        return cls(
+            protocol, corpus, packet_classes, config_values, io_interface, **kwargs
+        )
+
+    def _mutator(self) -> Mutator:
+        mutator = getattr(self._local, "mutator", None)
+        if mutator is None:
+            mutator = self._local.mutator = Mutator()
+        return mutator
+
+    def mutate(self, msg_name: str) -> bytes:
+        """
+        :returns: A mutant of a random seed of the message, fixed up unless disabled
+        """
+        frame = self._mutator().mutate(
+            self.corpus.choice(msg_name),
+            self.corpus.choice(random.choice(self.msg_names)),
+            self.stack,
+        )
+        if self.fix_up:
+            self.protocol.fix_raw(frame, self.config_values, self.io_interface)
+        return bytes(frame)
+
+    def build_msg(
+        self, msg_name: str, validate: bool, stop_flag
+    ) -> Optional[Tuple[Packet, bytes]]:
+        """
+        Like Protocol.build_msg, mutating seeds instead of fuzzing the template
+        :returns: The message and its raw bytes; None if interrupted by stop_flag
+        """
+        while not stop_flag():
+            raw_msg = self.mutate(msg_name)
+            with self._lock:
+                self._num_mutants += 1
+            if validate and self._validates:
+                try:
+                    valid = self.protocol.validate_msg(raw_msg, self.io_interface)
+                except NotImplementedError:
+                    # the protocol doesn't validate, so its build_msg ignores validate
+                    self._validates = False
+                    valid = True
+                if not valid:
+                    with self._lock:
+                        self._num_rejected += 1
+                    continue
+            packet_class = self._packet_classes.get(msg_name, Raw)
+            return LazyPacket(packet_class, raw_msg), raw_msg
+        return None
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "seeds": self.corpus.count(),
+                "mutants": self._num_mutants,
+                "rejected (invalid)": self._num_rejected,
+            }
+
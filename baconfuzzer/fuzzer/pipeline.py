@@ -0,0 +1,151 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+from scapy.packet import Packet
+
+log = logging.getLogger(__name__)
+
+
+class FuzzedFrame:
+    """
+    A generated message waiting to be sent, plus the metadata needed to send and log it
+    """
+
+    __slots__ = ("msg_name", "msg", "raw_msg", "created", "index")
+
+    def __init__(self, msg_name: str, msg: Packet, raw_msg: bytes, index=None):
+        self.msg_name = msg_name
+        self.msg = msg
+        self.raw_msg = raw_msg
+        self.created = time.monotonic()
+        # position in the enumeration, if enumerating
+        self.index = index
+
+
+class MessagePipeline:
+    """
+    Bounded prefetch queue between message generation and I/O.
+    Generator threads run the protocol's build (and validate) path ahead of time
+    while the I/O stage is blocked waiting on the target, and the I/O stage just
+    drains the queue. Queue occupancy tells whether a job is generation-bound
+    (queue mostly empty) or link-bound (queue mostly full).
+    """
+
+    BACK_PRESSURE = ["Block", "Drop Oldest"]
+
+    def __init__(
+        self,
+        generate: Callable[[], Optional[FuzzedFrame]],
+        stop_flag: Callable[[], bool],
+        depth=16,
+        producers=1,
+        back_pressure="Block",
+    ):
+        if back_pressure not in self.BACK_PRESSURE:
+            raise ValueError(f"Unknown back-pressure policy {back_pressure}")
+        self._generate = generate
+        self._stop_flag = stop_flag
+        self._queue = queue.Queue(maxsize=depth)
+        self.depth = depth
+        self.back_pressure = back_pressure
+        self._threads: List[threading.Thread] = [
+            threading.Thread(target=self._produce, daemon=True) for _ in range(producers)
+        ]
+        self._error: Optional[Exception] = None
+        self._lock = threading.Lock()
+        self._occupancy_sum = 0
+        self._num_gets = 0
+        self._num_empty = 0
+        self._num_full = 0
+        self._num_dropped = 0
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _stopping(self) -> bool:
+        return self._error is not None or self._stop_flag()
+
+    def _produce(self):
+        try:
+            while not self._stopping():
+                frame = self._generate()
+                if frame is not None:
+                    self._put(frame)
+        except Exception as e:
+            log.exception("Message generator failed")
+            self._error = e
+
+    def _put(self, frame: FuzzedFrame):
+        if self.back_pressure == "Drop Oldest":
+            while True:
+                try:
+                    self._queue.put_nowait(frame)
+                    return
+                except queue.Full:
+                    with self._lock:
+                        self._num_full += 1
+                try:
+                    self._queue.get_nowait()
+                    with self._lock:
+                        self._num_dropped += 1
+                except queue.Empty:
+                    pass
+        if self._queue.full():
+            with self._lock:
+                self._num_full += 1
+        while not self._stopping():
+            try:
+                self._queue.put(frame, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(self) -> Optional[FuzzedFrame]:
+        """
+        Get the next frame to send. Blocks until one is ready.
+        :returns: The next frame; None if the job is stopping
+        """
+        occupancy = self._queue.qsize()
+        with self._lock:
+            self._occupancy_sum += occupancy
+            self._num_gets += 1
+            if occupancy == 0:
+                self._num_empty += 1
+        while True:
+            if self._error is not None:
+                raise self._error
+            if self._stop_flag():
+                return None
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            gets = max(self._num_gets, 1)
+            mean_occupancy = self._occupancy_sum / gets
+            fill = mean_occupancy / self.depth
+            if fill < 0.25:
+                bound = "generation-bound"
+            elif fill > 0.75:
+                bound = "link-bound"
+            else:
+                bound = "balanced"
+            return {
+                "depth": self.depth,
+                "generators": len(self._threads),
+                "mean occupancy": round(mean_occupancy, 2),
+                "empty on get (%)": round(100 * self._num_empty / gets, 1),
+                "full on put": self._num_full,
+                "dropped": self._num_dropped,
+                "bound": bound,
+            }
@@ -0,0 +1,178 @@
+"""
+Message type schedulers: choose the type of each fuzzed message, optionally
+learning from what each type costs (generation time, round trip) and yields
+(crashes, responses with a new signature).
+"""
+import random
+import threading
+from typing import Dict, List, Type
+
+
+class Scheduler:
+    """
+    Chooses the type of each message. choose() is called by the generator threads,
+    the record_* methods by the job, so policies can learn from them.
+    """
+
+    name = ""
+
+    # reward of a response with a new signature, and of a crash candidate
+    NOVELTY_REWARD = 1.0
+    CRASH_REWARD = 4.0
+    # reward/count decay per response, so types that stopped yielding fade out
+    DISCOUNT = 0.999
+    # share of the choices spread evenly over all types
+    EXPLORATION = 0.05
+    # weight of the latest sample in the cost averages
+    COST_ALPHA = 0.1
+
+    def __init__(self, msg_names: List[str]):
+        if not msg_names:
+            raise ValueError("No message types to schedule")
+        self.msg_names = list(msg_names)
+        self._lock = threading.Lock()
+        # discounted number of responses and reward of each type
+        self._counts = {name: 0.0 for name in self.msg_names}
+        self._rewards = {name: 0.0 for name in self.msg_names}
+        # moving averages of seconds spent generating and waiting for a reply,
+        # and of the share of messages without a reply
+        self._gen_time: Dict[str, float] = {}
+        self._rtt: Dict[str, float] = {}
+        self._miss_rate: Dict[str, float] = {}
+
+    def choose(self) -> str:
+        raise NotImplementedError()
+
+    def weights(self) -> Dict[str, float]:
+        """
+        :returns: The probability of choosing each type
+        """
+        raise NotImplementedError()
+
+    def record_generation(self, msg_name: str, seconds: float):
+        """
+        Time taken to generate (and validate) a message of the type
+        """
+        with self._lock:
+            self._gen_time[msg_name] = self._average(
+                self._gen_time.get(msg_name), seconds
+            )
+
+    def record_response(
+        self, msg_name: str, latency: float, crashed: bool, novel: bool
+    ):
+        """
+        Outcome of sending a message of the type
+        :param crashed: No (acceptable) reply
+        :param novel: The reply had a signature not seen before
+        """
+        with self._lock:
+            for name in self.msg_names:
+                self._counts[name] *= self.DISCOUNT
+                self._rewards[name] *= self.DISCOUNT
+            if msg_name not in self._counts:
+                return
+            # a miss is only worth as much as it is unusual for the type; a type
+            # that always times out isn't finding new crashes
+            miss_rate = self._miss_rate.get(msg_name, 0.0)
+            reward = self.NOVELTY_REWARD * novel
+            reward += self.CRASH_REWARD * crashed * (1 - miss_rate)
+            self._counts[msg_name] += 1
+            self._rewards[msg_name] += reward
+            self._rtt[msg_name] = self._average(self._rtt.get(msg_name), latency)
+            self._miss_rate[msg_name] = self._average(miss_rate, float(crashed))
+
+    def _average(self, average, sample: float) -> float:
+        if average is None:
+            return sample
+        return average + self.COST_ALPHA * (sample - average)
+
+    def get_stats(self) -> dict:
+        return {
+            name: round(100 * weight, 1) for name, weight in self.weights().items()
+        }
+
+
+class UniformScheduler(Scheduler):
+    """
+    Every type equally often
+    """
+
+    name = "Uniform"
+
+    def choose(self) -> str:
+        return random.choice(self.msg_names)
+
+    def weights(self) -> Dict[str, float]:
+        return {name: 1 / len(self.msg_names) for name in self.msg_names}
+
+
+class WeightedScheduler(Scheduler):
+    """
+    Chooses types in proportion to scores(), mixed with uniform exploration
+    """
+
+    def scores(self) -> Dict[str, float]:
+        raise NotImplementedError()
+
+    def weights(self) -> Dict[str, float]:
+        with self._lock:
+            scores = self.scores()
+        total = sum(scores.values())
+        share = 1 / len(self.msg_names)
+        if total <= 0:
+            return {name: share for name in self.msg_names}
+        return {
+            name: self.EXPLORATION * share + (1 - self.EXPLORATION) * score / total
+            for name, score in scores.items()
+        }
+
+    def choose(self) -> str:
+        weights = self.weights()
+        return random.choices(list(weights), list(weights.values()))[0]
+
+    def _mean_reward(self, msg_name: str) -> float:
+        # optimistic prior: a type that hasn't been tried is worth trying
+        return (1 + self._rewards[msg_name]) / (1 + self._counts[msg_name])
+
+
+class BanditScheduler(WeightedScheduler):
+    """
+    Multi-armed bandit: favours the types whose recent messages found new
+    responses or crashes
+    """
+
+    name = "Bandit"
+
+    def scores(self) -> Dict[str, float]:
+        return {name: self._mean_reward(name) for name in self.msg_names}
+
+
+class CostAwareScheduler(WeightedScheduler):
+    """
+    Favours the types with the most reward per second spent on them, so types
+    that are expensive to generate (e.g. validation rejection loops) or that
+    keep timing out get less of the link
+    """
+
+    name = "Cost-Aware"
+
+    MIN_COST = 1e-4
+
+    def scores(self) -> Dict[str, float]:
+        costs = {
+            name: self._gen_time.get(name, 0) + self._rtt.get(name, 0)
+            for name in self.msg_names
+        }
+        known = [cost for cost in costs.values() if cost]
+        # types without measurements yet are assumed to cost the average
+        default = sum(known) / len(known) if known else 1
+        return {
+            name: self._mean_reward(name) / max(costs[name] or default, self.MIN_COST)
+            for name in self.msg_names
+        }
+
+
+SCHEDULERS: Dict[str, Type[Scheduler]] = {
+    cls.name: cls for cls in (UniformScheduler, BanditScheduler, CostAwareScheduler)
+}
@@ -1,7 +1,19 @@
+from .async_socket import BaconAsyncSocketIO
 from .io_handler import BaconSerialIO, BaconSocketIO
+from .udp import BaconUDPIO
 
 
 IOINTERFACES = {
     "TCP Socket": BaconSocketIO,
+    "Async TCP Socket": BaconAsyncSocketIO,
+    "UDP Socket": BaconUDPIO,
     "Serial": BaconSerialIO,
 }
+
+
+def get_protocol_interface(io_interface_name: str) -> str:
+    """
+    Name of the interface protocols build and configure messages for when
+    fuzzing over the given one
+    """
+    return IOINTERFACES[io_interface_name].protocol_interface or io_interface_name
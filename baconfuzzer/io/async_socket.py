@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import queue
+import socket
+import threading
+from time import monotonic
+from typing import List, NamedTuple, Optional
+
+from ..message_formats.config import IntValue
+from .io_handler import BaconIOInterface, Exchange
+from .rtt import AdaptiveTimeout
+
+log = logging.getLogger(__name__)
+
+
+class _Submission(NamedTuple):
+    msg_name: str
+    msg: object
+    raw_msg: bytes
+    timeouts: Optional[AdaptiveTimeout]
+
+
+class BaconAsyncSocketIO(BaconIOInterface):
+    """
+    Asyncio socket interface: an event loop thread drives many concurrent TCP
+    sessions (connections) to the target, each exchanging one message at a time
+    with its own timeout. Messages are submitted without waiting for their reply
+    (see submit()), so one job keeps every session busy. Protocols see it as a
+    "TCP Socket", so messages are built and framed as for one.
+    """
+
+    concurrent = True
+    protocol_interface = "TCP Socket"
+
+    def __init__(self, config, device):
+        super().__init__(config, "Async TCP Socket", device)
+        log.info("async socket")
+        self.ip = None
+        self.port = None
+        self.timeout = 5
+        self.num_sessions = 100
+        # messages per connection before a session reconnects; 0 keeps it open
+        self.reconnect_after = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._submissions: Optional[asyncio.Queue] = None
+        self._results: "queue.Queue[Exchange]" = queue.Queue()
+        # submitted messages whose outcome isn't known yet, at most one per session
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._handling_exception = False
+
+    @property
+    def keep_alive(self) -> bool:
+        # no dedicated connections to hand out (see BaconSocketIO)
+        return False
+
+    def configure(self, opts: dict):
+        self.ip, self.port = self._get_io_config("Destination IP", "Destination Port")
+        self.timeout = self._config.get("timeout", 5)
+        self.num_sessions = max(1, self._config.get("Concurrent Sessions") or 100)
+        self.reconnect_after = self._config.get("Messages per Connection") or 0
+        self.teardown()
+        # Test connection
+        with socket.create_connection((self.ip, self.port), timeout=self.timeout):
+            pass
+        self._slots = threading.BoundedSemaphore(self.num_sessions)
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run_loop, args=(started,), name="async-io", daemon=True
+        )
+        self._thread.start()
+        started.wait()
+
+    def teardown(self):
+        if self._loop is None:
+            return
+        for _ in range(self.num_sessions):
+            self._loop.call_soon_threadsafe(self._submissions.put_nowait, None)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+
+    def _run_loop(self, started: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        # created in the loop, as Python < 3.10 binds queues to the current loop
+        self._submissions = asyncio.Queue()
+        sessions = [self._session() for _ in range(self.num_sessions)]
+        self._loop.call_soon(started.set)
+        self._loop.run_until_complete(asyncio.gather(*sessions))
+
+    def submit(
+        self,
+        msg_name: str,
+        msg,
+        raw_msg: bytes,
+        timeouts: Optional[AdaptiveTimeout] = None,
+    ) -> List[Exchange]:
+        """
+        Hand a message to the next free session without waiting for its reply,
+        blocking while every session is busy.
+        :param timeouts: The job's adaptive timeouts; None waits self.timeout once
+        :returns: The exchanges completed since the last call
+        """
+        completed = []
+        # results release slots, so collect them while waiting for one
+        while not self._slots.acquire(timeout=0.05):
+            completed += self.completed()
+            if self._loop is None or not self._thread.is_alive():
+                raise ConnectionError("Async socket interface isn't running")
+        self._loop.call_soon_threadsafe(
+            self._submissions.put_nowait,
+            _Submission(msg_name, msg, bytes(raw_msg), timeouts),
+        )
+        return completed + self.completed()
+
+    def finish(self) -> List[Exchange]:
+        """
+        Wait until no session has a message in flight
+        :returns: The exchanges completed since the last call
+        """
+        completed = []
+        if self._loop is None:
+            return completed
+        # every slot free means every result is in
+        held = 0
+        while held < self.num_sessions:
+            if self._slots.acquire(timeout=0.05):
+                held += 1
+                continue
+            completed += self.completed()
+            if not self._thread.is_alive():
+                break
+        for _ in range(held):
+            self._slots.release()
+        return completed + self.completed()
+
+    def completed(self) -> List[Exchange]:
+        """
+        :returns: The exchanges completed since the last call, without waiting
+        """
+        completed = []
+        while True:
+            try:
+                completed.append(self._results.get_nowait())
+            except queue.Empty:
+                return completed
+
+    async def _session(self):
+        reader = writer = None
+        sent = 0
+        while True:
+            submission = await self._submissions.get()
+            if submission is None:
+                break
+            reply, latency, reusable = None, 0.0, False
+            try:
+                if writer is None or (
+                    self.reconnect_after and sent >= self.reconnect_after
+                ):
+                    self._close(writer)
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.ip, self.port), self.timeout
+                    )
+                    sent = 0
+                reply, latency, reusable = await self._exchange(
+                    reader, writer, submission
+                )
+                sent += 1
+            except (OSError, asyncio.TimeoutError) as ex:
+                self._handle_exception(ex)
+            except Exception:
+                # reported as unanswered; the session and its slot carry on
+                log.exception(f"Async exchange of {submission.msg_name} failed")
+            if not reusable:
+                self._close(writer)
+                reader = writer = None
+            self._results.put(Exchange(*submission[:3], reply, latency))
+            self._slots.release()
+        self._close(writer)
+
+    async def _exchange(self, reader, writer, submission: _Submission):
+        """
+        Send a message and wait for the reply, resending it to confirm a miss as
+        Protocol.send_msg does
+        :returns: The reply, the seconds waited for it and whether the connection
+        can be reused
+        """
+        msg_name, _, raw_msg, timeouts = submission
+        attempts = 1 + (timeouts.retries if timeouts is not None else 0)
+        for attempt in range(attempts):
+            timeout = (
+                self.timeout
+                if timeouts is None
+                else timeouts.timeout(msg_name, attempt)
+            )
+            sent = monotonic()
+            writer.write(raw_msg)
+            await writer.drain()
+            try:
+                reply = await asyncio.wait_for(self._read_frame(reader), timeout)
+            except asyncio.TimeoutError:
+                continue
+            latency = monotonic() - sent
+            if timeouts is not None:
+                timeouts.answered(msg_name, latency, attempt)
+            # after a resend the other reply may still arrive and would be taken
+            # for the next message's
+            return reply, latency, bool(reply) and not attempt
+        if timeouts is not None:
+            timeouts.missed(msg_name)
+        return None, monotonic() - sent, False
+
+    async def _read_frame(self, reader: asyncio.StreamReader) -> bytes:
+        if self.framer is None:
+            return await reader.read(65536)
+        data = bytearray()
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                return bytes(data)
+            data += chunk
+            length = self.framer.frame_length(data)
+            if length is not None:
+                return bytes(data[:length])
+
+    def _handle_exception(self, ex: Exception):
+        # the device handler may block (e.g. restart the target); sessions failing
+        # at the same time share one call
+        if self._handling_exception:
+            return
+        self._handling_exception = True
+
+        def handle():
+            try:
+                self.device.handle_io_exception(self, ex)
+            finally:
+                self._handling_exception = False
+
+        self._loop.run_in_executor(None, handle)
+
+    @staticmethod
+    def _close(writer: Optional[asyncio.StreamWriter]):
+        if writer is not None:
+            writer.close()
+
+    def transmit(self, msg, wait_for_reply=True, timeout=None) -> Optional[bytes]:
+        """
+        Exchange a single message on a connection of its own, waiting for the reply
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self._transmit_once(bytes(msg), wait_for_reply, timeout), self._loop
+        )
+        return future.result()
+
+    async def _transmit_once(self, msg, wait_for_reply, timeout) -> Optional[bytes]:
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip, self.port), self.timeout
+            )
+            writer.write(msg)
+            await writer.drain()
+            if not wait_for_reply:
+                return None
+            return await asyncio.wait_for(
+                self._read_frame(reader),
+                self.timeout if timeout is None else timeout,
+            )
+        except asyncio.TimeoutError:
+            return None
+        except OSError as ex:
+            self._handle_exception(ex)
+            return None
+        finally:
+            self._close(writer)
+
+    @staticmethod
+    def get_config_opts(selected_msgs, protocol) -> list:
+        """
+        Helper to return the options for the interface based on the supplied protocol
+        """
+        config = protocol.get_config(selected_msgs, interface="TCP Socket")
+        config.extend(
+            [
+                IntValue(
+                    "Concurrent Sessions",
+                    default=100,
+                    required=False,
+                    help_text="Connections exchanging messages with the target at once",
+                ),
+                IntValue(
+                    "Messages per Connection",
+                    default=0,
+                    required=False,
+                    help_text="Messages a session sends before it reconnects; 0 keeps "
+                    + "connections open",
+                ),
+            ]
+        )
+        return config
+
+    def get_info(self) -> str:
+        return f"Async TCP {self.ip}:{self.port} ({self.num_sessions} sessions)"
@@ -0,0 +1,69 @@
+"""
+Flight recorder: the last messages a job sent, with when they were sent and a
+summary of their replies, kept in a ring of preallocated slots so it can always
+stay on. A target often dies of a message sent a few steps before the one that goes
+unanswered; the recorder's snapshot is stored with every crash (see Protocol).
+"""
+from time import time
+from typing import List, Optional, Tuple
+
+# reply bytes kept per message, enough for e.g. a Modbus/TCP exception code
+REPLY_PREFIX = 16
+
+# (message name, frame, sent (epoch seconds), latency, reply length, reply prefix),
+# the reply's None if there was none
+FlightEntry = Tuple[str, bytes, float, float, Optional[int], Optional[bytes]]
+
+# slot fields
+_NAME, _FRAME, _SENT, _LATENCY, _REPLY_LENGTH, _REPLY = range(6)
+
+
+class FlightRecorder:
+    """
+    The slots are lists overwritten in place. Frames and replies are immutable bytes
+    (the builders' output), so the slots keep references to them rather than
+    copies; buffers that may be reused (e.g. replies viewed in a connection's
+    receive buffer) are copied. Only the job's fuzz thread records, and
+    snapshot() is called from it too.
+    """
+
+    def __init__(self, size=32, reply_prefix=REPLY_PREFIX):
+        self.size = max(1, size)
+        self.reply_prefix = reply_prefix
+        self._slots = [[None, None, 0.0, 0.0, 0, None] for _ in range(self.size)]
+        # messages recorded so far
+        self.count = 0
+
+    def record(self, msg_name: str, raw_msg: bytes, rxd, latency: float):
+        count = self.count
+        self.count = count + 1
+        slot = self._slots[count % self.size]
+        slot[_NAME] = msg_name
+        slot[_FRAME] = raw_msg if type(raw_msg) is bytes else bytes(raw_msg)
+        slot[_SENT] = time() - latency
+        slot[_LATENCY] = latency
+        if rxd is None:
+            slot[_REPLY] = None
+        else:
+            slot[_REPLY] = (
+                rxd if type(rxd) is bytes else bytes(rxd[: self.reply_prefix])
+            )
+            slot[_REPLY_LENGTH] = len(rxd)
+
+    def snapshot(self) -> List[FlightEntry]:
+        """
+        :returns: The recorded messages, oldest first
+        """
+        entries = []
+        for n in range(max(0, self.count - self.size), self.count):
+            name, frame, sent, latency, reply_length, reply = self._slots[n % self.size]
+            if reply is None:
+                entries.append((name, frame, sent, latency, None, None))
+            else:
+                entries.append(
+                    (name, frame, sent, latency, reply_length, reply[: self.reply_prefix])
+                )
+        return entries
+
+    def get_stats(self) -> dict:
+        return {"messages recorded": self.count, "size": self.size}
@@ -0,0 +1,184 @@
+"""
+Reply framing for stream interfaces: tells where a reply ends in the bytes
+received so far, so a read can return as soon as the reply is complete rather
+than when the buffer fills up or the timeout expires. ReceiveBuffer reassembles
+frames from a socket without copying them.
+"""
+import socket
+from time import monotonic
+from typing import Hashable, Optional
+
+# bits per character on a serial line: start, 8 data, parity or stop, stop
+BITS_PER_CHAR = 11
+
+
+def silence_gap(baud_rate: int, chars=3.5) -> float:
+    """
+    Seconds of silence that end a frame, as in Modbus RTU: 3.5 character times,
+    fixed at 1.75 ms above 19200 baud
+    """
+    if baud_rate > 19200:
+        return 0.00175
+    return chars * BITS_PER_CHAR / baud_rate
+
+
+class Framer:
+    """
+    Base framer. Replies are complete when frame_length() can tell their
+    length from their contents, or after `gap` seconds of silence.
+    """
+
+    def __init__(self, gap: Optional[float] = None):
+        """
+        :param gap: Seconds of silence after which the bytes received so far are
+        a reply; None waits for a complete frame or the timeout
+        """
+        self.gap = gap
+
+    def frame_length(self, data: bytearray) -> Optional[int]:
+        """
+        :returns: Length of the complete frame at the start of data; None if it
+        isn't complete yet or its length can't be told from its contents
+        """
+        return None
+
+    def transaction_id(self, frame) -> Optional[Hashable]:
+        """
+        Identifies the exchange a request or reply frame belongs to, so replies can
+        be matched to requests when several are in flight
+        :returns: The identifier; None if replies come back in request order
+        """
+        return None
+
+
+class SilenceFramer(Framer):
+    """
+    Frames end with an inter-frame silence only
+    """
+
+    def __init__(self, gap: float):
+        super().__init__(gap)
+
+
+class LengthPrefixFramer(Framer):
+    """
+    Frames start with an unsigned length field counting the bytes that follow it
+    """
+
+    def __init__(
+        self, size=1, offset=0, byteorder="big", adjust=0, gap: Optional[float] = None
+    ):
+        """
+        :param size: Bytes in the length field
+        :param offset: Position of the length field
+        :param adjust: Bytes the frame has beyond what the length field counts
+        (e.g. a trailing checksum)
+        """
+        super().__init__(gap)
+        self.size = size
+        self.offset = offset
+        self.byteorder = byteorder
+        self.adjust = adjust
+
+    def frame_length(self, data):
+        header = self.offset + self.size
+        if len(data) < header:
+            return None
+        length = int.from_bytes(data[self.offset : header], self.byteorder)
+        length += header + self.adjust
+        return length if len(data) >= length else None
+
+
+class DelimiterFramer(Framer):
+    """
+    Frames end with a delimiter, e.g. a line feed
+    """
+
+    def __init__(self, delimiter: bytes, gap: Optional[float] = None):
+        if not delimiter:
+            raise ValueError("Empty frame delimiter")
+        super().__init__(gap)
+        self.delimiter = delimiter
+
+    def frame_length(self, data):
+        if isinstance(data, memoryview):
+            # memoryviews can't be searched
+            data = data.tobytes()
+        end = data.find(self.delimiter)
+        return None if end < 0 else end + len(self.delimiter)
+
+
+class ReceiveBuffer:
+    """
+    Receive buffer of a stream connection, allocated once and filled with
+    recv_into. Frames are handed out as views of the buffer, valid until the next
+    read from it.
+    """
+
+    def __init__(self, size=65536):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        # received bytes not handed out yet
+        self._start = 0
+        self._end = 0
+
+    def clear(self):
+        """
+        Drop the bytes received but not handed out (e.g. a late reply)
+        """
+        self._start = self._end = 0
+
+    def fill(self, sock: socket.socket) -> int:
+        """
+        Receive once into the buffer, making room first if it is full
+        :returns: Number of bytes received; 0 if the peer closed the connection
+        """
+        if self._end == len(self._buf):
+            pending = self._end - self._start
+            if self._start:
+                self._buf[:pending] = self._view[self._start : self._end]
+            else:
+                # a frame larger than the buffer; views of the old one stay valid
+                self._buf = bytearray(2 * len(self._buf))
+                self._buf[:pending] = self._view
+                self._view = memoryview(self._buf)
+            self._start, self._end = 0, pending
+        received = sock.recv_into(self._view[self._end :])
+        self._end += received
+        return received
+
+    def next_frame(self, framer: Optional[Framer]) -> Optional[memoryview]:
+        """
+        :param framer: None hands out everything received so far as a frame
+        :returns: The next complete frame received; None if there isn't one yet
+        """
+        if self._end == self._start:
+            return None
+        pending = self._view[self._start : self._end]
+        length = len(pending) if framer is None else framer.frame_length(pending)
+        if length is None:
+            return None
+        self._start += length
+        if self._start == self._end:
+            self._start = self._end = 0
+        return pending[:length]
+
+    def read_frame(
+        self, sock: socket.socket, framer: Optional[Framer], timeout: float
+    ) -> memoryview:
+        """
+        Receive until a frame is complete
+        :returns: The frame; an empty view if the peer closed the connection
+        :raises socket.timeout: If no complete frame arrived within the timeout
+        """
+        deadline = monotonic() + timeout
+        while True:
+            frame = self.next_frame(framer)
+            if frame is not None:
+                return frame
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise socket.timeout("timed out")
+            sock.settimeout(remaining)
+            if not self.fill(sock):
+                return self._view[:0]
@@ -1,12 +1,30 @@
 import logging
-from typing import Optional
+from time import monotonic
+from typing import List, NamedTuple, Optional
 import serial
 import socket
 
+from ..message_formats.config import DropDown, IntValue
+from .framing import Framer, ReceiveBuffer
+from .socket_pool import SocketPool
+
 
 log = logging.getLogger(__name__)
 
 
+class Exchange(NamedTuple):
+    """
+    Outcome of a message submitted to a concurrent interface
+    """
+
+    msg_name: str
+    msg: object
+    raw_msg: bytes
+    # None if there was no reply, empty if the target closed the connection
+    reply: Optional[bytes]
+    latency: float
+
+
 class BaconIOInterface:
     """
     Base IO class.
@@ -22,12 +40,28 @@ class BaconIOInterface:
         "Destination Port": 1337,
         "Serial Port": None,  # serial port
         "Baudrate": 9600,
+        "Connection Mode": "Keep-Alive",
+        "Connection Pool Size": 2,
     }
 
+    # Interfaces that exchange many messages at once take them with submit()
+    # rather than transmit() (see BaconAsyncSocketIO)
+    concurrent = False
+    # Interface whose messages this one carries; protocols build and configure
+    # messages for that one. Left unset, it is the interface's own name.
+    protocol_interface: Optional[str] = None
+    # Interfaces that can't be opened a second time alongside the job's (e.g. a
+    # serial port), so the target can't be probed in the background
+    exclusive = False
+
     def __init__(self, config, name, device):
         self._config = config
         self.name = name
+        if self.protocol_interface is None:
+            self.protocol_interface = name
         self.device = device()
+        # tells where replies end; None reads whatever arrives before the timeout
+        self.framer: Optional[Framer] = None
 
     def configure(self, opts: dict):
         """
@@ -41,9 +75,13 @@ class BaconIOInterface:
         """
         raise NotImplementedError
 
-    def transmit(self, msg, wait_for_reply=False) -> Optional[bytes]:
+    def transmit(
+        self, msg, wait_for_reply=False, timeout: Optional[float] = None
+    ) -> Optional[bytes]:
         """
         Transmit data on the IO interface.
+        :param timeout: Seconds to wait for the reply; None uses the interface's
+        configured timeout
         """
         raise NotImplementedError
 
@@ -53,13 +91,33 @@ class BaconIOInterface:
         """
         raise NotImplementedError
 
+    def send_batch(self, frames: List[bytes]):
+        """
+        Write frames back to back without waiting for replies (flood mode). Stream
+        interfaces write them with a single call; replies to them are discarded
+        before the next exchange.
+        """
+        self.transmit(b"".join(frames), wait_for_reply=False)
+
+    def finish(self) -> List[Exchange]:
+        """
+        Complete the messages a concurrent interface still has queued or in flight,
+        e.g. when the job stops
+        :returns: Their exchanges
+        """
+        return []
+
     def _get_io_config(self, *kwargs):
         """
         Helper method that gets configuration params for communication.
+        Options that are missing or left blank fall back to the defaults.
         """
         result = []
         for x in kwargs:
-            result.append(self._config.get(x, BaconIOInterface.__defaults.get(x, None)))
+            value = self._config.get(x, None)
+            if value is None:
+                value = BaconIOInterface.__defaults.get(x, None)
+            result.append(value)
         if len(result) > 1:
             return tuple(result)
         else:
@@ -79,25 +137,32 @@ class BaconIOInterface:
         raise NotImplementedError
 
 
+# seconds between deadline checks while reading a frame that has no silence gap
+SERIAL_POLL = 0.05
+
+
 class BaconSerialIO(BaconIOInterface):
     """
     Serial IO Class.
     Bacon goes well with "serial".
     """
 
+    exclusive = True
+
     def __init__(self, config, device):
         super().__init__(config, "Serial", device)
         log.info("serial")
         self._ser = None
         self.port = None
+        self.timeout = 5
 
     def configure(self, opts: dict):
         io_opts = self._get_io_config("Serial Port", "Baud Rate", "Timeout")
         self.port = io_opts[0]
-        timeout = io_opts[2]
-        if not timeout:
-            timeout = 5
-        self._ser = serial.Serial(port=io_opts[0], baudrate=io_opts[1], timeout=timeout)
+        self.timeout = io_opts[2] or 5
+        self._ser = serial.Serial(
+            port=io_opts[0], baudrate=io_opts[1], timeout=self.timeout
+        )
         if self._ser.is_open:
             self._ser.close()
         self._ser.open()
@@ -106,12 +171,21 @@ class BaconSerialIO(BaconIOInterface):
         self._ser.close()
         self._ser = None
 
-    def transmit(self, msg, wait_for_reply=True) -> Optional[bytes]:
+    def _set_timeout(self, timeout: float):
+        # reconfigures the port, so only when it changes
+        if self._ser.timeout != timeout:
+            self._ser.timeout = timeout
+
+    def transmit(self, msg, wait_for_reply=True, timeout=None) -> Optional[bytes]:
         try:
+            timeout = self.timeout if timeout is None else timeout
+            if self.framer is not None:
+                # a late reply to an earlier message would be taken for this one's
+                self._ser.reset_input_buffer()
             self._ser.write(msg)
             if wait_for_reply:
                 try:
-                    data = self.receive()
+                    data = self._read_reply(timeout)
                 except:
                     return None
                 return data
@@ -127,12 +201,39 @@ class BaconSerialIO(BaconIOInterface):
             return None
 
     def receive(self) -> Optional[bytes]:
-        # TO DO: this needs better logic if we want directed fuzzing
-        t = self._ser.read(1024)
-        if len(t):
-            return t
-        else:
-            return None
+        return self._read_reply(self.timeout)
+
+    def _read_reply(self, timeout: float) -> Optional[bytes]:
+        if self.framer is None:
+            self._set_timeout(timeout)
+            t = self._ser.read(1024)
+            return t if len(t) else None
+        return self._read_frame(timeout)
+
+    def _read_frame(self, timeout: float) -> Optional[bytes]:
+        """
+        Read until the framer finds a complete frame, the line falls silent after
+        part of one, or the timeout expires. The port's timeout is set once per
+        reply, to the silence gap (or a short poll without one), and the deadline
+        is kept here.
+        """
+        gap = self.framer.gap
+        self._set_timeout(min(timeout, SERIAL_POLL if gap is None else gap))
+        deadline = monotonic() + timeout
+        data = bytearray()
+        while True:
+            chunk = self._ser.read(max(1, self._ser.in_waiting))
+            if chunk:
+                data += chunk
+                length = self.framer.frame_length(data)
+                if length is not None:
+                    return bytes(data[:length])
+            elif data and gap is not None:
+                # the line fell silent after part of a frame
+                break
+            if monotonic() >= deadline:
+                break
+        return bytes(data) if data else None
 
     @staticmethod
     def get_config_opts(selected_msgs, protocol) -> list:
@@ -148,58 +249,193 @@ class BaconSerialIO(BaconIOInterface):
 class BaconSocketIO(BaconIOInterface):
     """
     Socket IO Class
+    In "Keep-Alive" mode messages are sent over a small pool of long-lived
+    connections; "Per Message" mode opens a new connection for every message.
+    Replies are reassembled with the framer (if any) in a receive buffer per
+    connection and returned as memoryviews, valid until the connection's next
+    exchange.
     TO DO: might need changes for additional socket options...
     """
 
+    CONNECTION_MODES = ["Keep-Alive", "Per Message"]
+
     def __init__(self, config, device):
         super().__init__(config, "TCP Socket", device)
         log.info("socket")
         self.ip = None
         self.port = None
+        self.timeout = 5
+        self._pool: Optional[SocketPool] = None
+        # receive buffer of the connections in Per Message mode
+        self._buffer: Optional[ReceiveBuffer] = None
 
     def configure(self, opts: dict):
-        self.ip, self.port = self._get_io_config("Destination IP", "Destination Port")
-        # Test connection
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((self.ip, self.port))
+        self.ip, self.port, mode, pool_size = self._get_io_config(
+            "Destination IP",
+            "Destination Port",
+            "Connection Mode",
+            "Connection Pool Size",
+        )
+        self.timeout = self._config.get("timeout", 5)
+        buffer_size = self._config.get("bufsize", 65536)
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        if mode == "Per Message":
+            self._buffer = ReceiveBuffer(buffer_size)
+            # Test connection
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                sock.connect((self.ip, self.port))
+        else:
+            self._pool = SocketPool(
+                (self.ip, self.port),
+                size=pool_size,
+                connect_timeout=self.timeout,
+                buffer_size=buffer_size,
+            )
+            # Test connection and keep it around for the first message
+            self._pool.release(self._pool.acquire())
 
     def teardown(self):
-        pass
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    @property
+    def keep_alive(self) -> bool:
+        return self._pool is not None
+
+    def acquire_connection(self) -> socket.socket:
+        """
+        Check out a dedicated pooled connection for exchanges that span several
+        messages (e.g. pipelined requests). Only available in Keep-Alive mode.
+        """
+        if self._pool is None:
+            raise ValueError("Dedicated connections need the Keep-Alive connection mode")
+        return self._pool.acquire()
 
-    def transmit(self, msg, wait_for_reply=True) -> Optional[bytes]:
+    def connection_buffer(self, sock: socket.socket) -> ReceiveBuffer:
+        """
+        The receive buffer of a connection from acquire_connection
+        """
+        return self._pool.buffer(sock)
+
+    def release_connection(self, sock: socket.socket, reusable=True):
+        if self._pool is None:
+            return
+        if reusable:
+            self._pool.release(sock)
+        else:
+            self._pool.discard(sock)
+
+    def _read_reply(
+        self, sock: socket.socket, buffer: ReceiveBuffer, timeout: float
+    ) -> Optional[memoryview]:
+        """
+        :returns: The reply; None if it timed out, empty if the target closed the
+        connection
+        """
+        # whatever is left over belongs to an earlier exchange
+        buffer.clear()
+        try:
+            return buffer.read_frame(sock, self.framer, timeout)
+        except socket.timeout:
+            return None
+
+    def transmit(self, msg, wait_for_reply=True, timeout=None) -> Optional[memoryview]:
+        timeout = self.timeout if timeout is None else timeout
+        if self._pool is not None:
+            return self._transmit_pooled(msg, wait_for_reply, timeout)
         try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
                 sock.connect((self.ip, self.port))
                 sock.send(msg)
                 if wait_for_reply:
-                    sock.settimeout(self._config.get("timeout", 5))
-                    try:
-                        data = sock.recv(self._config.get("bufsize", 1024))
-                    except socket.timeout:
-                        return None
-                    return data
+                    return self._read_reply(sock, self._buffer, timeout)
                 else:
                     return None
         except Exception as ex:
             self.device.handle_io_exception(self, ex)
             return None
 
-    def receive(self) -> Optional[bytes]:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect(self._get_io_config("Destination IP", "Destination Port"))
-            sock.settimeout(self._config.get("timeout", 5))
+    def _transmit_pooled(self, msg, wait_for_reply, timeout) -> Optional[memoryview]:
+        try:
+            sock = self._pool.acquire()
+        except Exception as ex:
+            self.device.handle_io_exception(self, ex)
+            return None
+        try:
             try:
-                data = sock.recv(self._config.get("bufsize", 1024))
-            except socket.timeout:
+                sock.sendall(msg)
+            except OSError:
+                # Reset since the last health check; re-establish once and resend
+                log.debug("Pooled connection reset, reconnecting")
+                sock = self._pool.reconnect(sock)
+                sock.sendall(msg)
+            if not wait_for_reply:
+                self._pool.release(sock)
                 return None
+            data = self._read_reply(sock, self._pool.buffer(sock), timeout)
+            if data is None:
+                # a late reply would be mistaken for the next one, so don't reuse
+                self._pool.discard(sock)
+                return None
+            if not data:
+                # closed by the target, the connection can't be reused
+                self._pool.discard(sock)
+                return data
+            self._pool.release(sock)
             return data
+        except Exception as ex:
+            self._pool.discard(sock)
+            self.device.handle_io_exception(self, ex)
+            return None
+
+    def receive(self) -> Optional[memoryview]:
+        if self._pool is not None:
+            # LIFO pool, so this reads from the most recently used connection
+            sock = self._pool.acquire()
+            try:
+                data = self._read_reply(sock, self._pool.buffer(sock), self.timeout)
+            except Exception:
+                self._pool.discard(sock)
+                raise
+            if data is None:
+                self._pool.release(sock)
+                return None
+            if not data:
+                self._pool.discard(sock)
+                return data
+            self._pool.release(sock)
+            return data
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.connect(self._get_io_config("Destination IP", "Destination Port"))
+            return self._read_reply(sock, self._buffer, self.timeout)
 
     @staticmethod
     def get_config_opts(selected_msgs, protocol) -> list:
         """
         Helper to return the options for the interface based on the supplied protocol
         """
-        return protocol.get_config(selected_msgs, interface="TCP Socket")
+        config = protocol.get_config(selected_msgs, interface="TCP Socket")
+        config.extend(
+            [
+                DropDown(
+                    "Connection Mode",
+                    list(BaconSocketIO.CONNECTION_MODES),
+                    default="Keep-Alive",
+                    help_text="Keep-Alive reuses connections; "
+                    + "Per Message reconnects for every message",
+                ),
+                IntValue(
+                    "Connection Pool Size",
+                    default=2,
+                    required=False,
+                    help_text="Number of long-lived connections kept in Keep-Alive mode",
+                ),
+            ]
+        )
+        return config
 
     def get_info(self) -> str:
         return f"TCP {self.ip}:{self.port}"
@@ -0,0 +1,380 @@
+"""
+Compact binary records of frames (sent traffic, replies and crashes), appended to a
+file that grows by about the size of the frames: a file header, then records that
+each carry a timestamp, kind, job ID, message type ID and the raw frame. Job and
+message type names are defined by records of their own the first time they are
+used. The reader memory-maps the file for fast iteration and random access.
+`bacon-records` converts a file to JSON lines or pcap.
+
+File header: magic (8 bytes), version (u16), reserved (u16).
+Record: length of the rest of the record (u32), kind (u8), time in microseconds
+since the epoch (i64), job ID (u32), message type ID (u16), frame bytes. All
+little-endian.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, Iterator, NamedTuple, Optional
+
+MAGIC = b"BACNREC\x00"
+VERSION = 1
+FILE_HEADER = struct.Struct("<8sHH")
+RECORD_HEADER = struct.Struct("<IBqIH")
+# the record's length prefix doesn't count itself
+_LENGTH_SIZE = 4
+
+# record kinds
+SENT = 0
+REPLY = 1
+NO_RESPONSE = 2
+MALFORMED_RESPONSE = 3
+PROBE_FAILED = 4
+# a frame sent before a failed probe
+CONTEXT = 5
+# define the name of a job or message type ID (the frame is the UTF-8 name)
+_DEFINE_JOB = 0xFE
+_DEFINE_MSG_TYPE = 0xFF
+
+KIND_NAMES = {
+    SENT: "sent",
+    REPLY: "reply",
+    NO_RESPONSE: "no response",
+    MALFORMED_RESPONSE: "malformed response",
+    PROBE_FAILED: "probe failed",
+    CONTEXT: "context",
+}
+KINDS = {name: kind for kind, name in KIND_NAMES.items()}
+
+
+class Record(NamedTuple):
+    time: float
+    kind: int
+    job: str
+    msg_name: str
+    frame: bytes
+
+
+class RecordWriter:
+    """
+    Appends records through a buffer that is reused for every batch; records are
+    written once it is full, and by flush() and close()
+    """
+
+    def __init__(self, path: str, buffer_size=64 * 1024):
+        self.path = path
+        self._jobs: Dict[str, int] = {}
+        self._msg_types: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path) and os.path.getsize(path):
+            # continue the file's IDs, dropping a record torn by a crash
+            with RecordReader(path) as reader:
+                # scans the file, reading the definitions
+                end = reader.end
+                self._jobs = {name: i for i, name in reader.jobs.items()}
+                self._msg_types = {name: i for i, name in reader.msg_types.items()}
+            with open(path, "r+b") as f:
+                f.truncate(end)
+            self._file = open(path, "ab")
+        else:
+            self._file = open(path, "wb")
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION, 0))
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._used = 0
+
+    def write(
+        self,
+        kind: int,
+        job: str,
+        msg_name: Optional[str],
+        frame: bytes,
+        created: Optional[float] = None,
+    ):
+        """
+        :param created: Epoch seconds; now if None
+        """
+        if created is None:
+            created = time.time()
+        with self._lock:
+            job_id = self._jobs.get(job)
+            if job_id is None:
+                job_id = self._define(self._jobs, _DEFINE_JOB, job)
+            msg_name = msg_name or ""
+            type_id = self._msg_types.get(msg_name)
+            if type_id is None:
+                type_id = self._define(self._msg_types, _DEFINE_MSG_TYPE, msg_name)
+            self._append(kind, int(created * 1e6), job_id, type_id, frame)
+
+    def _define(self, ids: Dict[str, int], kind: int, name: str) -> int:
+        new_id = len(ids)
+        ids[name] = new_id
+        if kind == _DEFINE_JOB:
+            self._append(kind, 0, new_id, 0, name.encode())
+        else:
+            self._append(kind, 0, 0, new_id, name.encode())
+        return new_id
+
+    def _append(self, kind: int, time_us: int, job_id: int, type_id: int, frame):
+        size = RECORD_HEADER.size + len(frame)
+        if self._used + size > len(self._buf):
+            self._write_buffer()
+        if size > len(self._buf):
+            self._file.write(
+                RECORD_HEADER.pack(size - _LENGTH_SIZE, kind, time_us, job_id, type_id)
+            )
+            self._file.write(frame)
+            return
+        RECORD_HEADER.pack_into(
+            self._buf, self._used, size - _LENGTH_SIZE, kind, time_us, job_id, type_id
+        )
+        self._buf[self._used + RECORD_HEADER.size : self._used + size] = frame
+        self._used += size
+
+    def _write_buffer(self):
+        if self._used:
+            self._file.write(self._view[: self._used])
+            self._used = 0
+
+    def flush(self):
+        with self._lock:
+            self._write_buffer()
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._write_buffer()
+            self._file.close()
+            self._view.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RecordReader:
+    """
+    Reads a record file through a read-only memory map. Iterating goes through the
+    records in order; indexing (and len()) scans the file once for their offsets.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path} is empty") from None
+        magic, version, _ = FILE_HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} record file")
+        # ID -> name
+        self.jobs: Dict[int, str] = {}
+        self.msg_types: Dict[int, str] = {}
+        self._offsets: Optional[array] = None
+        self._end: Optional[int] = None
+
+    @property
+    def end(self) -> int:
+        """
+        Offset after the last complete record
+        """
+        if self._end is None:
+            self._index()
+        return self._end
+
+    def _scan(self) -> Iterator[tuple]:
+        """
+        Go through the records, keeping the definitions
+        :returns: (offset, kind, time in us, job ID, message type ID, frame end)
+        of the frame records
+        """
+        data = self._map
+        size = len(data)
+        unpack_from = RECORD_HEADER.unpack_from
+        offset = FILE_HEADER.size
+        while offset + RECORD_HEADER.size <= size:
+            length, kind, time_us, job_id, type_id = unpack_from(data, offset)
+            end = offset + _LENGTH_SIZE + length
+            if end > size or length < RECORD_HEADER.size - _LENGTH_SIZE:
+                # torn by a crash while being written
+                break
+            if kind == _DEFINE_JOB:
+                self.jobs[job_id] = data[offset + RECORD_HEADER.size : end].decode()
+            elif kind == _DEFINE_MSG_TYPE:
+                name = data[offset + RECORD_HEADER.size : end].decode()
+                self.msg_types[type_id] = name
+            else:
+                yield offset, kind, time_us, job_id, type_id, end
+            offset = end
+        self._end = offset
+
+    def _index(self):
+        offsets = array("Q")
+        for record in self._scan():
+            offsets.append(record[0])
+        self._offsets = offsets
+
+    def __iter__(self) -> Iterator[Record]:
+        data = self._map
+        jobs = self.jobs
+        msg_types = self.msg_types
+        for offset, kind, time_us, job_id, type_id, end in self._scan():
+            yield Record(
+                time_us / 1e6,
+                kind,
+                jobs.get(job_id, ""),
+                msg_types.get(type_id, ""),
+                data[offset + RECORD_HEADER.size : end],
+            )
+
+    def __len__(self) -> int:
+        if self._offsets is None:
+            self._index()
+        return len(self._offsets)
+
+    def __getitem__(self, i: int) -> Record:
+        if self._offsets is None:
+            self._index()
+        offset = self._offsets[i]
+        length, kind, time_us, job_id, type_id = RECORD_HEADER.unpack_from(
+            self._map, offset
+        )
+        return Record(
+            time_us / 1e6,
+            kind,
+            self.jobs.get(job_id, ""),
+            self.msg_types.get(type_id, ""),
+            self._map[offset + RECORD_HEADER.size : offset + _LENGTH_SIZE + length],
+        )
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# pcap, with the frames as the payload of IPv4/TCP packets or as is
+_PCAP_HEADER = struct.Struct("<IHHiIII")
+_PCAP_RECORD = struct.Struct("<IIII")
+_LINKTYPE_RAW = 101
+_LINKTYPE_USER0 = 147
+_IPV4 = struct.Struct("!BBHHHBBH4s4s")
+_TCP = struct.Struct("!HHIIBBHHH")
+_TARGET = bytes((10, 0, 0, 2))
+_FUZZER = bytes((10, 0, 0, 1))
+
+
+def _tcp_packet(record: Record, port: int, seq: Dict[bool, int]) -> bytes:
+    # frames to the target go to the port; replies come back from it
+    to_target = record.kind != REPLY
+    src, dst = (_FUZZER, _TARGET) if to_target else (_TARGET, _FUZZER)
+    sport, dport = (50000, port) if to_target else (port, 50000)
+    tcp = _TCP.pack(
+        sport, dport, seq[to_target], seq[not to_target], 5 << 4, 0x18, 65535, 0, 0
+    )
+    seq[to_target] = (seq[to_target] + len(record.frame)) & 0xFFFFFFFF
+    total = _IPV4.size + len(tcp) + len(record.frame)
+    # checksums are left at 0; Wireshark doesn't verify them by default
+    ip = _IPV4.pack(0x45, 0, total, 0, 0, 64, 6, 0, src, dst)
+    return ip + tcp + record.frame
+
+
+def write_pcap(records, out, tcp_port: Optional[int] = None):
+    """
+    :param tcp_port: Wrap the frames in IPv4/TCP packets to/from this port (e.g.
+    502 for Wireshark to dissect Modbus/TCP); None writes the bare frames
+    """
+    out.write(
+        _PCAP_HEADER.pack(
+            0xA1B2C3D4,
+            2,
+            4,
+            0,
+            0,
+            65535,
+            _LINKTYPE_USER0 if tcp_port is None else _LINKTYPE_RAW,
+        )
+    )
+    seq = {True: 1, False: 1}
+    for record in records:
+        packet = (
+            record.frame if tcp_port is None else _tcp_packet(record, tcp_port, seq)
+        )
+        seconds = int(record.time)
+        out.write(
+            _PCAP_RECORD.pack(
+                seconds,
+                int((record.time - seconds) * 1e6),
+                len(packet),
+                len(packet),
+            )
+        )
+        out.write(packet)
+
+
+def write_json(records, out):
+    """
+    One JSON object per line, with the frame in hex
+    """
+    for record in records:
+        out.write(
+            json.dumps(
+                {
+                    "time": record.time,
+                    "kind": KIND_NAMES.get(record.kind, record.kind),
+                    "job": record.job,
+                    "msg_name": record.msg_name,
+                    "frame": record.frame.hex(),
+                }
+            )
+            + "\n"
+        )
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(
+        description="Convert a record file (e.g. a job's traffic.bin) to JSON or pcap"
+    )
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["json", "pcap"], default="json")
+    parser.add_argument("--kind", choices=list(KINDS), action="append")
+    parser.add_argument(
+        "--tcp-port", type=int, help="pcap: wrap the frames in TCP to/from this port"
+    )
+    parser.add_argument("-o", "--output", help="Defaults to stdout")
+    args = parser.parse_args(argv)
+    kinds = None if args.kind is None else {KINDS[kind] for kind in args.kind}
+    with RecordReader(args.path) as reader:
+        records = (r for r in reader if kinds is None or r.kind in kinds)
+        if args.format == "pcap":
+            if args.output is None:
+                write_pcap(records, sys.stdout.buffer, args.tcp_port)
+            else:
+                with open(args.output, "wb") as out:
+                    write_pcap(records, out, args.tcp_port)
+        elif args.output is None:
+            write_json(records, sys.stdout)
+        else:
+            with open(args.output, "w") as out:
+                write_json(records, out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Adaptive response timeouts: a retransmission timeout estimator like TCP's
+(RFC 6298) per message type, so waiting for a reply that never comes costs a
+few of the target's round trips instead of a fixed timeout.
+"""
+import threading
+from typing import Dict, Optional
+
+
+class RttEstimator:
+    """
+    Smoothed round trip time and its variation; the timeout is the smoothed RTT
+    plus four times the variation, kept between a floor and a ceiling
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+    MAX_BACKOFF = 64
+
+    def __init__(self, floor: float, ceiling: float):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.samples = 0
+        # doubled on every spurious timeout until the next sample (TCP's back-off)
+        self._backoff = 1
+
+    def sample(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.samples += 1
+        self._backoff = 1
+
+    def back_off(self):
+        self._backoff = min(2 * self._backoff, self.MAX_BACKOFF)
+
+    def backed_off(self, rto: float) -> float:
+        """
+        :returns: rto backed off by this estimator's spurious timeouts
+        """
+        return min(rto * self._backoff, self.ceiling)
+
+    @property
+    def rto(self) -> float:
+        """
+        Timeout in seconds; the ceiling until there are samples
+        """
+        if self.srtt is None:
+            return self.ceiling
+        return self.backed_off(max(self.srtt + self.K * self.rttvar, self.floor))
+
+
+class AdaptiveTimeout:
+    """
+    Response timeouts of a job: an estimator per message type, and one over all
+    of them for the types without samples yet. A miss is confirmed by resending
+    the message with a backed-off timeout before it counts as a crash. Only
+    replies to a first attempt are sampled, since a reply to a resent message
+    can't be told apart from a late reply to the original (Karn's algorithm).
+    """
+
+    def __init__(self, floor: float, ceiling: float, retries=1):
+        """
+        :param floor: Shortest timeout in seconds
+        :param ceiling: Longest timeout in seconds, and the timeout until the
+        target has replied
+        :param retries: Confirmation resends before a miss counts as a crash
+        """
+        self.floor = min(floor, ceiling)
+        self.ceiling = ceiling
+        self.retries = max(0, retries)
+        self._job = RttEstimator(self.floor, self.ceiling)
+        self._by_msg: Dict[str, RttEstimator] = {}
+        self._lock = threading.Lock()
+        self._num_spurious = 0
+        self._num_confirmed = 0
+
+    def _estimator(self, msg_name: str) -> RttEstimator:
+        estimator = self._by_msg.get(msg_name)
+        if estimator is None:
+            estimator = self._by_msg[msg_name] = RttEstimator(self.floor, self.ceiling)
+        return estimator
+
+    def timeout(self, msg_name: str, attempt=0) -> float:
+        """
+        :param attempt: 0 for the first send, 1 for the first confirmation, ...
+        :returns: Seconds to wait for the reply
+        """
+        with self._lock:
+            estimator = self._estimator(msg_name)
+            if estimator.samples:
+                rto = estimator.rto
+            else:
+                # the job's estimate, backed off if this type was only answered on
+                # a resend, so it gets a first-attempt answer to sample eventually
+                rto = estimator.backed_off(self._job.rto)
+            return min(rto * 2**attempt, self.ceiling)
+
+    def answered(self, msg_name: str, rtt: float, attempt=0):
+        """
+        The message was answered after rtt seconds, on the given attempt
+        """
+        with self._lock:
+            if not attempt:
+                self._job.sample(rtt)
+                self._estimator(msg_name).sample(rtt)
+                return
+            # the timeout was too short (or the message got lost)
+            self._num_spurious += 1
+            self._estimator(msg_name).back_off()
+
+    def missed(self, msg_name: str):
+        """
+        The message and all its confirmations went unanswered
+        """
+        with self._lock:
+            self._num_confirmed += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            srtt = self._job.srtt
+            return {
+                "smoothed RTT (ms)": None if srtt is None else round(srtt * 1000, 2),
+                "timeout (ms)": round(self._job.rto * 1000, 2),
+                "answered on retry": self._num_spurious,
+                "confirmed misses": self._num_confirmed,
+            }
@@ -0,0 +1,128 @@
+import logging
+import queue
+import select
+import socket
+import threading
+from typing import Dict, Tuple
+
+from .framing import ReceiveBuffer
+
+log = logging.getLogger(__name__)
+
+
+class SocketPool:
+    """
+    Small pool of long-lived TCP connections to a single target.
+    Connections are health-checked when they are handed out and transparently
+    re-established if the target closed or reset them. All connections (idle or
+    in use) are closed by close(). Each connection has a receive buffer of its own.
+    """
+
+    def __init__(
+        self, address: Tuple[str, int], size=1, connect_timeout=5, buffer_size=65536
+    ):
+        self.address = address
+        self.connect_timeout = connect_timeout
+        self.buffer_size = buffer_size
+        self._idle = queue.LifoQueue()
+        # open connections and their receive buffers
+        self._sockets: Dict[socket.socket, ReceiveBuffer] = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, size))
+        self._closed = False
+
+    def _connect(self) -> socket.socket:
+        sock = socket.create_connection(self.address, timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._lock:
+            self._sockets[sock] = ReceiveBuffer(self.buffer_size)
+        return sock
+
+    @staticmethod
+    def is_healthy(sock: socket.socket) -> bool:
+        """
+        Check an idle connection without blocking. Stale data (e.g. a reply that
+        arrived after its timeout) is drained so it can't be mistaken for the
+        reply to the next request.
+        """
+        try:
+            while True:
+                readable, _, _ = select.select([sock], [], [], 0)
+                if not readable:
+                    return True
+                if not sock.recv(4096, socket.MSG_DONTWAIT):
+                    # orderly shutdown by the peer
+                    return False
+        except (OSError, ValueError):
+            return False
+
+    def acquire(self) -> socket.socket:
+        """
+        Check out a connection, opening a new one if no healthy idle connection exists.
+        """
+        if self._closed:
+            raise ConnectionError("Socket pool is closed")
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    sock = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self.is_healthy(sock):
+                    return sock
+                log.debug("Dropping dead pooled connection")
+                self._close_socket(sock)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, sock: socket.socket):
+        """
+        Return a healthy connection to the pool.
+        """
+        if self._closed:
+            self._close_socket(sock)
+        else:
+            self._idle.put(sock)
+        self._slots.release()
+
+    def discard(self, sock: socket.socket):
+        """
+        Close a checked out connection that is no longer usable (reset, timed out, ...).
+        """
+        self._close_socket(sock)
+        self._slots.release()
+
+    def reconnect(self, sock: socket.socket) -> socket.socket:
+        """
+        Replace a checked out connection with a freshly opened one.
+        """
+        self._close_socket(sock)
+        return self._connect()
+
+    def buffer(self, sock: socket.socket) -> ReceiveBuffer:
+        """
+        The receive buffer of a checked out connection
+        """
+        with self._lock:
+            return self._sockets[sock]
+
+    def _close_socket(self, sock: socket.socket):
+        with self._lock:
+            self._sockets.pop(sock, None)
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            sockets = list(self._sockets)
+            self._sockets.clear()
+        for sock in sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
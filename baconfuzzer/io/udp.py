@@ -0,0 +1,272 @@
+import logging
+import socket
+from collections import deque
+from time import monotonic
+from typing import Deque, Dict, Hashable, List, NamedTuple, Optional
+
+from ..message_formats.config import IntValue
+from .io_handler import BaconIOInterface, Exchange
+from .rtt import AdaptiveTimeout
+
+log = logging.getLogger(__name__)
+
+MAX_DATAGRAM = 65535
+
+
+class _Datagram(NamedTuple):
+    msg_name: str
+    msg: object
+    raw_msg: bytes
+    timeouts: Optional[AdaptiveTimeout]
+    sent: float = 0.0
+    deadline: float = 0.0
+    # 0 for the first send, then counts confirmation resends
+    attempt: int = 0
+
+
+class BaconUDPIO(BaconIOInterface):
+    """
+    UDP datagram interface. The socket is connected to the target, so datagrams
+    are sent without an address lookup and only the target's come back. Every
+    datagram is a frame; replies are matched to requests by the framer's
+    transaction identifier, or in order if it has none.
+    With a burst size above 1 the interface is concurrent: submitted messages are
+    sent a burst at a time, then the burst's replies are collected with a deadline
+    per datagram. Protocols see it as a "TCP Socket", so Modbus sends MBAP frames
+    as Modbus/UDP does.
+    """
+
+    protocol_interface = "TCP Socket"
+
+    def __init__(self, config, device):
+        super().__init__(config, "UDP Socket", device)
+        log.info("udp")
+        self.ip = None
+        self.port = None
+        self.timeout = 5
+        self.burst_size = 1
+        self._sock: Optional[socket.socket] = None
+        self._buf = bytearray(MAX_DATAGRAM)
+        self._view = memoryview(self._buf)
+        self._burst: List[_Datagram] = []
+
+    def configure(self, opts: dict):
+        self.ip, self.port = self._get_io_config("Destination IP", "Destination Port")
+        self.timeout = self._config.get("timeout", 5)
+        self.burst_size = max(1, self._config.get("Burst Size") or 1)
+        self.concurrent = self.burst_size > 1
+        self.teardown()
+        family, kind, proto, _, address = socket.getaddrinfo(
+            self.ip, self.port, type=socket.SOCK_DGRAM
+        )[0]
+        self._sock = socket.socket(family, kind, proto)
+        self._sock.connect(address)
+
+    def teardown(self):
+        if self._burst:
+            # finish() sends them; only left over if the job failed
+            log.warning(f"Dropping {len(self._burst)} datagrams that were never sent")
+            self._burst.clear()
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _drain(self):
+        """
+        Drop datagrams that arrived since the last exchange (e.g. late replies)
+        """
+        self._sock.setblocking(False)
+        try:
+            while True:
+                self._sock.recv_into(self._buf)
+        except OSError:
+            # nothing left, or the error of an earlier datagram (port unreachable)
+            pass
+
+    def _receive(self, timeout: float) -> Optional[memoryview]:
+        """
+        :returns: The next datagram, a view valid until the next receive; None if
+        none arrived within the timeout
+        """
+        self._sock.settimeout(max(timeout, 1e-6))
+        try:
+            received = self._sock.recv_into(self._buf)
+        except socket.timeout:
+            return None
+        return self._view[:received]
+
+    def _transaction_id(self, frame) -> Optional[Hashable]:
+        return None if self.framer is None else self.framer.transaction_id(frame)
+
+    def transmit(self, msg, wait_for_reply=True, timeout=None) -> Optional[memoryview]:
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            self._drain()
+            self._sock.settimeout(self.timeout)
+            self._sock.send(msg)
+            if not wait_for_reply:
+                return None
+            key = self._transaction_id(msg)
+            deadline = monotonic() + timeout
+            while True:
+                reply = self._receive(deadline - monotonic())
+                if reply is None:
+                    return None
+                if key is None or self._transaction_id(reply) == key:
+                    return reply
+                log.debug(f"Dropping reply to another transaction: {bytes(reply)}")
+        except OSError as ex:
+            # e.g. port unreachable
+            self.device.handle_io_exception(self, ex)
+            return None
+
+    def receive(self) -> Optional[memoryview]:
+        return self._receive(self.timeout)
+
+    def send_batch(self, frames: List[bytes]):
+        # a datagram per frame; replies are drained before the next exchange
+        try:
+            self._sock.settimeout(self.timeout)
+            for frame in frames:
+                self._sock.send(frame)
+        except OSError as ex:
+            self.device.handle_io_exception(self, ex)
+
+    def submit(
+        self,
+        msg_name: str,
+        msg,
+        raw_msg: bytes,
+        timeouts: Optional[AdaptiveTimeout] = None,
+    ) -> List[Exchange]:
+        """
+        Add a message to the burst being gathered, and exchange the burst once
+        it is full
+        :param timeouts: The job's adaptive timeouts; None waits self.timeout once
+        :returns: The exchanges of the burst if it was sent, otherwise none
+        """
+        self._burst.append(_Datagram(msg_name, msg, bytes(raw_msg), timeouts))
+        if len(self._burst) < self.burst_size:
+            return []
+        return self.flush()
+
+    def flush(self) -> List[Exchange]:
+        """
+        Exchange the messages gathered so far without waiting for a full burst
+        """
+        burst, self._burst = self._burst, []
+        return self._exchange_burst(burst) if burst else []
+
+    def finish(self) -> List[Exchange]:
+        # the burst gathered so far still has to be sent
+        return self.flush()
+
+    def _send(self, datagram: _Datagram, waiting: Dict, attempt=0):
+        timeouts = datagram.timeouts
+        timeout = (
+            self.timeout
+            if timeouts is None
+            else timeouts.timeout(datagram.msg_name, attempt)
+        )
+        self._sock.send(datagram.raw_msg)
+        sent = monotonic()
+        datagram = datagram._replace(
+            sent=sent, deadline=sent + timeout, attempt=attempt
+        )
+        key = self._transaction_id(datagram.raw_msg)
+        waiting.setdefault(key, deque()).append(datagram)
+
+    @staticmethod
+    def _next_deadline(waiting: Dict) -> float:
+        return min(d.deadline for queue in waiting.values() for d in queue)
+
+    def _expire(self, waiting: Dict, exchanges: List[Exchange]):
+        """
+        Resend the datagrams past their deadline that have confirmation retries
+        left, give up on the others
+        """
+        now = monotonic()
+        for key, queue in list(waiting.items()):
+            expired = [datagram for datagram in queue if now >= datagram.deadline]
+            for datagram in expired:
+                timeouts = datagram.timeouts
+                if timeouts is not None and datagram.attempt < timeouts.retries:
+                    self._send(datagram, waiting, datagram.attempt + 1)
+                    queue.remove(datagram)
+                    continue
+                queue.remove(datagram)
+                if timeouts is not None:
+                    timeouts.missed(datagram.msg_name)
+                exchanges.append(Exchange(*datagram[:3], None, now - datagram.sent))
+            if not waiting.get(key, True):
+                del waiting[key]
+
+    def _exchange_burst(self, burst: List[_Datagram]) -> List[Exchange]:
+        exchanges: List[Exchange] = []
+        # transaction identifier -> datagrams waiting for a reply, oldest first
+        waiting: Dict[Optional[Hashable], Deque[_Datagram]] = {}
+        unsent = deque(burst)
+        try:
+            self._drain()
+            self._sock.settimeout(self.timeout)
+            while unsent:
+                self._send(unsent[0], waiting)
+                unsent.popleft()
+            deadline = self._next_deadline(waiting)
+            while waiting:
+                now = monotonic()
+                if now >= deadline:
+                    self._expire(waiting, exchanges)
+                    if not waiting:
+                        break
+                    deadline = self._next_deadline(waiting)
+                    # expiring may resend, which takes time
+                    now = monotonic()
+                # replies only move the next deadline later, so it is checked early
+                reply = self._receive(deadline - now)
+                if reply is None:
+                    continue
+                key = self._transaction_id(reply)
+                queue = waiting.get(key)
+                if not queue:
+                    log.debug(f"Dropping reply to unknown transaction: {bytes(reply)}")
+                    continue
+                datagram = queue.popleft()
+                if not queue:
+                    del waiting[key]
+                latency = monotonic() - datagram.sent
+                if datagram.timeouts is not None:
+                    datagram.timeouts.answered(
+                        datagram.msg_name, latency, datagram.attempt
+                    )
+                exchanges.append(Exchange(*datagram[:3], bytes(reply), latency))
+        except OSError as ex:
+            self.device.handle_io_exception(self, ex)
+            now = monotonic()
+            exchanges += [
+                Exchange(*d[:3], None, now - d.sent)
+                for queue in waiting.values()
+                for d in queue
+            ]
+            exchanges += [Exchange(*d[:3], None, 0.0) for d in unsent]
+        return exchanges
+
+    @staticmethod
+    def get_config_opts(selected_msgs, protocol) -> list:
+        """
+        Helper to return the options for the interface based on the supplied protocol
+        """
+        config = protocol.get_config(selected_msgs, interface="TCP Socket")
+        config.append(
+            IntValue(
+                "Burst Size",
+                default=1,
+                required=False,
+                help_text="Datagrams sent back to back before their replies are "
+                + "collected; 1 waits for each reply",
+            )
+        )
+        return config
+
+    def get_info(self) -> str:
+        return f"UDP {self.ip}:{self.port}"
@@ -0,0 +1,147 @@
+"""
+Local UDP stand-in target for trying out the UDP interface: echoes every datagram
+back, optionally delayed or dropping some, or swallows them all (sink).
+`python -m baconfuzzer.io.udp_echo --bench` compares waiting for each reply with
+burst sends against it.
+"""
+import argparse
+import heapq
+import logging
+import random
+import socket
+import threading
+from time import monotonic
+from typing import List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class UDPEchoServer(threading.Thread):
+    def __init__(self, host="127.0.0.1", port=0, sink=False, delay=0.0, drop=0.0):
+        """
+        :param port: 0 picks a free port (see address)
+        :param sink: Swallow datagrams instead of echoing them
+        :param delay: Seconds each echo is held back, like a link's latency
+        :param drop: Fraction of datagrams not echoed
+        """
+        super().__init__(name="udp-echo", daemon=True)
+        self.sink = sink
+        self.delay = delay
+        self.drop = drop
+        self.received = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._stopping = threading.Event()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._sock.getsockname()
+
+    def run(self):
+        buf = bytearray(65535)
+        # (due, sequence, datagram, peer) of the echoes being delayed
+        delayed: List[Tuple[float, int, bytes, tuple]] = []
+        while not self._stopping.is_set():
+            now = monotonic()
+            while delayed and delayed[0][0] <= now:
+                _, _, datagram, peer = heapq.heappop(delayed)
+                self._sock.sendto(datagram, peer)
+            self._sock.settimeout(delayed[0][0] - now if delayed else 0.2)
+            try:
+                size, peer = self._sock.recvfrom_into(buf)
+            except socket.timeout:
+                continue
+            self.received += 1
+            if self.sink or random.random() < self.drop:
+                continue
+            if self.delay:
+                due = monotonic() + self.delay
+                heapq.heappush(delayed, (due, self.received, bytes(buf[:size]), peer))
+            else:
+                self._sock.sendto(buf[:size], peer)
+        self._sock.close()
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+
+def benchmark(messages=20000, burst_sizes=(1, 8, 32, 128), delay=0.0, drop=0.0):
+    """
+    Exchange numbered datagrams with a local echo server through the UDP
+    interface, and log the rate for each burst size
+    """
+    # imported here so the server runs without the fuzzer's dependencies
+    from ..devices import BaseDevice
+    from .framing import Framer
+    from .udp import BaconUDPIO
+
+    class SequenceFramer(Framer):
+        def transaction_id(self, frame):
+            return bytes(frame[:4])
+
+    server = UDPEchoServer(delay=delay, drop=drop)
+    server.start()
+    host, port = server.address
+    for burst_size in burst_sizes:
+        io = BaconUDPIO(
+            {
+                "Destination IP": host,
+                "Destination Port": port,
+                "timeout": 0.5,
+                "Burst Size": burst_size,
+            },
+            BaseDevice,
+        )
+        io.configure({})
+        io.framer = SequenceFramer()
+        answered = 0
+        start = monotonic()
+        for seq in range(messages):
+            msg = seq.to_bytes(4, "big") + bytes(60)
+            if io.concurrent:
+                answered += sum(
+                    exchange.reply is not None
+                    for exchange in io.submit("echo", None, msg)
+                )
+            else:
+                answered += io.transmit(msg, wait_for_reply=True) is not None
+        answered += sum(exchange.reply is not None for exchange in io.flush())
+        elapsed = monotonic() - start
+        io.teardown()
+        log.info(
+            f"burst {burst_size:>4}: {messages / elapsed:>8.0f} msg/s, "
+            f"{answered}/{messages} answered"
+        )
+    server.stop()
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5020)
+    parser.add_argument("--sink", action="store_true", help="Don't echo datagrams")
+    parser.add_argument(
+        "--delay", type=float, default=0.0, help="Seconds echoes are held back"
+    )
+    parser.add_argument("--drop", type=float, default=0.0, help="Fraction dropped")
+    parser.add_argument(
+        "--bench", action="store_true", help="Benchmark the UDP interface and exit"
+    )
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.bench:
+        benchmark(args.messages, delay=args.delay, drop=args.drop)
+        return
+    server = UDPEchoServer(args.host, args.port, args.sink, args.delay, args.drop)
+    log.info(f"{'Sink' if args.sink else 'Echo'} server on {server.address}")
+    server.start()
+    try:
+        server.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,24 @@ from .modbus.modbus import ModbusProtocol
 from .mil_std_1553.mil_std_1553_protocol import MILSTD1553Protocol
 from .dumb_serial.dumb_serial import DumbSerial
 
-PROTOCOLS: Dict[str, Protocol] = {
-    "modbus": ModbusProtocol(),
-    "MIL-STD-1553": MILSTD1553Protocol(),
-    "dumb-serial": DumbSerial(),
+"""
+Protocol factories: every job gets a protocol instance of its own (see
+create_protocol), so jobs don't share per-job state such as transaction
+identifiers or crash logs.
+"""
+PROTOCOLS: Dict[str, Type[Protocol]] = {
+    "modbus": ModbusProtocol,
+    "MIL-STD-1553": MILSTD1553Protocol,
+    "dumb-serial": DumbSerial,
 }
 
 
+def create_protocol(name: str, crash_path=None) -> Protocol:
+    return PROTOCOLS[name](crash_path)
+
+
 def GET_PROTO_STRING_FROM_TYPE(my_type: Type):
     for n, t in PROTOCOLS.items():
-        if type(t) is type(my_type):
+        if type(my_type) is t:
             return str(n).lower()
     return "unknown"
@@ -0,0 +1,501 @@
+"""
+Compiles fuzzed Scapy message templates into precomputed build plans.
+
+Building a fuzzed Scapy packet walks fields_desc, copies the packet, resolves every
+VolatileValue and runs post_build for each message. A BuildPlan does that analysis
+once: fixed-width fields are merged into struct formats, bit fields are packed into
+groups, length/count fields are computed from their target and post_build is
+replaced by a registered hook. Messages that contain anything else are not
+compiled (compile_packet returns None) and keep using Scapy.
+"""
+import logging
+import random
+import struct
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from scapy.fields import (
+    BitField,
+    BitFieldLenField,
+    BoundStrLenField,
+    ByteEnumField,
+    ByteField,
+    Field,
+    FieldLenField,
+    FieldListField,
+    IntField,
+    LongField,
+    ShortEnumField,
+    ShortField,
+    SignedByteField,
+    SignedIntField,
+    SignedShortField,
+    StrField,
+    StrLenField,
+    XByteEnumField,
+    XByteField,
+    XIntField,
+    XLongField,
+    XShortEnumField,
+    XShortField,
+)
+from scapy.packet import NoPayload, Packet, Raw
+from scapy.volatile import RandBin, RandNum, VolatileValue
+
+from .scapy_fields import RandList
+
+log = logging.getLogger(__name__)
+
+_FIXED_FIELD_TYPES = (
+    ByteField,
+    XByteField,
+    ByteEnumField,
+    XByteEnumField,
+    SignedByteField,
+    ShortField,
+    XShortField,
+    ShortEnumField,
+    XShortEnumField,
+    SignedShortField,
+    IntField,
+    XIntField,
+    SignedIntField,
+    LongField,
+    XLongField,
+)
+_STR_FIELD_TYPES = (StrField, StrLenField, BoundStrLenField)
+_STRUCT_CODES = "bBhHiIqQ"
+
+"""
+post_build replacements: packet class -> hook(buf, start, end, values) -> end.
+The hook patches the packet's bytes in buf[start:end] in place.
+"""
+POST_BUILD_HOOKS: Dict[type, Callable[[bytearray, int, int, dict], int]] = {}
+
+
+def register_post_build_hook(packet_class: type, hook):
+    """
+    Register the compiled equivalent of packet_class.post_build
+    """
+    POST_BUILD_HOOKS[packet_class] = hook
+
+
+class LazyPacket:
+    """
+    Stands in for the Scapy packet of a compiled frame. The raw frame is only
+    dissected if it is formatted, e.g. when a crash is logged.
+    """
+
+    __slots__ = ("packet_class", "raw")
+
+    def __init__(self, packet_class: type, raw: bytes):
+        self.packet_class = packet_class
+        self.raw = raw
+
+    def dissect(self) -> Packet:
+        try:
+            return self.packet_class(self.raw)
+        except Exception:
+            # fuzzed frames don't always dissect (e.g. absurd item counts)
+            return Raw(self.raw)
+
+    def __str__(self):
+        return str(self.dissect())
+
+    def __repr__(self):
+        return repr(self.dissect())
+
+
+class PlanField:
+    """
+    One field of a build plan and where its value comes from.
+    kind is "const", "int" (uniform in [lo, hi]), "bytes" (random length in
+    [lo, hi]), "list" (random count in [lo, hi] of ints in item_range) or "length"
+    (computed from the field named target).
+    """
+
+    __slots__ = (
+        "name",
+        "kind",
+        "value",
+        "lo",
+        "hi",
+        "item_range",
+        "target",
+        "compute",
+        "_bits",
+    )
+
+    def __init__(self, name, kind, value=None, lo=0, hi=0, item_range=None):
+        self.name = name
+        self.kind = kind
+        self.value = value
+        self.lo = lo
+        self.hi = hi
+        self.item_range = item_range
+        self.target = None
+        self.compute = None
+        # getrandbits() is much cheaper than randint() for full-width ranges
+        self._bits = _full_width(lo, hi) if kind == "int" else None
+
+    def random(self):
+        if self.kind == "int":
+            if self._bits:
+                return random.getrandbits(self._bits)
+            return random.randint(self.lo, self.hi)
+        if self.kind == "bytes":
+            size = random.randint(self.lo, self.hi)
+            return random.getrandbits(8 * size).to_bytes(size, "big") if size else b""
+        if self.kind == "list":
+            lo, hi = self.item_range
+            count = random.randint(self.lo, self.hi)
+            bits = _full_width(lo, hi)
+            if bits:
+                return [random.getrandbits(bits) for _ in range(count)]
+            return [random.randint(lo, hi) for _ in range(count)]
+        return self.value
+
+
+def _full_width(lo: int, hi: int) -> Optional[int]:
+    """
+    :returns: n if [lo, hi] is exactly the range of an n-bit unsigned number
+    """
+    if lo == 0 and hi > 0 and (hi + 1) & hi == 0:
+        return hi.bit_length()
+    return None
+
+
+class BuildPlan:
+    """
+    Precomputed build plan of one message template
+    """
+
+    def __init__(self, packet_class: type, template: Packet):
+        self.packet_class = packet_class
+        self.template = template
+        self.fields: List[PlanField] = []
+        # encoding steps: ("struct", Struct, [names]) | ("bits", nbytes, [(name, size)])
+        # | ("bytes", name) | ("list", name, Struct)
+        self.steps: List[tuple] = []
+        self.hook = None
+        self.max_size = 0
+        # build buffers are reused, one per generator thread
+        self._local = threading.local()
+
+    @property
+    def free_fields(self) -> List[PlanField]:
+        """
+        Fixed-width fields whose value is randomized
+        """
+        return [f for f in self.fields if f.kind == "int"]
+
+    def random_values(self) -> dict:
+        return {f.name: f.random() for f in self.fields if f.kind != "length"}
+
+    def build_into(self, buf: bytearray, offset=0, values: Optional[dict] = None) -> int:
+        """
+        Build a frame into buf (which must hold max_size bytes past offset).
+        :returns: Offset of the end of the frame
+        """
+        if values is None:
+            values = self.random_values()
+        for field in self.fields:
+            if field.kind == "length":
+                values[field.name] = field.compute(values[field.target])
+        pos = offset
+        for step in self.steps:
+            kind = step[0]
+            if kind == "struct":
+                fmt = step[1]
+                fmt.pack_into(buf, pos, *[values[name] or 0 for name in step[2]])
+                pos += fmt.size
+            elif kind == "bits":
+                acc = 0
+                for name, size in step[2]:
+                    acc = (acc << size) | ((values[name] or 0) & ((1 << size) - 1))
+                buf[pos : pos + step[1]] = acc.to_bytes(step[1], "big")
+                pos += step[1]
+            elif kind == "bytes":
+                data = values[step[1]]
+                buf[pos : pos + len(data)] = data
+                pos += len(data)
+            else:
+                item = step[2]
+                for value in values[step[1]]:
+                    item.pack_into(buf, pos, value)
+                    pos += item.size
+        if self.hook is not None:
+            pos = self.hook(buf, offset, pos, values)
+        return pos
+
+    def build(self, values: Optional[dict] = None) -> bytes:
+        """
+        Build a frame (random unless values are given) into the plan's reusable buffer
+        :returns: A copy of the frame
+        """
+        buf = getattr(self._local, "buffer", None)
+        if buf is None:
+            buf = self._local.buffer = bytearray(self.max_size)
+        end = self.build_into(buf, 0, values)
+        return bytes(buf[:end])
+
+    def scapy_build(self, values: dict) -> bytes:
+        """
+        Build the same values with Scapy, for checking the plan
+        """
+        # None means "computed by post_build" just like in the templates
+        explicit = {name: value for name, value in values.items() if value is not None}
+        for field in self.fields:
+            if field.kind == "length":
+                explicit.pop(field.name, None)
+        pkt = self.packet_class()
+        for name, value in explicit.items():
+            setattr(pkt, name, value)
+        return pkt.build()
+
+    def check(self, samples=64) -> bool:
+        """
+        Self-check: compare random frames with Scapy's output for the same values
+        :returns: True if every sample matched byte for byte
+        """
+        for _ in range(samples):
+            values = self.random_values()
+            compiled = self.build(dict(values))
+            expected = self.scapy_build(values)
+            if compiled != expected:
+                log.warning(
+                    f"Compiled {self.packet_class.__name__} differs from Scapy: "
+                    + f"{compiled.hex()} != {expected.hex()} for {values}"
+                )
+                return False
+        return True
+
+    def field_space(self) -> Optional["FieldSpace"]:
+        """
+        :returns: The space of all frames this plan can generate; None if it is
+        not practical to enumerate (variable-length fields)
+        """
+        if any(f.kind in ("bytes", "list", "length") for f in self.fields):
+            return None
+        fixed = {f.name: f.value for f in self.fields if f.kind == "const"}
+        dims = [(f.name, f.lo, f.hi - f.lo + 1) for f in self.free_fields]
+        return FieldSpace(fixed, dims)
+
+
+class FieldSpace:
+    """
+    Finite space of field values of one message, with a mixed-radix mapping
+    between indexes in range(size) and the field values
+    """
+
+    def __init__(self, fixed: dict, dims: List[Tuple[str, int, int]]):
+        """
+        :param fixed: Field name -> value of the fields that don't vary
+        :param dims: (field name, lowest value, number of values) of the fields that do
+        """
+        self.fixed = fixed
+        self.dims = dims
+        self.size = 1
+        for _, _, count in dims:
+            self.size *= count
+
+    def values(self, index: int) -> dict:
+        values = dict(self.fixed)
+        for name, lo, count in self.dims:
+            index, digit = divmod(index, count)
+            values[name] = lo + digit
+        return values
+
+    def pin(self, name: str, value) -> "FieldSpace":
+        """
+        :returns: A copy of the space where the named field is fixed to value
+        """
+        fixed = dict(self.fixed)
+        fixed[name] = value
+        return FieldSpace(fixed, [dim for dim in self.dims if dim[0] != name])
+
+    def vary(self, name: str, lo: int, count: int) -> "FieldSpace":
+        """
+        :returns: A copy of the space where the named field takes count values from lo
+        """
+        fixed = {k: v for k, v in self.fixed.items() if k != name}
+        dims = [dim for dim in self.dims if dim[0] != name] + [(name, lo, count)]
+        return FieldSpace(fixed, dims)
+
+
+def _random_range(value) -> Optional[Tuple[int, int]]:
+    """
+    Range of a uniform random number volatile (RandByte, RandShort, RandNum, ...)
+    """
+    if isinstance(value, RandNum) and type(value)._fix is RandNum._fix:
+        return value.min, value.max
+    return None
+
+
+def _struct_code(field: Field) -> Optional[Tuple[str, str]]:
+    fmt = field.fmt
+    if len(fmt) == 2 and fmt[0] in "!<>" and fmt[1] in _STRUCT_CODES:
+        return ("!" if fmt[0] == ">" else fmt[0]), fmt[1]
+    return None
+
+
+def _field_value(template: Packet, field: Field):
+    if field.name in template.fields:
+        return template.fields[field.name]
+    return template.default_fields.get(field.name)
+
+
+def _post_build_hook(packet_class: type):
+    """
+    :returns: (True, hook or None) if post_build can be compiled, else (False, None)
+    """
+    for klass in packet_class.__mro__:
+        if klass is Packet:
+            return True, None
+        if "post_build" in klass.__dict__:
+            hook = POST_BUILD_HOOKS.get(klass)
+            return hook is not None, hook
+    return True, None
+
+
+def compile_packet(template: Packet) -> Optional[BuildPlan]:
+    """
+    Compile a (fuzzed) single-layer message template.
+    :returns: The build plan; None if the template needs Scapy to build
+    """
+    packet_class = type(template)
+    if not isinstance(template.payload, NoPayload):
+        return None
+    if packet_class.do_build is not Packet.do_build:
+        return None
+    if packet_class.self_build is not Packet.self_build:
+        return None
+    ok, hook = _post_build_hook(packet_class)
+    if not ok:
+        return None
+
+    plan = BuildPlan(packet_class, template)
+    plan.hook = hook
+    bits: List[Tuple[str, int]] = []
+    size = 0
+    for field in packet_class.fields_desc:
+        value = _field_value(template, field)
+        if isinstance(field, BitField):
+            if field.rev:
+                return None
+            bits.append((field.name, field.size))
+        elif bits:
+            # a bit group must end on a byte boundary before any other field
+            return None
+
+        if isinstance(field, (FieldLenField, BitFieldLenField)) and value is None:
+            target = field.length_of or field.count_of
+            plan_field = PlanField(field.name, "length")
+            plan_field.target = target
+            plan.fields.append(plan_field)
+        elif isinstance(value, VolatileValue):
+            plan_field = _compile_volatile(field, value)
+            if plan_field is None:
+                return None
+            plan.fields.append(plan_field)
+        elif isinstance(value, (int, bytes, list)) or value is None:
+            plan.fields.append(PlanField(field.name, "const", value))
+        else:
+            return None
+
+        if isinstance(field, BitField):
+            total = sum(s for _, s in bits)
+            if total % 8 == 0:
+                plan.steps.append(("bits", total // 8, bits))
+                size += total // 8
+                bits = []
+        elif type(field) in _FIXED_FIELD_TYPES or isinstance(
+            field, _FIXED_FIELD_TYPES
+        ):
+            if type(field).addfield is not Field.addfield:
+                return None
+            code = _struct_code(field)
+            if code is None:
+                return None
+            last = plan.steps[-1] if plan.steps else None
+            if last and last[0] == "struct" and last[1].format[0] == code[0]:
+                fmt = struct.Struct(last[1].format + code[1])
+                plan.steps[-1] = ("struct", fmt, last[2] + [field.name])
+            else:
+                plan.steps.append(("struct", struct.Struct(code[0] + code[1]), [field.name]))
+            size += struct.calcsize(code[0] + code[1])
+        elif type(field) in _STR_FIELD_TYPES:
+            plan.steps.append(("bytes", field.name))
+            plan_field = plan.fields[-1]
+            size += plan_field.hi if plan_field.kind == "bytes" else len(plan_field.value or b"")
+        elif isinstance(field, FieldListField):
+            code = _struct_code(field.field)
+            if code is None or not isinstance(field.field, _FIXED_FIELD_TYPES):
+                return None
+            item = struct.Struct(code[0] + code[1])
+            plan.steps.append(("list", field.name, item))
+            plan_field = plan.fields[-1]
+            count = plan_field.hi if plan_field.kind == "list" else len(plan_field.value or [])
+            size += count * item.size
+        else:
+            return None
+    if bits:
+        return None
+
+    names = {f.name: f for f in plan.fields}
+    for plan_field in plan.fields:
+        if plan_field.kind == "length":
+            if not _compile_length(packet_class, plan_field, names):
+                return None
+            if plan_field.value is None:
+                plan_field.value = 0
+    plan.max_size = size
+    return plan
+
+
+def _compile_volatile(field: Field, value: VolatileValue) -> Optional[PlanField]:
+    if isinstance(value, RandBin):
+        size_range = _random_range(value.size)
+        if size_range is None or value.chars != RandBin._DEFAULT_CHARS:
+            return None
+        return PlanField(field.name, "bytes", lo=size_range[0], hi=size_range[1])
+    if isinstance(value, RandList):
+        count_range = _random_range(value.size)
+        item_range = _random_range(value.volatile_obj)
+        if count_range is None or item_range is None:
+            return None
+        return PlanField(
+            field.name, "list", lo=count_range[0], hi=count_range[1], item_range=item_range
+        )
+    value_range = _random_range(value)
+    if value_range is None:
+        return None
+    return PlanField(field.name, "int", lo=value_range[0], hi=value_range[1])
+
+
+def _compile_length(packet_class: type, plan_field: PlanField, names: dict) -> bool:
+    """
+    Set up the computation of a length/count field from its target field
+    """
+    fields = {field.name: field for field in packet_class.fields_desc}
+    length_field = fields[plan_field.name]
+    target = names.get(plan_field.target)
+    if target is None or target.kind not in ("bytes", "list", "const"):
+        return False
+    if target.kind == "list" or isinstance(target.value, list):
+        if length_field.count_of is not None:
+            item_size = 1
+        else:
+            target_field = fields[target.name]
+            item_size = struct.calcsize(target_field.field.fmt)
+    else:
+        if length_field.count_of is not None:
+            return False
+        item_size = 1
+    adjust = length_field.adjust
+
+    def compute(target_value):
+        return adjust(None, len(target_value or ()) * item_size)
+
+    plan_field.compute = compute
+    return True
@@ -16,21 +16,27 @@ class ConfigItem:
 
 class DropDown(ConfigItem):
     """
-    Configuration option that allows a single selection from a dropdown menu
+    Configuration option that allows a single selection from a dropdown menu.
+    If no default is given the first option (alphabetically) is selected.
     """
 
-    def __init__(self, name: str, options: List[str], help_text=None, group=None):
+    def __init__(
+        self, name: str, options: List[str], default=None, help_text=None, group=None
+    ):
         super().__init__(name, help_text, group)
         self.options = options
         self.options.sort()
+        self.default = default
 
     def to_html(self) -> str:
         payload = ""
         payload += BaconConfig.util_label(self.name, self.help_text)
         payload += f'<select name="{self.name}" class="form-select" id="{self.name}">'
         for option in self.options:
+            selected = "selected" if option == self.default else ""
             payload += (
-                f'<option name="{option}" data-group="{self.group}">{option}</option>'
+                f'<option name="{option}" data-group="{self.group}" {selected}>'
+                f"{option}</option>"
             )
         payload += f"</select></br>"
         return payload
@@ -178,6 +184,16 @@ class BaconConfig:
             raise ValueError("Items cannot have the same name")
         self.items = items
 
+    def extend(self, items: List[ConfigItem]):
+        """
+        Append additional items (e.g. interface or job options) to the configuration
+        """
+        names = self.item_names + [item.name for item in items]
+        if len(names) != len(set(names)):
+            raise ValueError("Items cannot have the same name")
+        self.item_names = names
+        self.items = self.items + items
+
     def to_html(self) -> str:
         return "<br>".join([item.to_html() for item in self.items])
 
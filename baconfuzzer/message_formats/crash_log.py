@@ -0,0 +1,222 @@
+"""
+Crash logs written off the fuzz threads: recording a crash only queues the record,
+and one writer thread per process formats it (str() of the Scapy packet in
+particular) and stores it in the crash store (see crash_store). Crashes are inserted
+in batches, once enough are pending or a little time has passed; every job's handle
+is closed when the job ends.
+"""
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import weakref
+from time import monotonic
+from typing import Dict, List, Optional
+
+from .crash_store import CRASH_DB, CrashRecord, CrashStore
+
+log = logging.getLogger(__name__)
+
+# pending records inserted in one transaction
+FLUSH_RECORDS = 256
+# seconds a record may wait to be inserted
+FLUSH_INTERVAL = 0.5
+# seconds a job waits for its crashes to be stored when it ends
+CLOSE_TIMEOUT = 10
+
+# queued item kinds
+_OPEN, _RECORD, _CLOSE, _FLUSH, _STOP = range(5)
+
+
+class _Sink:
+    """
+    A crash store opened by the writer, with the records waiting to be inserted
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # handles of the store that are open
+        self.refs = 0
+        self.pending: List[CrashRecord] = []
+        self._store: Optional[CrashStore] = None
+
+    def flush(self) -> int:
+        if not self.pending:
+            return 0
+        records, self.pending = self.pending, []
+        if self._store is None:
+            self._store = CrashStore(self.path)
+        return self._store.insert(records)
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+
+class CrashLog:
+    """
+    A job's handle of a crash store: records are queued for the writer thread.
+    Closed by close() or when garbage collected.
+    """
+
+    def __init__(self, writer: "CrashWriter", job: str, path: str = CRASH_DB):
+        self.job = job
+        self.path = path
+        self._writer = writer
+        writer.put((_OPEN, path))
+        self._release = weakref.finalize(self, writer.put, (_CLOSE, path))
+
+    def record(self, record: CrashRecord):
+        """
+        Queue a crash record; the objects it refers to mustn't change afterwards
+        """
+        self._writer.put((_RECORD, self.path, record))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the records queued so far are stored
+        :returns: False on timeout
+        """
+        return self._writer.flush(timeout)
+
+    def close(self, timeout: Optional[float] = CLOSE_TIMEOUT) -> bool:
+        """
+        Close the handle and wait until its records are stored
+        :returns: False on timeout
+        """
+        if not self._release.alive:
+            return True
+        self._release()
+        return self._writer.flush(timeout)
+
+
+class CrashWriter(threading.Thread):
+    def __init__(self, flush_records=FLUSH_RECORDS, flush_interval=FLUSH_INTERVAL):
+        super().__init__(name="crash-writer", daemon=True)
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self._queue: "queue.SimpleQueue[tuple]" = queue.SimpleQueue()
+        # store path -> its sink
+        self._sinks: Dict[str, _Sink] = {}
+        self._pending = 0
+        self.num_records = 0
+        self.num_flushes = 0
+
+    def put(self, item: tuple):
+        self._queue.put(item)
+
+    def open(self, job: str, path: str = CRASH_DB) -> CrashLog:
+        return CrashLog(self, job, path)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the items queued so far are handled and the records stored
+        :returns: False on timeout
+        """
+        if not self.is_alive():
+            return False
+        done = threading.Event()
+        self.put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def stop(self, timeout: Optional[float] = CLOSE_TIMEOUT):
+        """
+        Store everything queued, close the stores and stop
+        """
+        if not self.is_alive():
+            return
+        self.put((_STOP,))
+        self.join(timeout)
+
+    def run(self):
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - monotonic()
+                # also when records keep coming
+                if timeout <= 0:
+                    self._flush()
+                    deadline = timeout = None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush()
+                deadline = None
+                continue
+            kind = item[0]
+            if kind == _RECORD:
+                self._sink(item[1]).pending.append(item[2])
+                self._pending += 1
+                if self._pending >= self.flush_records:
+                    self._flush()
+                    deadline = None
+                elif deadline is None:
+                    deadline = monotonic() + self.flush_interval
+            elif kind == _OPEN:
+                self._sink(item[1]).refs += 1
+            elif kind == _CLOSE:
+                sink = self._sinks.get(item[1])
+                if sink is not None:
+                    sink.refs -= 1
+                    # closed with the next flush, after the records queued before
+                    if deadline is None:
+                        deadline = monotonic()
+            elif kind == _FLUSH:
+                self._flush()
+                deadline = None
+                item[1].set()
+            elif kind == _STOP:
+                self._flush()
+                for sink in self._sinks.values():
+                    sink.close()
+                self._sinks.clear()
+                return
+
+    def _sink(self, path: str) -> _Sink:
+        sink = self._sinks.get(path)
+        if sink is None:
+            sink = self._sinks[path] = _Sink(path)
+        return sink
+
+    def _flush(self):
+        for path, sink in list(self._sinks.items()):
+            try:
+                self.num_records += sink.flush()
+            except (OSError, sqlite3.Error):
+                log.exception(f"Couldn't store crashes in {path}")
+            if sink.refs <= 0:
+                sink.close()
+                del self._sinks[path]
+        self._pending = 0
+        self.num_flushes += 1
+
+
+_writer: Optional[CrashWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_crash_writer() -> CrashWriter:
+    """
+    The process's crash writer, started on first use (again in a forked child)
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.pid != os.getpid():
+            _writer = CrashWriter()
+            _writer.start()
+        return _writer
+
+
+def open_crash_log(job: str, path: str = CRASH_DB) -> CrashLog:
+    return get_crash_writer().open(job, path)
+
+
+@atexit.register
+def _stop_crash_writer():
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.stop()
@@ -0,0 +1,405 @@
+"""
+Crash store: every job's crashes go into one SQLite database (crashes/crashes.db,
+in WAL mode so the dashboard reads while jobs write) with the raw frames as BLOBs
+and indexed columns to query them by, e.g. all the crashes of a job for a function
+code. Crashes are inserted in batches by the crash writer (see crash_log).
+`bacon-crashes` exports them in the crash log's text format, or as binary records
+(see io.records).
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from ..io import records
+
+CRASH_DB = os.path.join("crashes", "crashes.db")
+
+# crash kinds
+NO_RESPONSE = "no response"
+MALFORMED_RESPONSE = "malformed response"
+PROBE_FAILED = "probe failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crashes (
+    id INTEGER PRIMARY KEY,
+    job TEXT NOT NULL,
+    time REAL NOT NULL,
+    kind TEXT NOT NULL,
+    interface TEXT NOT NULL,
+    msg_name TEXT,
+    function_code INTEGER,
+    raw_msg BLOB NOT NULL,
+    message TEXT,
+    response BLOB,
+    signature TEXT,
+    latency REAL
+);
+CREATE INDEX IF NOT EXISTS crashes_job_time ON crashes (job, time);
+CREATE INDEX IF NOT EXISTS crashes_job_msg_name ON crashes (job, msg_name);
+CREATE INDEX IF NOT EXISTS crashes_job_function_code ON crashes (job, function_code);
+CREATE INDEX IF NOT EXISTS crashes_job_signature ON crashes (job, signature);
+CREATE INDEX IF NOT EXISTS crashes_job_latency ON crashes (job, latency);
+CREATE INDEX IF NOT EXISTS crashes_time ON crashes (time);
+-- frames sent before a failed liveness probe, or the job's last messages (see
+-- io.flight_recorder), oldest first
+CREATE TABLE IF NOT EXISTS crash_context (
+    crash_id INTEGER NOT NULL REFERENCES crashes (id),
+    position INTEGER NOT NULL,
+    msg_name TEXT,
+    raw_msg BLOB NOT NULL,
+    time REAL,
+    latency REAL,
+    response_length INTEGER,
+    response BLOB,
+    PRIMARY KEY (crash_id, position)
+) WITHOUT ROWID;
+"""
+
+# columns added to crash_context since it was created
+_CONTEXT_COLUMNS = {
+    "time": "REAL",
+    "latency": "REAL",
+    "response_length": "INTEGER",
+    "response": "BLOB",
+}
+
+_COLUMNS = (
+    "id, job, time, kind, interface, msg_name, function_code, raw_msg, message, "
+    + "response, signature, latency"
+)
+
+# query() filter -> its condition
+_FILTERS = {
+    "job": "job = ?",
+    "kind": "kind = ?",
+    "msg_name": "msg_name = ?",
+    "function_code": "function_code = ?",
+    "signature": "signature = ?",
+    "since": "time >= ?",
+    "until": "time < ?",
+    "min_latency": "latency >= ?",
+}
+
+
+class ContextFrame(NamedTuple):
+    """
+    A frame sent before a crash; frames before a failed probe only have a name
+    and the frame
+    """
+
+    msg_name: Optional[str]
+    raw_msg: bytes
+    # epoch seconds it was sent
+    time: Optional[float] = None
+    latency: Optional[float] = None
+    # None if there was no reply
+    response_length: Optional[int] = None
+    # the start of the reply
+    response: Optional[bytes] = None
+
+
+class CrashRecord(NamedTuple):
+    """
+    A crash as recorded on the fuzz thread; msg (the Scapy packet) is formatted
+    by the writer
+    """
+
+    job: str
+    time: float
+    kind: str
+    interface: str
+    msg_name: Optional[str]
+    function_code: Optional[int]
+    raw_msg: bytes
+    msg: Any = None
+    response: Optional[bytes] = None
+    # the response's protocol fields (see Protocol.response_key)
+    signature: Optional[tuple] = None
+    latency: Optional[float] = None
+    # frames sent before the crash, oldest first: (message name, raw frame)
+    # before a failed probe, the job's flight recorder entries otherwise (both
+    # a prefix of ContextFrame)
+    context: Tuple[tuple, ...] = ()
+
+
+class CrashStore:
+    def __init__(self, path=CRASH_DB, timeout=30.0):
+        """
+        :param timeout: Seconds to wait for another job's write to finish
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL stays consistent without syncing every commit
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """
+        Add the columns a store created by an earlier version lacks
+        """
+        columns = {
+            row["name"]
+            for row in self._db.execute("PRAGMA table_info(crash_context)")
+        }
+        for name, kind in _CONTEXT_COLUMNS.items():
+            if name not in columns:
+                self._db.execute(f"ALTER TABLE crash_context ADD COLUMN {name} {kind}")
+
+    def close(self):
+        self._db.close()
+
+    def insert(self, records: Iterable[CrashRecord]) -> int:
+        """
+        Insert crashes in one transaction
+        :returns: Number of crashes inserted
+        """
+        count = 0
+        with self._transaction():
+            for record in records:
+                cursor = self._db.execute(
+                    "INSERT INTO crashes (job, time, kind, interface, msg_name, "
+                    + "function_code, raw_msg, message, response, signature, latency) "
+                    + "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        record.job,
+                        record.time,
+                        record.kind,
+                        record.interface,
+                        record.msg_name,
+                        record.function_code,
+                        record.raw_msg,
+                        None if record.msg is None else str(record.msg),
+                        record.response,
+                        None if record.signature is None else repr(record.signature),
+                        record.latency,
+                    ),
+                )
+                if record.context:
+                    self._db.executemany(
+                        "INSERT INTO crash_context (crash_id, position, msg_name, "
+                        + "raw_msg, time, latency, response_length, response) "
+                        + "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            (cursor.lastrowid, position, *ContextFrame(*frame))
+                            for position, frame in enumerate(record.context)
+                        ),
+                    )
+                count += 1
+        return count
+
+    @contextmanager
+    def _transaction(self):
+        # take the write lock up front rather than upgrading to it
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def query(
+        self, limit: Optional[int] = 100, offset=0, **filters
+    ) -> List[Dict[str, Any]]:
+        """
+        Crashes matching the filters (see _FILTERS), oldest first
+        """
+        where, params = self._where(filters)
+        sql = f"SELECT {_COLUMNS} FROM crashes{where} ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        return [dict(row) for row in self._db.execute(sql, params)]
+
+    def count(self, **filters) -> int:
+        where, params = self._where(filters)
+        row = self._db.execute(f"SELECT COUNT(*) FROM crashes{where}", params)
+        return row.fetchone()[0]
+
+    def get(self, crash_id: int) -> Optional[Dict[str, Any]]:
+        """
+        A crash with its context frames (if any)
+        """
+        row = self._db.execute(
+            f"SELECT {_COLUMNS} FROM crashes WHERE id = ?", (crash_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        crash = dict(row)
+        crash["context"] = self.context(crash_id)
+        return crash
+
+    def context(self, crash_id: int) -> List[ContextFrame]:
+        """
+        The frames sent before a crash, oldest first
+        """
+        return [
+            ContextFrame(*row)
+            for row in self._db.execute(
+                "SELECT msg_name, raw_msg, time, latency, response_length, response "
+                + "FROM crash_context WHERE crash_id = ? ORDER BY position",
+                (crash_id,),
+            )
+        ]
+
+    def jobs(self) -> Dict[str, int]:
+        """
+        :returns: Job -> number of crashes
+        """
+        rows = self._db.execute("SELECT job, COUNT(*) FROM crashes GROUP BY job")
+        return dict(rows.fetchall())
+
+    def export_log(self, **filters) -> Iterator[str]:
+        """
+        The matching crashes in the crash log's text format, line by line
+        """
+        where, params = self._where(filters)
+        for row in self._db.execute(
+            f"SELECT {_COLUMNS} FROM crashes{where} ORDER BY id", params
+        ):
+            stamp = log_stamp(row["time"])
+            for line in format_crash(row, self.context(row["id"])):
+                yield f"{stamp}{line}\n"
+
+    def export_records(self, writer: records.RecordWriter, **filters) -> int:
+        """
+        Append the matching crashes to a binary record file: the crashing frame,
+        then its response and the frames sent before it
+        :returns: Number of crashes exported
+        """
+        where, params = self._where(filters)
+        count = 0
+        for row in self._db.execute(
+            f"SELECT {_COLUMNS} FROM crashes{where} ORDER BY id", params
+        ):
+            job, msg_name, created = row["job"], row["msg_name"], row["time"]
+            kind = records.KINDS[row["kind"]]
+            writer.write(kind, job, msg_name, row["raw_msg"], created)
+            if row["response"] is not None:
+                writer.write(records.REPLY, job, msg_name, row["response"], created)
+            for frame in self.context(row["id"]):
+                writer.write(
+                    records.CONTEXT,
+                    job,
+                    frame.msg_name,
+                    frame.raw_msg,
+                    created if frame.time is None else frame.time,
+                )
+            count += 1
+        return count
+
+    @staticmethod
+    def _where(filters: Dict[str, Any]) -> Tuple[str, list]:
+        conditions = []
+        params = []
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name not in _FILTERS:
+                raise ValueError(f"Unknown crash filter {name}")
+            conditions.append(_FILTERS[name])
+            params.append(value)
+        if not conditions:
+            return "", params
+        return " WHERE " + " AND ".join(conditions), params
+
+
+def log_stamp(created: float) -> str:
+    """
+    The prefix of logging's "%(asctime)s - %(levelname)s - %(message)s"
+    """
+    return "%s,%03d - WARNING - " % (
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created)),
+        (created - int(created)) * 1000,
+    )
+
+
+def _format_reply(frame: ContextFrame) -> str:
+    if frame.response_length is None:
+        return "no reply"
+    reply = f"{frame.response_length} byte reply {bytes(frame.response)}"
+    if frame.response_length > len(frame.response):
+        reply += "..."
+    return f"{reply} after {frame.latency * 1000:.1f} ms"
+
+
+def format_crash(crash, context: List[ContextFrame]) -> List[str]:
+    """
+    A stored crash's lines in the crash log
+    """
+    if crash["kind"] == PROBE_FAILED:
+        lines = [
+            f"Liveness probe failed on interface {crash['interface']}",
+            f"\tProbe: {bytes(crash['raw_msg'])}",
+            f"\tLast {len(context)} frames, oldest first:",
+        ]
+        lines.extend(f"\t{frame.msg_name}: {bytes(frame.raw_msg)}" for frame in context)
+        return lines
+    lines = [
+        f"Crash detected on interface {crash['interface']}",
+        f"\tMessage: {crash['message']}",
+        f"\tRaw message: {bytes(crash['raw_msg'])}",
+    ]
+    if context:
+        lines.append(f"\tLast {len(context)} messages, oldest first:")
+        lines.extend(
+            f"\t{frame.msg_name}: {bytes(frame.raw_msg)} -> {_format_reply(frame)}"
+            for frame in context
+        )
+    return lines
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(
+        description="Export crashes from the crash store in the crash log format, "
+        + "or append them to a binary record file (see bacon-records)"
+    )
+    parser.add_argument("--db", default=CRASH_DB)
+    parser.add_argument("--job", help="The job's crash directory")
+    parser.add_argument("--msg-name")
+    parser.add_argument("--function-code", type=lambda code: int(code, 0))
+    parser.add_argument("--jobs", action="store_true", help="List the jobs and exit")
+    parser.add_argument("--format", choices=["log", "records"], default="log")
+    parser.add_argument("-o", "--output", help="Defaults to stdout (log only)")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        parser.error(f"No crash store at {args.db}")
+    if args.format == "records" and args.output is None:
+        parser.error("Record files need an --output")
+    filters = {
+        "job": args.job,
+        "msg_name": args.msg_name,
+        "function_code": args.function_code,
+    }
+    store = CrashStore(args.db)
+    try:
+        if args.jobs:
+            for job, count in store.jobs().items():
+                print(f"{job}\t{count}")
+            return
+        if args.format == "records":
+            with records.RecordWriter(args.output) as writer:
+                store.export_records(writer, **filters)
+            return
+        out = sys.stdout if args.output is None else open(args.output, "w")
+        try:
+            out.writelines(store.export_log(**filters))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,8 @@ from baconfuzzer.message_formats.config import (
     TextValue,
 )
 
+from ...io.framing import DelimiterFramer, LengthPrefixFramer
+from ..compiler import LazyPacket
 from ..protocol import Protocol
 
 log = logging.getLogger(__name__)
@@ -31,29 +33,39 @@ class DumbSerialPacket(Packet):
 
 
 class DumbSerial(Protocol):
+    MSGS = [DumbSerialPacket]
+
     def __init__(self, crash_path=None):
         super().__init__(crash_path)
-        self.msg_types = {msg().name: msg for msg in [DumbSerialPacket]}
-        self.fuzzed_msgs = {}
-        for name, msg_class in self.msg_types.items():
-            msg = fuzz(msg_class())
-            self.fuzzed_msgs[name] = msg
+        self.msg_types = {msg().name: msg for msg in self.MSGS}
+
+    @classmethod
+    def create_templates(cls):
+        return {msg_class().name: fuzz(msg_class()) for msg_class in cls.MSGS}
 
     def get_msg_names(self, io_interface_name=None):
         return {key: True for key in self.msg_types.keys()}
 
-    def fuzz_msg(self, msg_name, validate, config_values, io_interface, stop_flag):
+    def build_msg(self, msg_name, validate, config_values, io_interface, stop_flag):
+        plan = self._get_build_plan(msg_name, config_values)
+        if plan is not None:
+            raw_msg = plan.build()
+            return LazyPacket(plan.packet_class, raw_msg), raw_msg
         fuzzed_msg = self.fuzzed_msgs[msg_name]
-        raw_msg = fuzzed_msg.build()
-        log.debug(f"Generated msg {fuzzed_msg}")
-        rxd = io_interface.transmit(raw_msg, True)
-        log.debug(f"received: {rxd}")
-        if rxd is None:
-            log.warning(f"Crash detected with input {raw_msg}")
-            self._record_crash(io_interface, fuzzed_msg, raw_msg)
-            return True
-        log.debug(f"succeeded with input {raw_msg}")
-        return False
+        return fuzzed_msg, fuzzed_msg.build()
+
+    def get_framer(self, config_values, io_interface):
+        framer = super().get_framer(config_values, io_interface)
+        framing = config_values.get("Serial Framing")
+        if framer is None or framing not in ("Length Prefix", "Delimiter"):
+            return framer
+        # the silence gap still ends replies that don't follow the format
+        if framing == "Length Prefix":
+            return LengthPrefixFramer(
+                config_values.get("Length Prefix Size") or 1, gap=framer.gap
+            )
+        delimiter = bytes.fromhex(config_values.get("Frame Delimiter") or "0a")
+        return DelimiterFramer(delimiter, gap=framer.gap)
 
     def get_config(self, selected_msgs, interface):
         # io defaults/hints
@@ -71,6 +83,33 @@ class DumbSerial(Protocol):
             opts.append(
                 FloatValue("Timeout", default=5, help_text="Read / response timeout")
             )
+            opts.append(
+                DropDown(
+                    "Serial Framing",
+                    ["Inter-frame Gap", "Length Prefix", "Delimiter", "Timeout"],
+                    default="Inter-frame Gap",
+                    help_text="Where replies end: after a silence, after the number "
+                    + "of bytes their big-endian length prefix gives, at a delimiter, "
+                    + "or only at the timeout",
+                )
+            )
+            opts.append(self.frame_gap_opt())
+            opts.append(
+                IntValue(
+                    "Length Prefix Size",
+                    default=1,
+                    required=False,
+                    help_text="Bytes in the length prefix of each reply",
+                )
+            )
+            opts.append(
+                TextValue(
+                    "Frame Delimiter",
+                    default="0a",
+                    required=False,
+                    help_text="Hex bytes that end each reply",
+                )
+            )
         elif interface == "TCP Socket":
             opts.append(
                 TextValue(
@@ -0,0 +1,102 @@
+"""
+Vectorized generation of fuzzed MIL-STD-1553 words.
+
+A 1553 word is 16 payload bits plus a parity bit, sent as a fixed 3-byte frame
+(see MILSTD1553Packet), so thousands of them can be generated at once with NumPy
+instead of building Scapy packets one by one.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from scapy.fields import BitField
+
+from .mil_std_1553_packets import MILSTD1553Packet
+
+FRAME_SIZE = 3
+
+# subaddress/mode values that mark the word count field as a mode code
+MODE_CODE_SUBADDRESSES = (0, 31)
+
+# number of set bits in each byte value, mod 2
+PARITY_TABLE = np.array([bin(i).count("1") & 1 for i in range(256)], dtype=np.uint8)
+
+
+class MILSTD1553BatchGenerator:
+    """
+    Generates batches of fuzzed words of one MIL-STD-1553 word type.
+    Unconstrained fields are uniformly random and the parity bit is computed the
+    same way as MILSTD1553Packet.post_build does for a fuzzed Scapy template
+    (i.e. over the random padding too, which is then zeroed), so batches can stand
+    in for the Scapy-built messages.
+    """
+
+    def __init__(
+        self,
+        packet_class: type,
+        constraints: Optional[Dict[str, Union[int, Iterable[int]]]] = None,
+        seed=None,
+    ):
+        """
+        :param packet_class: One of the MILSTD1553Packet subclasses
+        :param constraints: Field name -> value or allowed values, e.g.
+        {"subaddress_mode": MODE_CODE_SUBADDRESSES}. Constraining parity disables
+        the parity calculation.
+        """
+        if not issubclass(packet_class, MILSTD1553Packet):
+            raise ValueError(f"{packet_class.__name__} is not a MIL-STD-1553 word")
+        self.packet_class = packet_class
+        # (name, shift, width) of each field within the 24 frame bits
+        self._fields: List[Tuple[str, int, int]] = []
+        shift = 8 * FRAME_SIZE
+        for field in packet_class.fields_desc:
+            width = field.size if isinstance(field, BitField) else 8 * field.sz
+            shift -= width
+            self._fields.append((field.name, shift, width))
+        if shift != 0:
+            raise ValueError(f"{packet_class.__name__} is not {FRAME_SIZE} bytes long")
+
+        self._constraints: Dict[str, np.ndarray] = {}
+        widths = {name: width for name, _, width in self._fields}
+        for name, allowed in (constraints or {}).items():
+            if name not in widths:
+                raise ValueError(f"{packet_class.__name__} has no field {name}")
+            if isinstance(allowed, int):
+                allowed = [allowed]
+            allowed = np.array(sorted(set(allowed)), dtype=np.uint32)
+            if not len(allowed) or allowed[-1] >= 1 << widths[name]:
+                raise ValueError(f"Invalid values for {name}: {allowed.tolist()}")
+            self._constraints[name] = allowed
+        self._rng = np.random.default_rng(seed)
+
+    def generate_array(self, count: int) -> np.ndarray:
+        """
+        :returns: A (count, 3) uint8 array with one frame per row
+        """
+        words = np.zeros(count, dtype=np.uint32)
+        for name, shift, width in self._fields:
+            allowed = self._constraints.get(name)
+            if allowed is not None:
+                if len(allowed) == 1:
+                    values = allowed[0]
+                else:
+                    values = allowed[self._rng.integers(0, len(allowed), count)]
+            elif name == "parity":
+                continue
+            else:
+                values = self._rng.integers(0, 1 << width, count, dtype=np.uint32)
+            words |= np.left_shift(values, shift, dtype=np.uint32)
+
+        frames = np.empty((count, FRAME_SIZE), dtype=np.uint8)
+        for i in range(FRAME_SIZE):
+            frames[:, i] = words >> (8 * (FRAME_SIZE - 1 - i))
+        if "parity" not in self._constraints:
+            odd = PARITY_TABLE[frames].sum(axis=1, dtype=np.uint8) & 1
+            frames[:, 2] = (odd ^ 1) << 7
+        return frames
+
+    def generate(self, count: int) -> memoryview:
+        """
+        :returns: A flat memoryview of count frames back to back; frame i is
+        view[FRAME_SIZE * i : FRAME_SIZE * (i + 1)]
+        """
+        return memoryview(self.generate_array(count)).cast("B")
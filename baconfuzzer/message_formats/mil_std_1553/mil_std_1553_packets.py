@@ -1,6 +1,11 @@
 from scapy.packet import Packet
 from scapy.fields import BitField, XShortField
 
+from ..compiler import register_post_build_hook
+
+# number of set bits in each byte value
+BIT_COUNTS = bytes(bin(i).count("1") for i in range(256))
+
 
 class MILSTD1553Packet(Packet):
     """
@@ -14,12 +19,7 @@ class MILSTD1553Packet(Packet):
         if self.parity is None:
             parity_field = self.fields_desc[-2]
             assert parity_field.name == "parity"
-            count = 0
-            for byte in pkt:
-                for i in range(8):
-                    if byte & 1:
-                        count += 1
-                    byte >>= 1
+            count = sum(BIT_COUNTS[byte] for byte in pkt)
             parity_bit = 0 if (count % 2) else 1
             pkt = pkt[:2] + bytes([parity_bit << 7])
         return pkt
@@ -62,3 +62,17 @@ class MILSTD1553StatusWord(MILSTD1553Packet):
         BitField("parity", None, 1),
         BitField("__padding", 0, 7),
     ]
+
+
+def _compiled_parity(buf, start, end, values):
+    """
+    Compiled equivalent of MILSTD1553Packet.post_build
+    """
+    if values.get("parity") is None:
+        count = sum(BIT_COUNTS[byte] for byte in buf[start:end])
+        parity_bit = 0 if (count % 2) else 1
+        buf[start + 2] = parity_bit << 7
+    return end
+
+
+register_post_build_hook(MILSTD1553Packet, _compiled_parity)
@@ -1,52 +1,102 @@
 import logging
+import threading
 from scapy.packet import fuzz
 
 from baconfuzzer.io.utils import get_serial_port
 from baconfuzzer.message_formats.config import (
     BaconConfig,
+    DropDown,
     FloatValue,
     IntValue,
     TextValue,
 )
 
+from .batch import FRAME_SIZE, MODE_CODE_SUBADDRESSES, MILSTD1553BatchGenerator
 from .mil_std_1553_packets import (
+    BIT_COUNTS,
     MILSTD1553CommandWord,
     MILSTD1553DataWord,
     MILSTD1553StatusWord,
 )
+from ..compiler import LazyPacket
 from ..protocol import Protocol
 
 log = logging.getLogger(__name__)
 
 
 class MILSTD1553Protocol(Protocol):
+    MSGS = [MILSTD1553CommandWord, MILSTD1553DataWord, MILSTD1553StatusWord]
+
     def __init__(self, crash_path=None):
         super().__init__(crash_path)
-        self.msg_types = {
-            msg().name: msg
-            for msg in [MILSTD1553CommandWord, MILSTD1553DataWord, MILSTD1553StatusWord]
-        }
-        self.fuzzed_msgs = {}
-        for name, msg_class in self.msg_types.items():
-            msg = fuzz(msg_class())
-            # msg.__padding = 0
-            self.fuzzed_msgs[name] = msg
+        self.msg_types = {msg().name: msg for msg in self.MSGS}
+        # batches being consumed by each generator thread
+        self._batches = threading.local()
+
+    @classmethod
+    def create_templates(cls):
+        return {msg_class().name: fuzz(msg_class()) for msg_class in cls.MSGS}
 
     def get_msg_names(self, io_interface_name=None):
         return {key: True for key in self.msg_types.keys()}
 
-    def fuzz_msg(self, msg_name, validate, config_values, io_interface, stop_flag):
+    def build_msg(self, msg_name, validate, config_values, io_interface, stop_flag):
+        batch_size = config_values.get("Batch Size")
+        if batch_size:
+            raw_msg = self._next_batched_msg(msg_name, batch_size, config_values)
+            return LazyPacket(self.msg_types[msg_name], raw_msg), raw_msg
+        plan = self._get_build_plan(msg_name, config_values)
+        if plan is not None:
+            raw_msg = plan.build()
+            return LazyPacket(plan.packet_class, raw_msg), raw_msg
         fuzzed_msg = self.fuzzed_msgs[msg_name]
-        raw_msg = fuzzed_msg.build()
-        log.debug(f"Generated msg {fuzzed_msg}")
-        rxd = io_interface.transmit(raw_msg, True)
-        log.debug(f"received: {rxd}")
-        if rxd is None:
-            log.warning(f"Crash detected with input {raw_msg}")
-            self._record_crash(io_interface, fuzzed_msg, raw_msg)
-            return True
-        log.debug(f"succeeded with input {raw_msg}")
-        return False
+        return fuzzed_msg, fuzzed_msg.build()
+
+    def get_field_space(self, msg_name):
+        space = super().get_field_space(msg_name)
+        if space is None:
+            return None
+        # The padding isn't sent (post_build zeroes it) and only decides the parity
+        # bit, so enumerate both parities directly: 2^17 words per type.
+        return space.pin("__padding", 0).vary("parity", 0, 2)
+
+    def fix_raw(self, frame, config_values, io_interface):
+        # set each word's parity bit (odd parity over its 16 bits), zero the padding
+        for pos in range(0, len(frame) - FRAME_SIZE + 1, FRAME_SIZE):
+            count = BIT_COUNTS[frame[pos]] + BIT_COUNTS[frame[pos + 1]]
+            frame[pos + 2] = (0 if count % 2 else 1) << 7
+
+    def _get_constraints(self, msg_name, config_values) -> dict:
+        field_names = [field.name for field in self.msg_types[msg_name].fields_desc]
+        constraints = {}
+        rt_address = config_values.get("Remote Terminal Address")
+        if rt_address is not None and "remote_terminal_address" in field_names:
+            constraints["remote_terminal_address"] = rt_address
+        if (
+            config_values.get("Subaddress Mode") == "Mode Codes"
+            and "subaddress_mode" in field_names
+        ):
+            constraints["subaddress_mode"] = MODE_CODE_SUBADDRESSES
+        return constraints
+
+    def _next_batched_msg(self, msg_name, batch_size, config_values) -> memoryview:
+        """
+        Take the next word from this thread's current batch, generating a new
+        batch when it runs out. The word is a view into the batch, not a copy.
+        """
+        batches = self._batches.__dict__
+        batch = batches.get(msg_name)
+        if batch is None:
+            generator = MILSTD1553BatchGenerator(
+                self.msg_types[msg_name], self._get_constraints(msg_name, config_values)
+            )
+            batch = batches[msg_name] = [generator, memoryview(b""), 0]
+        generator, frames, pos = batch
+        if pos >= len(frames):
+            frames = batch[1] = generator.generate(batch_size)
+            pos = 0
+        batch[2] = pos + FRAME_SIZE
+        return frames[pos : pos + FRAME_SIZE]
 
     def get_config(self, selected_msgs, interface):
         # io defaults/hints
@@ -64,6 +114,15 @@ class MILSTD1553Protocol(Protocol):
                 FloatValue("Timeout", default=5, help_text="Read / response timeout")
             )
             opts.append(IntValue("Baud Rate", default=9600, help_text="Data baud rate"))
+            opts.append(
+                DropDown(
+                    "Serial Framing",
+                    ["Inter-frame Gap", "Timeout"],
+                    default="Inter-frame Gap",
+                    help_text="Where replies end: after a silence, or only at the timeout",
+                )
+            )
+            opts.append(self.frame_gap_opt())
         elif interface == "TCP Socket":
             opts.append(
                 TextValue(
@@ -81,4 +140,30 @@ class MILSTD1553Protocol(Protocol):
             )
 
         # actual protocol config fields
+        opts.append(
+            IntValue(
+                "Batch Size",
+                default=4096,
+                required=False,
+                help_text="Words generated at a time with NumPy; 0 builds each word individually",
+            )
+        )
+        opts.append(
+            IntValue(
+                "Remote Terminal Address",
+                default=None,
+                required=False,
+                help_text="Pin the RT address of command and status words; blank "
+                + "fuzzes it (batched generation only)",
+            )
+        )
+        opts.append(
+            DropDown(
+                "Subaddress Mode",
+                ["Any", "Mode Codes"],
+                default="Any",
+                help_text="Limit command word subaddresses to the mode code values 0 "
+                + "and 31 (batched generation only)",
+            )
+        )
         return BaconConfig(opts)
@@ -0,0 +1,218 @@
+"""
+Builds Modbus request PDUs that are valid by construction.
+
+Each generator draws its fields from the ranges ModbusProtocol.validate_msg
+accepts and derives the dependent fields (byte counts, quantities, sub-request
+lengths) from them, instead of building random frames until one passes.
+"""
+import math
+import random
+import struct
+from typing import Callable, Dict, List, Optional
+
+from scapy.config import conf
+
+# function codes validate_msg accepts on each interface
+SERIAL_FUNC_CODES = (
+    1,
+    2,
+    3,
+    4,
+    5,
+    6,
+    7,
+    8,
+    0xB,
+    0xC,
+    0xF,
+    0x10,
+    0x11,
+    0x14,
+    0x15,
+    0x16,
+    0x17,
+    0x18,
+)
+TCP_FUNC_CODES = (1, 2, 3, 4, 5, 6, 0xF, 0x10, 0x14, 0x15, 0x16, 0x17, 0x18)
+
+MAX_PDU_SIZE = 253
+MAX_ADDRESS = 0x10000
+MAX_FILE_RECORD = 0x2710
+
+# diagnostics sub-function -> allowed data (None: any; 3 takes one value <= 0xFF00)
+DIAGNOSTICS_DATA = {
+    0: None,
+    1: [[0x0000], [0xFF00]],
+    2: [[0x0000]],
+    3: None,
+    4: [[0x0000]],
+    **{sub_func: [[0x0000]] for sub_func in range(0xA, 0x13)},
+    0x14: [[0x0000]],
+}
+
+
+def _short() -> int:
+    return random.getrandbits(16)
+
+
+def _max_items(count: int) -> int:
+    """
+    validate_msg follows Scapy's dissection, which refuses lists longer than
+    conf.max_list_count
+    """
+    return min(count, conf.max_list_count)
+
+
+def _address_range(max_quantity: int):
+    """
+    Random quantity in [1, max_quantity] and a start address it fits after
+    """
+    quantity = random.randint(1, max_quantity)
+    return random.randint(0, MAX_ADDRESS - quantity), quantity
+
+
+def _read_request(func_code: int, max_quantity: int) -> Callable[[], bytes]:
+    def build() -> bytes:
+        start, quantity = _address_range(max_quantity)
+        return struct.pack("!BHH", func_code, start, quantity)
+
+    return build
+
+
+def _func_code_only(func_code: int) -> Callable[[], bytes]:
+    return lambda: bytes((func_code,))
+
+
+def _write_single_coil() -> bytes:
+    return struct.pack("!BHH", 5, _short(), random.choice((0x0000, 0xFF00)))
+
+
+def _write_single_register() -> bytes:
+    return struct.pack("!BHH", 6, _short(), _short())
+
+
+def _diagnostics() -> bytes:
+    sub_func = random.choice(list(DIAGNOSTICS_DATA))
+    if sub_func == 3:
+        data = [random.randint(0, 0xFF00)]
+    elif DIAGNOSTICS_DATA[sub_func] is None:
+        count = random.randint(0, _max_items((MAX_PDU_SIZE - 3) // 2))
+        data = [_short() for _ in range(count)]
+    else:
+        data = random.choice(DIAGNOSTICS_DATA[sub_func])
+    return struct.pack(f"!BH{len(data)}H", 8, sub_func, *data)
+
+
+def _write_multiple_coils() -> bytes:
+    start, quantity = _address_range(min(0x7B0, 8 * _max_items(0xFF)))
+    byte_count = math.ceil(quantity / 8)
+    outputs = random.getrandbits(8 * byte_count).to_bytes(byte_count, "big")
+    return struct.pack("!BHHB", 0xF, start, quantity, byte_count) + outputs
+
+
+def _write_multiple_registers() -> bytes:
+    start, quantity = _address_range(_max_items(0x7B))
+    values = [_short() for _ in range(quantity)]
+    return struct.pack(
+        f"!BHHB{quantity}H", 0x10, start, quantity, 2 * quantity, *values
+    )
+
+
+def _file_record(record_budget: int):
+    """
+    Random file record reference: (file number, record number, record length)
+    with a record length of at most record_budget
+    """
+    record_number = random.randint(0, MAX_FILE_RECORD - 1)
+    length = random.randint(0, min(record_budget, MAX_FILE_RECORD - record_number))
+    return random.randint(1, 0xFFFF), record_number, length
+
+
+def _read_file_record() -> bytes:
+    # the response holds 2 bytes plus (2 + 2 * record length) per sub-request
+    count = random.randint(1, 35)
+    budget = (MAX_PDU_SIZE - 2) // 2 - count
+    sub_requests = []
+    for _ in range(count):
+        file_number, record_number, length = _file_record(budget)
+        budget -= length
+        sub_requests.append(
+            struct.pack("!BHHH", 6, file_number, record_number, length)
+        )
+    return struct.pack("!BB", 0x14, 7 * count) + b"".join(sub_requests)
+
+
+def _write_file_record() -> bytes:
+    # each sub-request takes 7 bytes plus 2 per register; 9 to 251 bytes in total
+    budget = 0xFB
+    sub_requests: List[bytes] = []
+    while budget >= 9 and (not sub_requests or random.random() < 0.5):
+        file_number, record_number, length = _file_record(
+            _max_items((budget - 7) // 2)
+        )
+        if not sub_requests:
+            length = max(length, 1)
+        budget -= 7 + 2 * length
+        data = [_short() for _ in range(length)]
+        sub_request = struct.pack("!BHHH", 6, file_number, record_number, length)
+        sub_requests.append(sub_request + struct.pack(f"!{length}H", *data))
+    data = b"".join(sub_requests)
+    return struct.pack("!BB", 0x15, len(data)) + data
+
+
+def _mask_write_register() -> bytes:
+    return struct.pack("!BHHH", 0x16, _short(), _short(), _short())
+
+
+def _read_write_multiple_registers() -> bytes:
+    read_start, read_quantity = _address_range(0x7D)
+    write_start, write_quantity = _address_range(_max_items(0x79))
+    values = [_short() for _ in range(write_quantity)]
+    return struct.pack(
+        f"!BHHHHB{write_quantity}H",
+        0x17,
+        read_start,
+        read_quantity,
+        write_start,
+        write_quantity,
+        2 * write_quantity,
+        *values,
+    )
+
+
+def _read_fifo_queue() -> bytes:
+    return struct.pack("!BH", 0x18, _short())
+
+
+VALID_PDU_GENERATORS: Dict[int, Callable[[], bytes]] = {
+    1: _read_request(1, 0x7D0),
+    2: _read_request(2, 0x7D0),
+    3: _read_request(3, 0x7D),
+    4: _read_request(4, 0x7D),
+    5: _write_single_coil,
+    6: _write_single_register,
+    7: _func_code_only(7),
+    8: _diagnostics,
+    0xB: _func_code_only(0xB),
+    0xC: _func_code_only(0xC),
+    0xF: _write_multiple_coils,
+    0x10: _write_multiple_registers,
+    0x11: _func_code_only(0x11),
+    0x14: _read_file_record,
+    0x15: _write_file_record,
+    0x16: _mask_write_register,
+    0x17: _read_write_multiple_registers,
+    0x18: _read_fifo_queue,
+}
+
+
+def build_valid_pdu(func_code: int, io_interface_name: str) -> Optional[bytes]:
+    """
+    :returns: A random valid request PDU; None if no request with this function
+    code is valid on the interface
+    """
+    allowed = SERIAL_FUNC_CODES if io_interface_name == "Serial" else TCP_FUNC_CODES
+    generator = VALID_PDU_GENERATORS.get(func_code)
+    if generator is None or func_code not in allowed:
+        return None
+    return generator()
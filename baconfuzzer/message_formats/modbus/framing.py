@@ -0,0 +1,84 @@
+"""
+Modbus reply framing. The length of an RTU reply follows from its function code
+(and byte count, for the functions that have one), so it is complete before the
+3.5 character silence that ends it. Modbus/TCP frames carry their length in the
+MBAP header.
+"""
+from typing import Optional
+
+from ...io.framing import Framer, LengthPrefixFramer
+
+
+class MBAPFramer(LengthPrefixFramer):
+    """
+    Modbus/TCP frames: the MBAP length field (after the transaction and protocol
+    identifiers) counts the bytes after it, and replies repeat the transaction
+    identifier of their request
+    """
+
+    def __init__(self):
+        super().__init__(size=2, offset=4)
+
+    def transaction_id(self, frame):
+        return bytes(frame[:2]) if len(frame) >= 2 else None
+
+
+MBAP_FRAMER = MBAPFramer()
+
+# address, function code and CRC
+RTU_OVERHEAD = 4
+
+# function code -> length of the reply's fixed-size data
+FIXED_DATA = {
+    5: 4,
+    6: 4,
+    7: 1,
+    0xB: 4,
+    0xF: 4,
+    0x10: 4,
+    0x16: 6,
+}
+# function codes whose replies have a byte count after the function code
+BYTE_COUNT_8 = (1, 2, 3, 4, 0xC, 0x11, 0x14, 0x15, 0x17)
+
+
+def rtu_reply_length(data) -> Optional[int]:
+    """
+    :returns: Length of the RTU reply starting data; None if more bytes are
+    needed to tell, or if the function's replies don't tell their length
+    """
+    if len(data) < 2:
+        return None
+    func_code = data[1]
+    if func_code & 0x80:
+        # exception code
+        return RTU_OVERHEAD + 1
+    if func_code in FIXED_DATA:
+        return RTU_OVERHEAD + FIXED_DATA[func_code]
+    if func_code in BYTE_COUNT_8:
+        if len(data) < 3:
+            return None
+        return RTU_OVERHEAD + 1 + data[2]
+    if func_code == 0x18:
+        # read FIFO queue: 16-bit byte count
+        if len(data) < 4:
+            return None
+        return RTU_OVERHEAD + 2 + int.from_bytes(data[2:4], "big")
+    if func_code == 8 and len(data) >= 4 and data[2:4] != b"\x00\x00":
+        # diagnostics echo the sub-function and one data word, except "return
+        # query data" which echoes all of the request's data
+        return RTU_OVERHEAD + 4
+    return None
+
+
+class ModbusRTUFramer(Framer):
+    """
+    Replies are complete once the length their function code implies is in; the
+    silence gap ends the others (e.g. unknown function codes)
+    """
+
+    def frame_length(self, data):
+        length = rtu_reply_length(data)
+        if length is None or len(data) < length:
+            return None
+        return length
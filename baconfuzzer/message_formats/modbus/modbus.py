@@ -1,8 +1,12 @@
 import logging
-import math
+import random
+import struct
+import threading
+import weakref
+from time import monotonic
+from typing import List
 from .invalid_functions import ModbusPDUInvalidFuncCode
 
-from fluent_validator import validate
 from scapy.contrib.modbus import (
     ModbusADURequest,
     ModbusPDU01ReadCoilsRequest,
@@ -30,12 +34,21 @@ from scapy.volatile import RandByte
 from baconfuzzer.io.utils import get_serial_port
 
 
+from ..checksum import crc16_modbus
+from ..compiler import LazyPacket
 from ..protocol import Protocol
-from ..config import BaconConfig, FloatValue, TextValue, IntValue
+from ..config import BaconConfig, DropDown, FloatValue, TextValue, IntValue
+from .constructive import build_valid_pdu
+from .framing import MBAP_FRAMER, ModbusRTUFramer
 from .modbus_serial_adu import ModbusSerialADURequest
+from .pipelining import MBAP_HEADER, ModbusTCPPipeline, Unanswered
+from .validation import REQUEST_VALIDATORS
 
 log = logging.getLogger(__name__)
 
+# read coils: function code, starting address, quantity
+PROBE_PDU = struct.pack(">BHH", 1, 0, 1)
+
 
 class ModbusProtocol(Protocol):
     REQUEST_MSGS = [
@@ -63,14 +76,26 @@ class ModbusProtocol(Protocol):
     def __init__(self, crash_path=None):
         super().__init__(crash_path)
         self.msg_types = {msg().name: msg for msg in self.REQUEST_MSGS}
-        self.fuzzed_msgs = {}
-        for name, msg_class in self.msg_types.items():
-            msg = self._apply_custom_fields(msg_class)
+        self.transaction_identifier = 0
+        self._transaction_lock = threading.Lock()
+        # per-job (i.e. per I/O interface) pipelined connections
+        self._pipelines = weakref.WeakKeyDictionary()
+        # per-job msg name -> [valid frames, build attempts, constructed frames]
+        self._validation_stats = weakref.WeakKeyDictionary()
+        # (function code, interface name) -> constructed messages pass validation
+        self._constructible = {}
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def create_templates(cls):
+        templates = {}
+        for msg_class in cls.REQUEST_MSGS:
+            msg = cls._apply_custom_fields(msg_class)
             fuzzed_msg = fuzz(msg)
             func_code = fuzzed_msg.class_default_fields[msg_class]["funcCode"]
             fuzzed_msg.funcCode = func_code
-            self.fuzzed_msgs[name] = fuzzed_msg
-        self.transaction_identifier = 0
+            templates[msg_class().name] = fuzzed_msg
+        return templates
 
     def get_msg_names(self, io_interface_name=None):
         if io_interface_name is None or io_interface_name == "Serial":
@@ -86,225 +111,302 @@ class ModbusProtocol(Protocol):
                 f"Unsupported I/O interface ({io_interface_name}) for modbus"
             )
 
-    def fuzz_msg(self, msg_name, validate, config_values, io_interface, stop_flag):
-        fuzzed_msg = self.fuzzed_msgs[msg_name]
-        unitId_config = config_values["Unit Identifier"]
-        unitId = unitId_config if unitId_config is not None else RandByte()
-        if io_interface.name == "Serial":
-            adu = ModbusSerialADURequest(address=unitId)
-        elif io_interface.name == "TCP Socket":
-            adu = ModbusADURequest(transId=self.transaction_identifier, unitId=unitId)
+    def _next_transaction_identifier(self) -> int:
+        with self._transaction_lock:
+            trans_id = self.transaction_identifier
             if self.transaction_identifier >= 0xFFFF:
                 self.transaction_identifier = 0
             else:
                 self.transaction_identifier += 1
+        return trans_id
+
+    def build_msg(self, msg_name, validate, config_values, io_interface, stop_flag):
+        if validate and config_values.get("Validation Mode") != "Reject":
+            built = self._build_constructed_msg(msg_name, config_values, io_interface)
+            if built is not None:
+                return built
+        plan = self._get_build_plan(msg_name, config_values)
+        if plan is not None:
+            return self._build_compiled_msg(
+                msg_name, plan, validate, config_values, io_interface, stop_flag
+            )
+        fuzzed_msg = self.fuzzed_msgs[msg_name]
+        unitId_config = config_values["Unit Identifier"]
+        unitId = unitId_config if unitId_config is not None else RandByte()
+        if io_interface.protocol_interface == "Serial":
+            adu = ModbusSerialADURequest(address=unitId)
+        elif io_interface.protocol_interface == "TCP Socket":
+            adu = ModbusADURequest(
+                transId=self._next_transaction_identifier(), unitId=unitId
+            )
         else:
             raise NotImplementedError(
                 f"Unsupported I/O interface ({io_interface.name}) for modbus"
             )
 
         msg = adu / fuzzed_msg
-        msg_valid = False
-        while not msg_valid and not stop_flag():
+        attempts = 0
+        while not stop_flag():
             raw_msg = msg.build()
-            if not validate:
-                break
-            msg_valid = self.validate_msg(raw_msg, io_interface)
-        log.debug(f"Generated msg {msg}")
-        rxd = io_interface.transmit(raw_msg, True)
-        log.debug(f"received: {rxd}")
-        if rxd is None:
-            log.warning(f"Crash detected with input {raw_msg}")
-            self._record_crash(io_interface, msg, raw_msg)
-            return True
-        log.debug(f"succeeded with input {raw_msg}")
-        return False
+            attempts += 1
+            if not validate or self.validate_msg(raw_msg, io_interface):
+                self._record_validation(io_interface, msg_name, attempts, validate)
+                return msg, raw_msg
+        self._record_validation(io_interface, msg_name, attempts, validate, False)
+        return None
 
-    def validate_msg(self, msg, io_interface) -> bool:
-        try:
-            if io_interface.name == "Serial":
-                adu = ModbusSerialADURequest(msg)
-                validate(len(adu)).greater_than(3)
-            elif io_interface.name == "TCP Socket":
-                adu = ModbusADURequest(msg)
-                validate(len(adu)).greater_than(7)
-                validate(len(adu.payload)).equal(adu.len - 1)
-            else:
-                raise NotImplementedError(
-                    f"Unsupported I/O interface ({io_interface.name}) for modbus"
-                )
+    def build_enumerated_msg(
+        self, msg_name, values, validate, config_values, io_interface
+    ):
+        return self._build_compiled_msg(
+            msg_name,
+            self.build_plans[msg_name],
+            validate,
+            config_values,
+            io_interface,
+            lambda: False,
+            values,
+        )
 
-            payload = adu.payload
-            validate(len(payload)).less_or_equal_than(253)
-            if io_interface.name == "Serial":
-                validate(payload.funcCode).is_in(
-                    1,
-                    2,
-                    3,
-                    4,
-                    5,
-                    6,
-                    7,
-                    8,
-                    0xB,
-                    0xC,
-                    0xF,
-                    0x10,
-                    0x11,
-                    0x14,
-                    0x15,
-                    0x16,
-                    0x17,
-                    0x18,
-                )
-            elif io_interface.name == "TCP Socket":
-                validate(payload.funcCode).is_in(
-                    1, 2, 3, 4, 5, 6, 0xF, 0x10, 0x14, 0x15, 0x16, 0x17, 0x18
-                )
+    def _frame_pdu(self, pdu, config_values, io_interface, transId=None):
+        """
+        Wrap a PDU in the ADU of the interface
+        :returns: The ADU class and the raw frame
+        """
+        unitId = config_values["Unit Identifier"]
+        if unitId is None:
+            unitId = random.getrandbits(8)
+        if io_interface.protocol_interface == "Serial":
+            frame = bytes((unitId,)) + pdu
+            return ModbusSerialADURequest, frame + struct.pack("H", crc16_modbus(frame))
+        elif io_interface.protocol_interface == "TCP Socket":
+            if transId is None:
+                transId = self._next_transaction_identifier()
+            mbap = MBAP_HEADER.pack(transId, 0, len(pdu) + 1)
+            return ModbusADURequest, mbap + bytes((unitId,)) + pdu
+        raise NotImplementedError(
+            f"Unsupported I/O interface ({io_interface.name}) for modbus"
+        )
 
-            if payload.funcCode == 1:
-                validate(payload.quantity).greater_than(0).less_or_equal_than(0x7D0)
-                validate(payload.startAddr + payload.quantity).less_or_equal_than(
-                    0x10000
-                )
-            elif payload.funcCode == 2:
-                validate(payload.quantity).greater_than(0).less_or_equal_than(0x7D0)
-                validate(payload.startAddr + payload.quantity).less_or_equal_than(
-                    0x10000
-                )
-            elif payload.funcCode == 3:
-                validate(payload.quantity).greater_than(0).less_or_equal_than(0x7D)
-                validate(payload.startAddr + payload.quantity).less_or_equal_than(
-                    0x10000
-                )
-            elif payload.funcCode == 4:
-                validate(payload.quantity).greater_than(0).less_or_equal_than(0x7D)
-                validate(payload.startAddr + payload.quantity).less_or_equal_than(
-                    0x10000
-                )
-            elif payload.funcCode == 5:
-                validate(payload.outputValue).is_in(0x0000, 0xFF00)
-            elif payload.funcCode == 6:
-                pass
-            elif payload.funcCode == 7:
-                pass
-            elif payload.funcCode == 8:
-                validate(payload.subFunc).is_in(
-                    0, 1, 2, 3, 4, 0xA, 0xB, 0xC, 0xD, 0xE, 0xF, 0x10, 0x11, 0x12, 0x14
-                )
-                if payload.subFunc == 0:
-                    pass
-                elif payload.subFunc == 1:
-                    validate(payload.data).is_in([0x0000], [0xFF00])
-                elif payload.subFunc == 2:
-                    validate(payload.data).equal([0x0000])
-                elif payload.subFunc == 3:
-                    validate(len(payload.data)).equal(1)
-                    validate(payload.data[0]).greater_or_equal_than(
-                        0x0000
-                    ).less_or_equal_than(0xFF00)
-                elif payload.subFunc == 4:
-                    validate(payload.data).equal([0x0000])
-                elif payload.subFunc == 0xA:
-                    validate(payload.data).equal([0x0000])
-                elif payload.subFunc == 0xB:
-                    validate(payload.data).equal([0x0000])
-                elif payload.subFunc == 0xC:
-                    validate(payload.data).equal([0x0000])
-                elif payload.subFunc == 0xD:
-                    validate(payload.data).equal([0x0000])
-                elif payload.subFunc == 0xE:
-                    validate(payload.data).equal([0x0000])
-                elif payload.subFunc == 0xF:
-                    validate(payload.data).equal([0x0000])
-                elif payload.subFunc == 0x10:
-                    validate(payload.data).equal([0x0000])
-                elif payload.subFunc == 0x11:
-                    validate(payload.data).equal([0x0000])
-                elif payload.subFunc == 0x12:
-                    validate(payload.data).equal([0x0000])
-                elif payload.subFunc == 0x14:
-                    validate(payload.data).equal([0x0000])
-            elif payload.funcCode == 0xB:
-                pass
-            elif payload.funcCode == 0xC:
-                pass
-            elif payload.funcCode == 0xF:
-                validate(payload.quantityOutput).greater_than(0).less_or_equal_than(
-                    0x7B0
-                )
-                validate(payload.byteCount).equal(math.ceil(payload.quantityOutput / 8))
-                validate(len(payload.outputsValue)).equal(payload.byteCount)
-                validate(payload.startAddr + payload.quantityOutput).less_or_equal_than(
-                    0x10000
-                )
-            elif payload.funcCode == 0x10:
-                validate(payload.quantityRegisters).greater_than(0).less_or_equal_than(
-                    0x7B
+    def fix_raw(self, frame, config_values, io_interface):
+        if io_interface.protocol_interface == "Serial":
+            if len(frame) >= 3:
+                crc = crc16_modbus(frame[:-2])
+                struct.pack_into("<H", frame, len(frame) - 2, crc)
+        elif io_interface.protocol_interface == "TCP Socket":
+            if len(frame) >= MBAP_HEADER.size:
+                # a fresh transaction identifier keeps pipelined replies apart
+                transId = self._next_transaction_identifier()
+                struct.pack_into("!H", frame, 0, transId)
+                struct.pack_into("!H", frame, 4, len(frame) - MBAP_HEADER.size)
+
+    def _build_compiled_msg(
+        self,
+        msg_name,
+        plan,
+        validate,
+        config_values,
+        io_interface,
+        stop_flag,
+        values=None,
+    ):
+        transId = None
+        if io_interface.protocol_interface == "TCP Socket":
+            transId = self._next_transaction_identifier()
+        attempts = 0
+        while not stop_flag():
+            pdu = plan.build(None if values is None else dict(values))
+            adu_class, raw_msg = self._frame_pdu(
+                pdu, config_values, io_interface, transId
+            )
+            if values is not None:
+                # the PDU is fixed; rebuilding can't make it valid
+                if not validate or self.validate_msg(raw_msg, io_interface):
+                    return LazyPacket(adu_class, raw_msg), raw_msg
+                return None
+            attempts += 1
+            if not validate or self.validate_msg(raw_msg, io_interface):
+                self._record_validation(io_interface, msg_name, attempts, validate)
+                return LazyPacket(adu_class, raw_msg), raw_msg
+        self._record_validation(io_interface, msg_name, attempts, validate, False)
+        return None
+
+    def _build_constructed_msg(self, msg_name, config_values, io_interface):
+        """
+        Build a message that is valid by construction
+        :returns: The message; None if the message type can't be constructed
+        """
+        func_code = self.msg_types[msg_name].funcCode.default
+        if not self._can_construct(func_code, io_interface):
+            return None
+        pdu = build_valid_pdu(func_code, io_interface.protocol_interface)
+        adu_class, raw_msg = self._frame_pdu(pdu, config_values, io_interface)
+        self._record_validation(io_interface, msg_name, 1, True, constructed=True)
+        return LazyPacket(adu_class, raw_msg), raw_msg
+
+    def _can_construct(self, func_code, io_interface, samples=64) -> bool:
+        """
+        Self-check (once per function code and interface) that the constructed
+        messages really pass validate_msg
+        """
+        key = (func_code, io_interface.protocol_interface)
+        with self._stats_lock:
+            ok = self._constructible.get(key)
+        if ok is None:
+            ok = build_valid_pdu(func_code, io_interface.protocol_interface) is not None
+            for _ in range(samples if ok else 0):
+                pdu = build_valid_pdu(func_code, io_interface.protocol_interface)
+                _, raw_msg = self._frame_pdu(
+                    pdu, {"Unit Identifier": 0}, io_interface, transId=0
                 )
-                validate(payload.byteCount).equal(2 * payload.quantityRegisters)
-                validate(len(payload.outputsValue)).equal(payload.quantityRegisters)
-                validate(
-                    payload.startAddr + payload.quantityRegisters
-                ).less_or_equal_than(0x10000)
-            elif payload.funcCode == 0x11:
-                pass
-            elif payload.funcCode == 0x14:
-                validate(payload.byteCount).greater_than(6).less_or_equal_than(
-                    0xF5
-                ).equal(len(payload.payload))
-                validate(payload.byteCount % 7).equal(0)
-                total_subresp_length = 2
-                subreq = payload.payload
-                while len(subreq):
-                    validate(subreq.refType).equal(6)
-                    validate(subreq.fileNumber).greater_than(0)
-                    validate(subreq.recordNumber).less_or_equal_than(0x270F)
-                    validate(
-                        subreq.recordNumber + subreq.recordLength
-                    ).less_or_equal_than(0x2710)
-                    total_subresp_length += (2 * subreq.recordLength) + 2
-                    subreq = subreq.payload
-                validate(total_subresp_length).less_or_equal_than(253)
-            elif payload.funcCode == 0x15:
-                validate(payload.dataLength).greater_than(8).less_or_equal_than(
-                    0xFB
-                ).equal(len(payload.payload))
-                subreq = payload.payload
-                while len(subreq):
-                    validate(subreq.refType).equal(6)
-                    validate(subreq.fileNumber).greater_than(0)
-                    validate(subreq.recordNumber).less_or_equal_than(0x270F)
-                    validate(
-                        subreq.recordNumber + subreq.recordLength
-                    ).less_or_equal_than(0x2710)
-                    validate(len(subreq.recordData)).equal(subreq.recordLength * 2)
-                    subreq = subreq.payload
-            elif payload.funcCode == 0x16:
-                pass
-            elif payload.funcCode == 0x17:
-                validate(payload.readQuantityRegisters).greater_than(
-                    0
-                ).less_or_equal_than(0x7D)
-                validate(
-                    payload.readStartingAddr + payload.readQuantityRegisters
-                ).less_or_equal_than(0x10000)
-                validate(payload.writeQuantityRegisters).greater_than(
-                    0
-                ).less_or_equal_than(0x79)
-                validate(
-                    payload.writeStartingAddr + payload.writeQuantityRegisters
-                ).less_or_equal_than(0x10000)
-                validate(payload.byteCount).equal(2 * payload.writeQuantityRegisters)
-                validate(len(payload.writeRegistersValue)).equal(payload.byteCount)
-            elif payload.funcCode == 0x18:
-                pass
-            else:
-                return False
-        except ValueError:
-            return False
+                if not self.validate_msg(raw_msg, io_interface):
+                    log.warning(
+                        f"Constructed function code {func_code:#x} request failed "
+                        + f"validation, using rejection sampling: {raw_msg.hex()}"
+                    )
+                    ok = False
+                    break
+            with self._stats_lock:
+                self._constructible[key] = ok
+        return ok
+
+    def _record_validation(
+        self,
+        io_interface,
+        msg_name,
+        attempts,
+        validate,
+        accepted=True,
+        constructed=False,
+    ):
+        if not validate:
+            return
+        with self._stats_lock:
+            stats = self._validation_stats.setdefault(io_interface, {})
+            counts = stats.setdefault(msg_name, [0, 0, 0])
+            counts[0] += int(accepted)
+            counts[1] += attempts
+            counts[2] += int(constructed)
+
+    def get_stats(self, io_interface):
+        with self._stats_lock:
+            stats = dict(self._validation_stats.get(io_interface, {}))
+        report = super().get_stats(io_interface)
+        for msg_name, (accepted, attempts, constructed) in stats.items():
+            report[f"Validation: {msg_name}"] = {
+                "valid frames": accepted,
+                "constructed": constructed,
+                "build attempts": attempts,
+                "acceptance (%)": round(100 * accepted / max(attempts, 1), 2),
+                "retries per frame": round((attempts - accepted) / max(accepted, 1), 1),
+            }
+        return report
+
+    def send_msg(self, msg_name, msg, raw_msg, config_values, io_interface):
+        window = config_values.get("Pipeline Window")
+        if (
+            io_interface.name != "TCP Socket"
+            or not window
+            or window <= 1
+            or not io_interface.keep_alive
+        ):
+            return super().send_msg(msg_name, msg, raw_msg, config_values, io_interface)
+
+        pipeline = self._pipelines.get(io_interface)
+        if pipeline is None:
+            pipeline = ModbusTCPPipeline(
+                io_interface,
+                window,
+                io_interface.timeout,
+                lambda *reply: self._notify_response(io_interface, *reply),
+                self._get_timeouts(config_values, io_interface),
+            )
+            self._pipelines[io_interface] = pipeline
+        try:
+            unanswered = pipeline.send(msg, raw_msg, msg_name)
+        except Exception as ex:
+            # target unreachable; nothing in flight will be answered
+            unanswered = pipeline.abort()
+            self._notify_response(io_interface, msg_name, raw_msg, None, 0.0)
+            unanswered.append((msg_name, msg, raw_msg, monotonic()))
+            io_interface.device.handle_io_exception(io_interface, ex)
+        return self._report_unanswered(io_interface, unanswered)
+
+    def finish(self, config_values, io_interface):
+        pipeline = self._pipelines.pop(io_interface, None)
+        if pipeline is None:
+            return super().finish(config_values, io_interface)
+        try:
+            unanswered = pipeline.finish()
+        except Exception as ex:
+            unanswered = pipeline.abort()
+            io_interface.device.handle_io_exception(io_interface, ex)
+        return self._report_unanswered(io_interface, unanswered)
+
+    def _report_unanswered(self, io_interface, unanswered: List[Unanswered]) -> int:
+        return sum(
+            self._report_missing(io_interface, name, crash_msg, crash_raw_msg, sent)
+            for name, crash_msg, crash_raw_msg, sent in unanswered
+        )
+
+    def get_probe_msg(self, config_values, io_interface):
+        # read one coil; an exception reply (e.g. no coils) still shows it's alive
+        unitId = config_values.get("Unit Identifier")
+        _, raw_msg = self._frame_pdu(
+            PROBE_PDU,
+            # 0 is the serial broadcast address, which gets no reply
+            {"Unit Identifier": 1 if unitId is None else unitId},
+            io_interface,
+        )
+        return raw_msg
+
+    def response_key(self, rxd, io_interface):
+        if io_interface.protocol_interface == "Serial":
+            # without the address and CRC
+            pdu = rxd[1:-2]
+        elif io_interface.protocol_interface == "TCP Socket":
+            # without the MBAP header (transaction id, length) and unit id
+            pdu = rxd[MBAP_HEADER.size + 1 :]
+        else:
+            pdu = rxd
+        if not pdu:
+            return (), pdu
+        func_code = pdu[0]
+        exception_code = pdu[1] if func_code & 0x80 and len(pdu) > 1 else None
+        return (func_code, exception_code), pdu
+
+    def request_code(self, raw_msg, io_interface):
+        # the function code follows the address, or the MBAP header and unit id
+        offset = (
+            1 if io_interface.protocol_interface == "Serial" else MBAP_HEADER.size + 1
+        )
+        return raw_msg[offset] if len(raw_msg) > offset else None
+
+    def get_framer(self, config_values, io_interface):
+        if io_interface.protocol_interface == "TCP Socket":
+            return MBAP_FRAMER
+        framer = super().get_framer(config_values, io_interface)
+        if framer is None or config_values.get("Serial Framing") == "Inter-frame Gap":
+            return framer
+        return ModbusRTUFramer(framer.gap)
+
+    def check_response(self, rxd, config_values, io_interface):
+        if (
+            io_interface.protocol_interface == "Serial"
+            and config_values.get("Verify Response CRC") == "Yes"
+        ):
+            # an RTU frame followed by its CRC checksums to 0
+            return len(rxd) >= 4 and crc16_modbus(rxd) == 0
         return True
 
+    def validate_msg(self, msg, io_interface) -> bool:
+        validate_frame = REQUEST_VALIDATORS.get(io_interface.protocol_interface)
+        if validate_frame is None:
+            raise NotImplementedError(
+                f"Unsupported I/O interface ({io_interface.name}) for modbus"
+            )
+        return validate_frame(msg)
+
     def get_config(self, selected_msgs, interface):
         # io defaults/hints
         opts = []
@@ -321,6 +423,24 @@ class ModbusProtocol(Protocol):
             opts.append(
                 FloatValue("Timeout", default=5, help_text="Read / response timeout")
             )
+            opts.append(
+                DropDown(
+                    "Serial Framing",
+                    ["Function Code", "Inter-frame Gap", "Timeout"],
+                    default="Function Code",
+                    help_text="Where replies end: at the length their function code "
+                    + "implies, after a silence, or only at the timeout",
+                )
+            )
+            opts.append(self.frame_gap_opt())
+            opts.append(
+                DropDown(
+                    "Verify Response CRC",
+                    ["No", "Yes"],
+                    default="No",
+                    help_text="Treat responses with a bad RTU CRC as crashes",
+                )
+            )
         elif interface == "TCP Socket":
             opts.append(
                 TextValue(
@@ -336,6 +456,15 @@ class ModbusProtocol(Protocol):
                     help_text="Port on which SUT is listening",
                 )
             )
+            opts.append(
+                IntValue(
+                    "Pipeline Window",
+                    default=1,
+                    required=False,
+                    help_text="Requests kept outstanding on one Keep-Alive connection "
+                    + "and matched by transaction ID; 1 disables pipelining",
+                )
+            )
 
         # actual protocol config fields
         opts.append(
@@ -343,4 +472,13 @@ class ModbusProtocol(Protocol):
                 "Unit Identifier", required=False, help_text="Leave blank to randomize"
             )
         )
+        opts.append(
+            DropDown(
+                "Validation Mode",
+                ["Construct", "Reject"],
+                default="Construct",
+                help_text="With validation on, build messages that are valid by "
+                + "construction, or build random ones until one passes",
+            )
+        )
         return BaconConfig(opts)
@@ -3,20 +3,14 @@ import struct
 from scapy.contrib.modbus import ModbusADURequest, ModbusADUResponse
 from scapy.fields import XByteField, FCSField
 
+from ..checksum import crc16_modbus
+
 
 def crc16(data: bytes) -> int:
     """
-    CRC-16-ANSI
+    CRC-16-ANSI (CRC-16/MODBUS)
     """
-    crc = 0xFFFF
-    for byte in data:
-        crc = crc ^ byte
-        for i in range(8):
-            if crc & 1:
-                crc = (crc >> 1) ^ 0xA001
-            else:
-                crc = crc >> 1
-    return crc
+    return crc16_modbus(data)
 
 
 class ModbusSerialADURequest(ModbusADURequest):
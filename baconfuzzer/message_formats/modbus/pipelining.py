@@ -0,0 +1,226 @@
+import logging
+import select
+import socket
+import struct
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from scapy.packet import Packet
+
+from ...io.framing import ReceiveBuffer
+from ...io.rtt import AdaptiveTimeout
+from .framing import MBAP_FRAMER
+
+log = logging.getLogger(__name__)
+
+MBAP_HEADER = struct.Struct("!HHH")
+
+
+class _Request(NamedTuple):
+    msg_name: str
+    msg: Packet
+    raw_msg: bytes
+    sent: float
+    deadline: float
+    # 0 for the first send, then counts confirmation resends
+    attempt: int = 0
+
+
+# (msg name, request, raw request, when it was last sent) of an unanswered request
+Unanswered = Tuple[str, Packet, bytes, float]
+
+
+class ModbusTCPPipeline:
+    """
+    Keeps up to `window` Modbus/TCP requests outstanding on one connection.
+    Replies are matched back to their requests by MBAP transaction identifier;
+    requests still unanswered after the timeout are handed back as crash candidates.
+    With adaptive timeouts each request gets its own deadline, and is resent to
+    confirm it went unanswered.
+    """
+
+    def __init__(
+        self,
+        io_interface,
+        window: int,
+        timeout: float,
+        on_reply: Optional[Callable[[str, bytes, Optional[bytes], float], None]] = None,
+        timeouts: Optional[AdaptiveTimeout] = None,
+    ):
+        """
+        :param timeout: Fixed timeout, used without adaptive timeouts
+        :param on_reply: Called with (msg name, request, reply, latency) when a
+        request is answered, with no reply when it times out, or with an empty one
+        if the target closed the connection
+        """
+        self.io_interface = io_interface
+        self.window = window
+        self.timeout = timeout
+        self.on_reply = on_reply
+        self.timeouts = timeouts
+        self._sock: Optional[socket.socket] = None
+        self._buffer: Optional[ReceiveBuffer] = None
+        # transId -> request, oldest first
+        self._outstanding: "OrderedDict[int, _Request]" = OrderedDict()
+
+    def _connect(self):
+        if self._sock is None:
+            self._sock = self.io_interface.acquire_connection()
+            self._buffer = self.io_interface.connection_buffer(self._sock)
+            self._buffer.clear()
+
+    def _drop_connection(self):
+        if self._sock is not None:
+            self.io_interface.release_connection(self._sock, reusable=False)
+            self._sock = None
+
+    def send(self, msg: Packet, raw_msg: bytes, msg_name: str = "") -> List[Unanswered]:
+        """
+        Send a request without waiting for its reply.
+        :returns: The requests that timed out while waiting for room in the window
+        """
+        expired = []
+        while len(self._outstanding) >= self.window:
+            expired += self._collect(block=True)
+        trans_id = MBAP_HEADER.unpack_from(raw_msg)[0]
+        try:
+            self._connect()
+            self._sock.sendall(raw_msg)
+        except OSError:
+            # Reset by the target; reconnect once. Replies to the requests that were
+            # in flight on the old connection can no longer arrive.
+            log.debug("Pipelined connection reset, reconnecting")
+            self._drop_connection()
+            self._close_outstanding()
+            self._connect()
+            self._sock.sendall(raw_msg)
+        sent = monotonic()
+        self._outstanding[trans_id] = _Request(
+            msg_name, msg, raw_msg, sent, sent + self._timeout(msg_name)
+        )
+        return expired + self._collect(block=False)
+
+    def abort(self) -> List[Unanswered]:
+        """
+        Give up on the connection (e.g. the target can't be reached anymore).
+        :returns: The requests that were still unanswered
+        """
+        now = monotonic()
+        unanswered = [
+            self._unanswered(request, now) for request in self._outstanding.values()
+        ]
+        self._outstanding.clear()
+        self._drop_connection()
+        return unanswered
+
+    def finish(self) -> List[Unanswered]:
+        """
+        Wait for the replies to the requests still outstanding, at most until their
+        timeouts, and close the connection (e.g. when the job stops)
+        :returns: The requests that went unanswered
+        """
+        unanswered = []
+        while self._outstanding and self._sock is not None:
+            unanswered += self._collect(block=True)
+        return unanswered + self.abort()
+
+    def _timeout(self, msg_name: str, attempt=0) -> float:
+        if self.timeouts is None:
+            return self.timeout
+        return self.timeouts.timeout(msg_name, attempt)
+
+    def _collect(self, block: bool) -> List[Unanswered]:
+        """
+        Read whatever replies are available (waiting for the oldest request's
+        deadline if block is set) and expire requests that are past their timeout.
+        """
+        if self._outstanding and self._sock is not None:
+            wait = 0.0
+            if block:
+                deadline = min(r.deadline for r in self._outstanding.values())
+                wait = max(0.0, deadline - monotonic())
+            readable, _, _ = select.select([self._sock], [], [], wait)
+            if readable:
+                self._read()
+        return self._expire()
+
+    def _read(self):
+        try:
+            received = self._buffer.fill(self._sock)
+        except OSError:
+            received = 0
+        if not received:
+            # Closed by the target, e.g. in response to a malformed request.
+            # Like a closed connection in non-pipelined mode, that is not a crash.
+            self._drop_connection()
+            self._close_outstanding()
+            return
+        while True:
+            # a view of the connection's buffer, valid until the next fill
+            reply = self._buffer.next_frame(MBAP_FRAMER)
+            if reply is None:
+                break
+            trans_id = MBAP_HEADER.unpack_from(reply)[0]
+            request = self._outstanding.pop(trans_id, None)
+            if request is None:
+                log.debug(f"Dropping reply to unknown or expired transaction {trans_id}")
+                continue
+            latency = monotonic() - request.sent
+            if self.timeouts is not None:
+                self.timeouts.answered(request.msg_name, latency, request.attempt)
+            if self.on_reply is not None:
+                self.on_reply(request.msg_name, request.raw_msg, reply, latency)
+
+    def _expire(self) -> List[Unanswered]:
+        expired = []
+        now = monotonic()
+        for trans_id, request in list(self._outstanding.items()):
+            if now < request.deadline:
+                continue
+            del self._outstanding[trans_id]
+            if self._resend(trans_id, request, now):
+                continue
+            if self.timeouts is not None:
+                self.timeouts.missed(request.msg_name)
+            expired.append(self._unanswered(request, now))
+        return expired
+
+    def _close_outstanding(self):
+        """
+        Settle the requests in flight on a connection the target closed, as closed
+        (an empty reply) like the non-pipelined exchange does
+        """
+        now = monotonic()
+        if self.on_reply is not None:
+            for r in self._outstanding.values():
+                self.on_reply(r.msg_name, r.raw_msg, b"", now - r.sent)
+        self._outstanding.clear()
+
+    def _unanswered(self, request: _Request, now: float) -> Unanswered:
+        if self.on_reply is not None:
+            self.on_reply(request.msg_name, request.raw_msg, None, now - request.sent)
+        return request.msg_name, request.msg, request.raw_msg, request.sent
+
+    def _resend(self, trans_id: int, request: _Request, now: float) -> bool:
+        """
+        Resend an unanswered request to confirm the miss, if it has retries left
+        :returns: True if resent
+        """
+        if (
+            self.timeouts is None
+            or request.attempt >= self.timeouts.retries
+            or self._sock is None
+        ):
+            return False
+        try:
+            self._sock.sendall(request.raw_msg)
+        except OSError:
+            return False
+        attempt = request.attempt + 1
+        self._outstanding[trans_id] = request._replace(
+            sent=now,
+            deadline=now + self._timeout(request.msg_name, attempt),
+            attempt=attempt,
+        )
+        return True
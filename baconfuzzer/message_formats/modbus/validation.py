@@ -0,0 +1,410 @@
+"""
+Modbus request validity rules, written once as data and compiled into validators
+that check raw frames with struct, without dissecting them into Scapy packets.
+
+REQUEST_PDUS describes, per function code, how Scapy lays out the request PDU
+(fixed fields, a trailing list or file sub-requests) and the rules its fields must
+satisfy. Parsing follows Scapy's dissection, so a frame is valid exactly when
+the original validator (tests/modbus_reference.py) says so;
+tests/test_modbus_validation.py checks the two against each other.
+"""
+import operator
+import struct
+from typing import Callable, Dict, NamedTuple, Optional, Tuple, Union
+
+from scapy.config import conf
+
+from .constructive import (
+    DIAGNOSTICS_DATA,
+    MAX_ADDRESS,
+    MAX_FILE_RECORD,
+    MAX_PDU_SIZE,
+    SERIAL_FUNC_CODES,
+    TCP_FUNC_CODES,
+)
+
+# An expression is a field name, a constant or (operator, *operands):
+#   ("+", a, b), ("*", a, b), ("%", a, b), ("ceil8", a): arithmetic
+#   ("len", list), ("item", list, i): number of items / one item of a list field
+#   ("size", sub-requests): bytes taken up by the sub-requests
+#   ("sum", sub-requests, expression): expression summed over the sub-requests
+# A rule is one of:
+#   ("range", expression, lo, hi), ("le", a, b), ("eq", a, b), ("in", a, values)
+#   ("case", field, {value: rules}): rules for the field's value; others fail
+#   ("each", sub-requests, rules): rules every sub-request must satisfy
+Expression = Union[str, int, tuple]
+Rule = tuple
+
+
+class ListField(NamedTuple):
+    """
+    List of items after the fixed fields
+    """
+
+    name: str
+    item_format: str
+    # field holding the list's size in bytes; None: the list takes the rest of
+    # the PDU
+    count_from: Optional[str] = None
+
+
+class SubRequests(NamedTuple):
+    """
+    File record sub-requests, one after the other up to the end of the PDU
+    """
+
+    name: str
+    fmt: str
+    names: Tuple[str, ...]
+    # (list name, field holding its number of registers) of the record data
+    data: Optional[Tuple[str, str]] = None
+
+
+class PduLayout(NamedTuple):
+    # struct format and names of the fields following the function code
+    fmt: str
+    names: Tuple[str, ...]
+    rules: Tuple[Rule, ...] = ()
+    tail: Union[None, ListField, SubRequests] = None
+    # Scapy keeps bytes after the last field as a payload of the PDU (instead of
+    # dropping them as padding), so they count toward its length
+    keeps_trailing: bool = False
+
+
+def _address_rules(start: str, quantity: str, max_quantity: int):
+    return (
+        ("range", quantity, 1, max_quantity),
+        ("le", ("+", start, quantity), MAX_ADDRESS),
+    )
+
+
+_FILE_RECORD_FIELDS = ("refType", "fileNumber", "recordNumber", "recordLength")
+_FILE_RECORD_RULES = (
+    ("eq", "refType", 6),
+    ("range", "fileNumber", 1, 0xFFFF),
+    ("le", "recordNumber", MAX_FILE_RECORD - 1),
+    ("le", ("+", "recordNumber", "recordLength"), MAX_FILE_RECORD),
+)
+
+
+def _diagnostics_rules(sub_func: int):
+    if sub_func == 3:
+        return (("eq", ("len", "data"), 1), ("le", ("item", "data", 0), 0xFF00))
+    if DIAGNOSTICS_DATA[sub_func] is None:
+        return ()
+    allowed = tuple(tuple(data) for data in DIAGNOSTICS_DATA[sub_func])
+    return (("in", "data", allowed),)
+
+
+def _read_request(max_quantity: int) -> PduLayout:
+    return PduLayout(
+        "HH",
+        ("startAddr", "quantity"),
+        _address_rules("startAddr", "quantity", max_quantity),
+    )
+
+
+_FUNC_CODE_ONLY = PduLayout("", ())
+
+REQUEST_PDUS: Dict[int, PduLayout] = {
+    1: _read_request(0x7D0),
+    2: _read_request(0x7D0),
+    3: _read_request(0x7D),
+    4: _read_request(0x7D),
+    5: PduLayout(
+        "HH",
+        ("outputAddr", "outputValue"),
+        (("in", "outputValue", (0x0000, 0xFF00)),),
+        keeps_trailing=True,
+    ),
+    6: PduLayout("HH", ("registerAddr", "registerValue")),
+    7: _FUNC_CODE_ONLY,
+    8: PduLayout(
+        "H",
+        ("subFunc",),
+        (("case", "subFunc", {f: _diagnostics_rules(f) for f in DIAGNOSTICS_DATA}),),
+        ListField("data", "H"),
+    ),
+    0xB: _FUNC_CODE_ONLY,
+    0xC: _FUNC_CODE_ONLY,
+    0xF: PduLayout(
+        "HHB",
+        ("startAddr", "quantityOutput", "byteCount"),
+        _address_rules("startAddr", "quantityOutput", 0x7B0)
+        + (
+            ("eq", "byteCount", ("ceil8", "quantityOutput")),
+            ("eq", ("len", "outputsValue"), "byteCount"),
+        ),
+        ListField("outputsValue", "B", "byteCount"),
+        keeps_trailing=True,
+    ),
+    0x10: PduLayout(
+        "HHB",
+        ("startAddr", "quantityRegisters", "byteCount"),
+        _address_rules("startAddr", "quantityRegisters", 0x7B)
+        + (
+            ("eq", "byteCount", ("*", 2, "quantityRegisters")),
+            ("eq", ("len", "outputsValue"), "quantityRegisters"),
+        ),
+        ListField("outputsValue", "H", "byteCount"),
+        keeps_trailing=True,
+    ),
+    0x11: _FUNC_CODE_ONLY,
+    0x14: PduLayout(
+        "B",
+        ("byteCount",),
+        (
+            ("range", "byteCount", 7, 0xF5),
+            ("eq", "byteCount", ("size", "subRequests")),
+            ("eq", ("%", "byteCount", 7), 0),
+            ("each", "subRequests", _FILE_RECORD_RULES),
+            # length of the response
+            (
+                "le",
+                ("+", 2, ("sum", "subRequests", ("+", ("*", 2, "recordLength"), 2))),
+                MAX_PDU_SIZE,
+            ),
+        ),
+        SubRequests("subRequests", "BHHH", _FILE_RECORD_FIELDS),
+    ),
+    0x15: PduLayout(
+        "B",
+        ("dataLength",),
+        (
+            ("range", "dataLength", 9, 0xFB),
+            ("eq", "dataLength", ("size", "subRequests")),
+            (
+                "each",
+                "subRequests",
+                _FILE_RECORD_RULES + (("eq", ("len", "recordData"), "recordLength"),),
+            ),
+        ),
+        SubRequests(
+            "subRequests", "BHHH", _FILE_RECORD_FIELDS, ("recordData", "recordLength")
+        ),
+    ),
+    0x16: PduLayout("HHH", ("refAddr", "andMask", "orMask"), keeps_trailing=True),
+    0x17: PduLayout(
+        "HHHHB",
+        (
+            "readStartingAddr",
+            "readQuantityRegisters",
+            "writeStartingAddr",
+            "writeQuantityRegisters",
+            "byteCount",
+        ),
+        _address_rules("readStartingAddr", "readQuantityRegisters", 0x7D)
+        + _address_rules("writeStartingAddr", "writeQuantityRegisters", 0x79)
+        + (
+            ("eq", "byteCount", ("*", 2, "writeQuantityRegisters")),
+            ("eq", ("len", "writeRegistersValue"), "writeQuantityRegisters"),
+        ),
+        ListField("writeRegistersValue", "H", "byteCount"),
+        keeps_trailing=True,
+    ),
+    0x18: PduLayout("H", ("FIFOPointerAddr",), keeps_trailing=True),
+}
+
+_ARITHMETIC = {"+": operator.add, "*": operator.mul, "%": operator.mod}
+# key of the byte size of the sub-requests among the parsed fields
+_SIZE = ".size"
+_MBAP_LENGTH = struct.Struct("!H")
+
+Check = Callable[[dict], bool]
+
+
+def _compile_expression(expression: Expression) -> Callable[[dict], int]:
+    if isinstance(expression, str):
+        return operator.itemgetter(expression)
+    if isinstance(expression, int):
+        return lambda values: expression
+    op, *args = expression
+    if op in _ARITHMETIC:
+        apply = _ARITHMETIC[op]
+        a, b = map(_compile_expression, args)
+        return lambda values: apply(a(values), b(values))
+    if op == "ceil8":
+        a = _compile_expression(args[0])
+        return lambda values: -(-a(values) // 8)
+    if op == "len":
+        name = args[0]
+        return lambda values: len(values[name])
+    if op == "item":
+        name, i = args
+        return lambda values: values[name][i]
+    if op == "size":
+        key = args[0] + _SIZE
+        return operator.itemgetter(key)
+    if op == "sum":
+        name, term = args[0], _compile_expression(args[1])
+        return lambda values: sum(term(sub) for sub in values[name])
+    raise ValueError(f"Unknown operator in {expression}")
+
+
+def _compile_rule(rule: Rule) -> Check:
+    kind, *args = rule
+    if kind == "range":
+        a, lo, hi = _compile_expression(args[0]), args[1], args[2]
+        return lambda values: lo <= a(values) <= hi
+    if kind == "le":
+        a, b = map(_compile_expression, args)
+        return lambda values: a(values) <= b(values)
+    if kind == "eq":
+        a, b = map(_compile_expression, args)
+        return lambda values: a(values) == b(values)
+    if kind == "in":
+        a, allowed = _compile_expression(args[0]), frozenset(args[1])
+        return lambda values: a(values) in allowed
+    if kind == "case":
+        field = args[0]
+        cases = {value: _compile_rules(rules) for value, rules in args[1].items()}
+
+        def check_case(values):
+            check = cases.get(values[field])
+            return check is not None and check(values)
+
+        return check_case
+    if kind == "each":
+        name, check = args[0], _compile_rules(args[1])
+        return lambda values: all(check(sub) for sub in values[name])
+    raise ValueError(f"Unknown rule {rule}")
+
+
+def _compile_rules(rules: Tuple[Rule, ...]) -> Check:
+    checks = tuple(_compile_rule(rule) for rule in rules)
+    return lambda values: all(check(values) for check in checks)
+
+
+def _list_parser(field: ListField):
+    item_size = struct.calcsize(field.item_format)
+
+    def parse(pdu, values, start) -> int:
+        available = len(pdu) - start
+        if field.count_from is None:
+            count = -(-available // item_size)
+        else:
+            count = values[field.count_from] // item_size
+        if count * item_size > available:
+            # Scapy stops at the end of the data, but fails on a partial item
+            if available % item_size:
+                return -1
+            count = available // item_size
+        if count > conf.max_list_count:
+            return -1
+        values[field.name] = struct.unpack_from(
+            f"!{count}{field.item_format}", pdu, start
+        )
+        return start + count * item_size
+
+    return parse
+
+
+def _sub_request_parser(field: SubRequests):
+    header = struct.Struct("!" + field.fmt)
+
+    def parse(pdu, values, start) -> int:
+        size = len(pdu)
+        end = start
+        sub_requests = []
+        while end < size:
+            if size - end < header.size:
+                return -1
+            sub = dict(zip(field.names, header.unpack_from(pdu, end)))
+            end += header.size
+            if field.data is not None:
+                name, count_from = field.data
+                length = min(2 * sub[count_from], size - end)
+                if length % 2 or length // 2 > conf.max_list_count:
+                    return -1
+                sub[name] = struct.unpack_from(f"!{length // 2}H", pdu, end)
+                end += length
+            sub_requests.append(sub)
+        values[field.name] = sub_requests
+        values[field.name + _SIZE] = end - start
+        return end
+
+    return parse
+
+
+def _compile_layout(layout: PduLayout) -> Callable[[memoryview], int]:
+    """
+    :returns: A function that parses a PDU (starting with its function code) and
+    returns its length as Scapy dissects it; -1 if the PDU breaks a rule or can't
+    be dissected
+    """
+    fixed = struct.Struct("!" + layout.fmt)
+    names = layout.names
+    tail_start = 1 + fixed.size
+    check = _compile_rules(layout.rules)
+    if isinstance(layout.tail, ListField):
+        parse_tail = _list_parser(layout.tail)
+    elif isinstance(layout.tail, SubRequests):
+        parse_tail = _sub_request_parser(layout.tail)
+    else:
+        parse_tail = None
+    keeps_trailing = layout.keeps_trailing
+
+    def parse(pdu) -> int:
+        if len(pdu) < tail_start:
+            return -1
+        values = dict(zip(names, fixed.unpack_from(pdu, 1)))
+        end = tail_start
+        if parse_tail is not None:
+            end = parse_tail(pdu, values, end)
+            if end < 0:
+                return -1
+        if not check(values):
+            return -1
+        return len(pdu) if keeps_trailing else end
+
+    return parse
+
+
+def compile_validator(io_interface_name: str) -> Callable[[bytes], bool]:
+    """
+    :returns: A function telling whether a raw request frame (ADU) for the
+    interface is valid
+    """
+    if io_interface_name == "Serial":
+        func_codes = SERIAL_FUNC_CODES
+    elif io_interface_name == "TCP Socket":
+        func_codes = TCP_FUNC_CODES
+    else:
+        raise NotImplementedError(
+            f"Unsupported I/O interface ({io_interface_name}) for modbus"
+        )
+    pdus = {code: _compile_layout(REQUEST_PDUS[code]) for code in func_codes}
+
+    if io_interface_name == "Serial":
+
+        def validate_frame(frame: bytes) -> bool:
+            # address, PDU, CRC (not checked)
+            if len(frame) < 4:
+                return False
+            pdu = memoryview(frame)[1:-2]
+            parse = pdus.get(pdu[0])
+            return parse is not None and 0 < parse(pdu) <= MAX_PDU_SIZE
+
+    else:
+
+        def validate_frame(frame: bytes) -> bool:
+            # MBAP header (transaction id, protocol id, length, unit id), PDU
+            if len(frame) < 8:
+                return False
+            pdu = memoryview(frame)[7:]
+            parse = pdus.get(pdu[0])
+            if parse is None:
+                return False
+            length = parse(pdu)
+            return (
+                0 < length <= MAX_PDU_SIZE
+                and length == _MBAP_LENGTH.unpack_from(frame, 4)[0] - 1
+            )
+
+    return validate_frame
+
+
+REQUEST_VALIDATORS = {
+    name: compile_validator(name) for name in ("Serial", "TCP Socket")
+}
+
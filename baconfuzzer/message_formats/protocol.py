@@ -1,29 +1,102 @@
 import logging
-from logging.handlers import RotatingFileHandler
-from typing import List, Optional, Dict
+import threading
+import time
+import weakref
+from functools import partial
+from time import monotonic
+from types import MappingProxyType
+from typing import Callable, List, Mapping, Optional, Dict, Tuple
 
 
 from scapy.packet import Packet
 from scapy.base_classes import Packet_metaclass
 from scapy.fields import FieldListField
 
-from .config import BaconConfig
+from ..io.flight_recorder import FlightRecorder
+from ..io.framing import Framer, SilenceFramer, silence_gap
+from ..io.rtt import AdaptiveTimeout
+from .compiler import BuildPlan, FieldSpace, LazyPacket, compile_packet
+from .config import BaconConfig, FloatValue
+from .crash_log import open_crash_log
+from .crash_store import (
+    MALFORMED_RESPONSE,
+    NO_RESPONSE,
+    PROBE_FAILED,
+    CrashRecord,
+)
 from .scapy_fields import CustomFieldListField
 
+log = logging.getLogger(__name__)
+
+# job of the crashes recorded by protocols outside of jobs
+DEFAULT_CRASH_JOB = "bacon"
+
 
 class Protocol:
+    """
+    A protocol instance holds the state of one job (see create_protocol); the
+    fuzzed message templates and compiled build plans are built once per protocol
+    class and shared read-only by its instances.
+    """
+
+    # protocol class -> its fuzzed message templates
+    _shared_templates: Dict[type, Mapping[str, Packet]] = {}
+    # protocol class -> message name -> compiled build plan (None if the message
+    # can't be compiled or failed its self-check)
+    _shared_plans: Dict[type, Dict[str, Optional[BuildPlan]]] = {}
+    # protocol class -> message name -> self-check samples its plan passed
+    _shared_plan_checks: Dict[type, Dict[str, int]] = {}
+    _shared_lock = threading.Lock()
+    _compile_lock = threading.Lock()
+
     def __init__(self, crash_path=None):
         self.set_logger(crash_path)
+        self.fuzzed_msgs = self._get_shared_templates()
+        with Protocol._shared_lock:
+            self.build_plans = Protocol._shared_plans.setdefault(type(self), {})
+            self._plan_checks = Protocol._shared_plan_checks.setdefault(type(self), {})
+        # per-job (i.e. per I/O interface) response observers
+        self._response_observers = weakref.WeakKeyDictionary()
+        # per-job adaptive response timeouts
+        self._timeouts = weakref.WeakKeyDictionary()
+        # per-job crash confirmers (see confirm_crashes)
+        self._crash_confirmers = weakref.WeakKeyDictionary()
+        # per-job flight recorders (see record_flights)
+        self._flight_recorders = weakref.WeakKeyDictionary()
 
     def set_logger(self, crash_path):
-        if not crash_path:
-            crash_path = "bacon.log"
-        self._crash_logger = logging.getLogger(crash_path)
-        fh = RotatingFileHandler(crash_path, maxBytes=10 * 1024 * 1024, backupCount=10)
-        fh.level = logging.INFO
-        formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-        fh.setFormatter(formatter)
-        self._crash_logger.addHandler(fh)
+        """
+        :param crash_path: The job's crash directory, which identifies its crashes
+        in the crash store
+        """
+        previous = getattr(self, "_crash_log", None)
+        self._crash_log = open_crash_log(crash_path or DEFAULT_CRASH_JOB)
+        if previous is not None:
+            previous.close()
+
+    def close(self):
+        """
+        Close the crash log of a finished job, once its crashes are stored
+        """
+        if not self._crash_log.close():
+            log.warning(f"Crashes of {self._crash_log.job} not stored in time")
+
+    @classmethod
+    def create_templates(cls) -> Dict[str, Packet]:
+        """
+        Build the fuzzed message templates (fuzzed_msgs). Called once per protocol
+        class; the templates must not be modified afterwards.
+        """
+        return {}
+
+    @classmethod
+    def _get_shared_templates(cls) -> Mapping[str, Packet]:
+        with Protocol._shared_lock:
+            templates = Protocol._shared_templates.get(cls)
+            if templates is None:
+                templates = MappingProxyType(cls.create_templates())
+                Protocol._shared_templates[cls] = templates
+            return templates
 
     def get_msg_names(self, io_interface_name: Optional[str] = None) -> Dict[str, bool]:
         """
@@ -32,19 +105,405 @@ class Protocol:
         """
         raise NotImplementedError()
 
+    def build_msg(
+        self,
+        msg_name: str,
+        validate: bool,
+        config_values: dict,
+        io_interface,
+        stop_flag,
+    ) -> Optional[Tuple[Packet, bytes]]:
+        """
+        Generate (but don't send) a single fuzzed message. Must be safe to call from
+        several generator threads at once.
+        :returns: The message and its raw bytes; None if interrupted by stop_flag
+        """
+        raise NotImplementedError()
+
+    def send_msg(
+        self,
+        msg_name: str,
+        msg: Packet,
+        raw_msg: bytes,
+        config_values: dict,
+        io_interface,
+    ) -> int:
+        """
+        Send a message generated by build_msg and check the target replied. On
+        concurrent interfaces the replies checked are those to earlier messages
+        that arrived in the meantime.
+        :returns: Number of crashes detected; for a single message True if crash,
+        False if no crash
+        """
+        log.debug("Generated msg %s", msg)
+        if io_interface.concurrent:
+            exchanges = io_interface.submit(
+                msg_name, msg, raw_msg, self._get_timeouts(config_values, io_interface)
+            )
+            return sum(
+                self._check_reply(*exchange, config_values, io_interface)
+                for exchange in exchanges
+            )
+        rxd, latency = self._exchange(msg_name, raw_msg, config_values, io_interface)
+        return self._check_reply(
+            msg_name, msg, raw_msg, rxd, latency, config_values, io_interface
+        )
+
+    def finish(self, config_values: dict, io_interface) -> int:
+        """
+        Settle the messages still in flight when the job using io_interface stops
+        (e.g. pipelined requests), so crashes they caused are still recorded
+        :returns: Number of crashes detected
+        """
+        if not io_interface.concurrent:
+            return 0
+        return sum(
+            self._check_reply(*exchange, config_values, io_interface)
+            for exchange in io_interface.finish()
+        )
+
+    def _check_reply(
+        self,
+        msg_name: str,
+        msg: Packet,
+        raw_msg: bytes,
+        rxd: Optional[bytes],
+        latency: float,
+        config_values: dict,
+        io_interface,
+    ) -> bool:
+        """
+        Record the outcome of sending a message
+        :returns: True if crash; False if no crash
+        """
+        self._notify_response(io_interface, msg_name, raw_msg, rxd, latency)
+        log.debug("received: %s", rxd)
+        if rxd is None:
+            return self._report_missing(
+                io_interface, msg_name, msg, raw_msg, monotonic() - latency
+            )
+        if not self.check_response(rxd, config_values, io_interface):
+            log.warning("Malformed response %s to input %s", bytes(rxd), bytes(raw_msg))
+            self._record_crash(
+                io_interface,
+                MALFORMED_RESPONSE,
+                msg_name,
+                msg,
+                raw_msg,
+                rxd,
+                latency,
+                self._flight_context(io_interface),
+            )
+            return True
+        log.debug("succeeded with input %s", raw_msg)
+        return False
+
+    def _exchange(
+        self, msg_name: str, raw_msg: bytes, config_values: dict, io_interface
+    ) -> Tuple[Optional[bytes], float]:
+        """
+        Send a message and wait for the reply. With adaptive timeouts, a missing
+        reply is confirmed by resending the message.
+        :returns: The reply (None if there was none), and the seconds waited for it
+        """
+        timeouts = self._get_timeouts(config_values, io_interface)
+        if timeouts is None:
+            sent = monotonic()
+            rxd = io_interface.transmit(raw_msg, True)
+            return rxd, monotonic() - sent
+        for attempt in range(timeouts.retries + 1):
+            sent = monotonic()
+            rxd = io_interface.transmit(
+                raw_msg, True, timeouts.timeout(msg_name, attempt)
+            )
+            latency = monotonic() - sent
+            if rxd is not None:
+                timeouts.answered(msg_name, latency, attempt)
+                return rxd, latency
+            if attempt < timeouts.retries:
+                log.debug(f"No reply to {msg_name}, resending to confirm")
+        timeouts.missed(msg_name)
+        return None, latency
+
+    def get_probe_msg(self, config_values: dict, io_interface) -> Optional[bytes]:
+        """
+        A known-good message the target answers while it is healthy, sent to check
+        its liveness in flood mode. Called for every probe, so per-message fields
+        (e.g. transaction identifiers) can change.
+        :returns: The raw probe; None if the protocol has none
+        """
+        return None
+
+    def probe(self, raw_probe: bytes, config_values: dict, io_interface) -> bool:
+        """
+        Exchange a liveness probe, confirming a miss like any other message
+        :returns: True if the target answered it acceptably
+        """
+        rxd, _ = self._exchange(
+            "Liveness probe", raw_probe, config_values, io_interface
+        )
+        if not rxd:
+            # no reply, or the target closed the connection
+            return False
+        return self.check_response(rxd, config_values, io_interface)
+
+    def _get_timeouts(
+        self, config_values: dict, io_interface
+    ) -> Optional[AdaptiveTimeout]:
+        """
+        :returns: The adaptive response timeouts of the job using io_interface;
+        None if the job waits the interface's fixed timeout
+        """
+        if config_values.get("Adaptive Timeout") == "No":
+            return None
+        timeouts = self._timeouts.get(io_interface)
+        if timeouts is None:
+            floor = config_values.get("Timeout Floor")
+            retries = config_values.get("Confirmation Retries")
+            timeouts = AdaptiveTimeout(
+                0.05 if floor is None else floor,
+                io_interface.timeout,
+                1 if retries is None else retries,
+            )
+            self._timeouts[io_interface] = timeouts
+        return timeouts
+
+    def get_framer(self, config_values: dict, io_interface) -> Optional[Framer]:
+        """
+        How the job's replies are framed on io_interface. Serial replies end with
+        an inter-frame silence unless the "Serial Framing" option says otherwise.
+        :returns: The framer; None reads whatever arrives before the timeout (or,
+        on stream sockets, whatever one receive returns)
+        """
+        if (
+            io_interface.protocol_interface != "Serial"
+            or config_values.get("Serial Framing") == "Timeout"
+        ):
+            return None
+        return SilenceFramer(self._get_frame_gap(config_values))
+
+    @staticmethod
+    def frame_gap_opt() -> FloatValue:
+        """
+        The "Inter-frame Gap" option of protocols that frame serial replies by
+        silence (see get_framer)
+        """
+        return FloatValue(
+            "Inter-frame Gap",
+            required=False,
+            help_text="Milliseconds of silence that end a reply; blank uses 3.5 "
+            + "characters at the baud rate (raise it for USB adapters that deliver "
+            + "replies in bursts)",
+        )
+
+    def _get_frame_gap(self, config_values: dict) -> float:
+        """
+        :returns: The "Inter-frame Gap" option in seconds, 3.5 characters at the
+        baud rate if left blank
+        """
+        gap = config_values.get("Inter-frame Gap")
+        if gap:
+            return gap / 1000
+        return silence_gap(config_values.get("Baud Rate") or 9600)
+
+    def check_response(self, rxd: bytes, config_values: dict, io_interface) -> bool:
+        """
+        Check a reply received by send_msg. A reply that fails the check is
+        recorded like a missing reply.
+        :returns: True if the reply is acceptable
+        """
+        return True
+
+    def observe_responses(
+        self,
+        io_interface,
+        observer: Optional[Callable[[str, bytes, Optional[bytes], float], None]],
+    ):
+        """
+        Call observer(msg_name, raw_msg, response, latency) for every message the
+        job using io_interface sends; the response is None if there was no reply
+        """
+        if observer is None:
+            self._response_observers.pop(io_interface, None)
+        else:
+            self._response_observers[io_interface] = observer
+
+    def _notify_response(self, io_interface, msg_name, raw_msg, rxd, latency):
+        recorder = self._flight_recorders.get(io_interface)
+        if recorder is not None:
+            recorder.record(msg_name, raw_msg, rxd, latency)
+        observer = self._response_observers.get(io_interface)
+        if observer is not None:
+            observer(msg_name, raw_msg, rxd, latency)
+
+    def record_flights(self, io_interface, recorder: Optional[FlightRecorder]):
+        """
+        Keep the last messages the job using io_interface sends in recorder, and
+        store them with each of its crashes
+        """
+        if recorder is None:
+            self._flight_recorders.pop(io_interface, None)
+        else:
+            self._flight_recorders[io_interface] = recorder
+
+    def _flight_context(self, io_interface) -> tuple:
+        """
+        :returns: The job's recorded messages, the crashing one last; empty if it
+        has no flight recorder
+        """
+        recorder = self._flight_recorders.get(io_interface)
+        if recorder is None:
+            return ()
+        return tuple(recorder.snapshot())
+
+    def confirm_crashes(
+        self,
+        io_interface,
+        confirmer: Optional[Callable[[float, Callable[[], None]], None]],
+    ):
+        """
+        Hand missing replies of the job using io_interface to
+        confirmer(sent, record) instead of recording them as crashes; the
+        confirmer calls record() if the target really failed after `sent`
+        """
+        if confirmer is None:
+            self._crash_confirmers.pop(io_interface, None)
+        else:
+            self._crash_confirmers[io_interface] = confirmer
+
+    def _report_missing(
+        self, io_interface, msg_name: str, msg, raw_msg, sent: float
+    ) -> bool:
+        """
+        A message sent at `sent` went unanswered
+        :returns: True if it was recorded as a crash; False if it awaits
+        confirmation
+        """
+        # the messages up to this one, whenever the crash is confirmed
+        record = partial(
+            self._record_crash,
+            io_interface,
+            NO_RESPONSE,
+            msg_name,
+            msg,
+            raw_msg,
+            latency=monotonic() - sent,
+            context=self._flight_context(io_interface),
+        )
+        confirmer = self._crash_confirmers.get(io_interface)
+        if confirmer is None:
+            log.warning("Crash detected with input %s", bytes(raw_msg))
+            record()
+            return True
+        log.debug("No reply to input %s, awaiting confirmation", bytes(raw_msg))
+        confirmer(sent, record)
+        return False
+
+    def response_key(self, rxd: bytes, io_interface) -> Tuple[tuple, bytes]:
+        """
+        Split a response for its signature
+        :returns: Protocol fields that identify the kind of response (e.g. a
+        function or exception code), and the body to fingerprint (without
+        per-message fields such as transaction identifiers or checksums)
+        """
+        return (), rxd
+
+    def request_code(self, raw_msg: bytes, io_interface) -> Optional[int]:
+        """
+        :returns: The request's function (or command) code, stored with its
+        crashes to query them by; None if the protocol has none
+        """
+        return None
+
     def fuzz_msg(
         self,
         msg_name: str,
         validate: bool,
         config_values: dict,
         io_interface,
-        stop_flag: dict,
+        stop_flag,
     ) -> bool:
         """
         Generate and send a single fuzzed message.
         :returns: True if crash; False if no crash
         """
-        raise NotImplementedError()
+        built = self.build_msg(msg_name, validate, config_values, io_interface, stop_flag)
+        if built is None:
+            return False
+        msg, raw_msg = built
+        return self.send_msg(msg_name, msg, raw_msg, config_values, io_interface)
+
+    def compile_msgs(self, self_check=64):
+        """
+        Compile the fuzzed message templates (self.fuzzed_msgs) into build plans.
+        Plans that don't reproduce Scapy's output on self_check random samples are
+        discarded. Compiled once per protocol class; a plan is checked again if a
+        job asks for more samples than it passed so far.
+        """
+        with Protocol._compile_lock:
+            for msg_name, template in self.fuzzed_msgs.items():
+                if msg_name in self.build_plans:
+                    plan = self.build_plans[msg_name]
+                else:
+                    plan = compile_packet(template)
+                checked = self._plan_checks.get(msg_name, 0)
+                if plan is not None and self_check > checked:
+                    if plan.check(self_check - checked):
+                        self._plan_checks[msg_name] = self_check
+                    else:
+                        log.warning(f"Not using compiled builder for {msg_name}")
+                        plan = None
+                self.build_plans[msg_name] = plan
+
+    def _get_build_plan(self, msg_name: str, config_values: dict) -> Optional[BuildPlan]:
+        """
+        :returns: The compiled plan for msg_name; None if the message is built with Scapy
+        """
+        if config_values.get("Frame Builder") == "Scapy":
+            return None
+        return self.build_plans.get(msg_name)
+
+    def get_field_space(self, msg_name: str) -> Optional[FieldSpace]:
+        """
+        The values to visit when enumerating a message. Requires compile_msgs.
+        :returns: The message's field space; None if it can't be enumerated
+        """
+        plan = self.build_plans.get(msg_name)
+        if plan is None:
+            return None
+        return plan.field_space()
+
+    def build_enumerated_msg(
+        self,
+        msg_name: str,
+        values: dict,
+        validate: bool,
+        config_values: dict,
+        io_interface,
+    ) -> Optional[Tuple[Packet, bytes]]:
+        """
+        Build the message with the given field values (a point of get_field_space).
+        :returns: The message and its raw bytes; None if it doesn't pass validation
+        """
+        plan = self.build_plans[msg_name]
+        raw_msg = plan.build(dict(values))
+        return LazyPacket(plan.packet_class, raw_msg), raw_msg
+
+    def fix_raw(self, frame: memoryview, config_values: dict, io_interface):
+        """
+        Restore, in place, the fields of a raw frame that byte-level mutation breaks
+        (lengths, checksums, parity), so the mutant isn't rejected for them
+        """
+
+    def get_stats(self, io_interface) -> dict:
+        """
+        Protocol statistics of the job using io_interface, shown with the job's
+        statistics
+        """
+        timeouts = self._timeouts.get(io_interface)
+        if timeouts is None:
+            return {}
+        return {"Response timeouts": timeouts.get_stats()}
 
     def validate_msg(self, msg, io_interface) -> bool:
         """
@@ -64,7 +523,8 @@ class Protocol:
         """
         raise NotImplementedError()
 
-    def _apply_custom_fields(self, packet_meta: Packet_metaclass) -> Packet:
+    @staticmethod
+    def _apply_custom_fields(packet_meta: Packet_metaclass) -> Packet:
         for i in range(len(packet_meta.fields_desc)):
             field = packet_meta.fields_desc[i]
             if isinstance(field, FieldListField):
@@ -76,9 +536,60 @@ class Protocol:
         packet.fields = {}
         return packet
 
-    def _record_crash(self, io_interface, msg, raw_msg):
-        self._crash_logger.warning(
-            f"Crash detected on interface {io_interface.get_info()}"
+    def _record_crash(
+        self,
+        io_interface,
+        kind: str,
+        msg_name: Optional[str],
+        msg,
+        raw_msg,
+        rxd: Optional[bytes] = None,
+        latency: Optional[float] = None,
+        context: tuple = (),
+    ):
+        """
+        :param context: The messages sent before the crash (see record_flights)
+        """
+        raw_msg = bytes(raw_msg)
+        signature = None
+        if rxd is not None:
+            rxd = bytes(rxd)
+            signature = self.response_key(rxd, io_interface)[0]
+        # str(msg) is formatted by the crash log's writer thread
+        self._crash_log.record(
+            CrashRecord(
+                self._crash_log.job,
+                time.time(),
+                kind,
+                io_interface.get_info(),
+                msg_name,
+                self.request_code(raw_msg, io_interface),
+                raw_msg,
+                msg,
+                rxd,
+                signature,
+                latency,
+                context=context,
+            )
+        )
+
+    def record_probe_crash(
+        self, io_interface, raw_probe: bytes, recent: List[Tuple[str, bytes]]
+    ):
+        """
+        Record a liveness probe that went unanswered in flood mode, with the frames
+        sent before it as the crash's context
+        :param recent: (message name, raw frame) of the recent frames, oldest first
+        """
+        self._crash_log.record(
+            CrashRecord(
+                self._crash_log.job,
+                time.time(),
+                PROBE_FAILED,
+                io_interface.get_info(),
+                "Liveness probe",
+                self.request_code(raw_probe, io_interface),
+                bytes(raw_probe),
+                context=tuple(recent),
+            )
         )
-        self._crash_logger.warning(f"\tMessage: {msg}")
-        self._crash_logger.warning(f"\tRaw message: {raw_msg}")
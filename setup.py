@@ -4,10 +4,19 @@ setup(
     name="baconfuzzer",
     version="0.1",
     packages=["baconfuzzer"],
-    install_requires=["flask", "fluent-validator", "scapy", "pyserial", "requests"],
+    install_requires=[
+        "flask",
+        "scapy",
+        "pyserial",
+        "requests",
+        "numpy",
+    ],
+    extras_require={"test": ["pytest", "fluent-validator"]},
     python_requires=">=3.7",
     entry_points="""
     [console_scripts]
     baconfuzz=baconfuzzer.bacon_fuzzer_webapp:main
+    bacon-crashes=baconfuzzer.message_formats.crash_store:main
+    bacon-records=baconfuzzer.io.records:main
     """,
 )
@@ -0,0 +1,188 @@
+"""
+The original Modbus request validator, kept as the reference the compiled
+validators are checked against
+"""
+import math
+
+from fluent_validator import validate
+from scapy.contrib.modbus import ModbusADURequest
+
+from baconfuzzer.message_formats.modbus.constructive import (
+    SERIAL_FUNC_CODES,
+    TCP_FUNC_CODES,
+)
+from baconfuzzer.message_formats.modbus.modbus_serial_adu import (
+    ModbusSerialADURequest,
+)
+
+
+def scapy_validate(msg: bytes, io_interface_name: str) -> bool:
+    """
+    Dissects the frame with Scapy and checks the fields with fluent_validator
+    """
+    try:
+        if io_interface_name == "Serial":
+            adu = ModbusSerialADURequest(msg)
+            validate(len(adu)).greater_than(3)
+        elif io_interface_name == "TCP Socket":
+            adu = ModbusADURequest(msg)
+            validate(len(adu)).greater_than(7)
+            validate(len(adu.payload)).equal(adu.len - 1)
+        else:
+            raise NotImplementedError(
+                f"Unsupported I/O interface ({io_interface_name}) for modbus"
+            )
+
+        payload = adu.payload
+        validate(len(payload)).less_or_equal_than(253)
+        if io_interface_name == "Serial":
+            validate(payload.funcCode).is_in(*SERIAL_FUNC_CODES)
+        elif io_interface_name == "TCP Socket":
+            validate(payload.funcCode).is_in(*TCP_FUNC_CODES)
+
+        if payload.funcCode == 1:
+            validate(payload.quantity).greater_than(0).less_or_equal_than(0x7D0)
+            validate(payload.startAddr + payload.quantity).less_or_equal_than(
+                0x10000
+            )
+        elif payload.funcCode == 2:
+            validate(payload.quantity).greater_than(0).less_or_equal_than(0x7D0)
+            validate(payload.startAddr + payload.quantity).less_or_equal_than(
+                0x10000
+            )
+        elif payload.funcCode == 3:
+            validate(payload.quantity).greater_than(0).less_or_equal_than(0x7D)
+            validate(payload.startAddr + payload.quantity).less_or_equal_than(
+                0x10000
+            )
+        elif payload.funcCode == 4:
+            validate(payload.quantity).greater_than(0).less_or_equal_than(0x7D)
+            validate(payload.startAddr + payload.quantity).less_or_equal_than(
+                0x10000
+            )
+        elif payload.funcCode == 5:
+            validate(payload.outputValue).is_in(0x0000, 0xFF00)
+        elif payload.funcCode == 6:
+            pass
+        elif payload.funcCode == 7:
+            pass
+        elif payload.funcCode == 8:
+            validate(payload.subFunc).is_in(
+                0, 1, 2, 3, 4, 0xA, 0xB, 0xC, 0xD, 0xE, 0xF, 0x10, 0x11, 0x12, 0x14
+            )
+            if payload.subFunc == 0:
+                pass
+            elif payload.subFunc == 1:
+                validate(payload.data).is_in([0x0000], [0xFF00])
+            elif payload.subFunc == 2:
+                validate(payload.data).equal([0x0000])
+            elif payload.subFunc == 3:
+                validate(len(payload.data)).equal(1)
+                validate(payload.data[0]).greater_or_equal_than(
+                    0x0000
+                ).less_or_equal_than(0xFF00)
+            elif payload.subFunc == 4:
+                validate(payload.data).equal([0x0000])
+            elif payload.subFunc == 0xA:
+                validate(payload.data).equal([0x0000])
+            elif payload.subFunc == 0xB:
+                validate(payload.data).equal([0x0000])
+            elif payload.subFunc == 0xC:
+                validate(payload.data).equal([0x0000])
+            elif payload.subFunc == 0xD:
+                validate(payload.data).equal([0x0000])
+            elif payload.subFunc == 0xE:
+                validate(payload.data).equal([0x0000])
+            elif payload.subFunc == 0xF:
+                validate(payload.data).equal([0x0000])
+            elif payload.subFunc == 0x10:
+                validate(payload.data).equal([0x0000])
+            elif payload.subFunc == 0x11:
+                validate(payload.data).equal([0x0000])
+            elif payload.subFunc == 0x12:
+                validate(payload.data).equal([0x0000])
+            elif payload.subFunc == 0x14:
+                validate(payload.data).equal([0x0000])
+        elif payload.funcCode == 0xB:
+            pass
+        elif payload.funcCode == 0xC:
+            pass
+        elif payload.funcCode == 0xF:
+            validate(payload.quantityOutput).greater_than(0).less_or_equal_than(
+                0x7B0
+            )
+            validate(payload.byteCount).equal(math.ceil(payload.quantityOutput / 8))
+            validate(len(payload.outputsValue)).equal(payload.byteCount)
+            validate(payload.startAddr + payload.quantityOutput).less_or_equal_than(
+                0x10000
+            )
+        elif payload.funcCode == 0x10:
+            validate(payload.quantityRegisters).greater_than(0).less_or_equal_than(
+                0x7B
+            )
+            validate(payload.byteCount).equal(2 * payload.quantityRegisters)
+            validate(len(payload.outputsValue)).equal(payload.quantityRegisters)
+            validate(
+                payload.startAddr + payload.quantityRegisters
+            ).less_or_equal_than(0x10000)
+        elif payload.funcCode == 0x11:
+            pass
+        elif payload.funcCode == 0x14:
+            validate(payload.byteCount).greater_than(6).less_or_equal_than(
+                0xF5
+            ).equal(len(payload.payload))
+            validate(payload.byteCount % 7).equal(0)
+            total_subresp_length = 2
+            subreq = payload.payload
+            while len(subreq):
+                validate(subreq.refType).equal(6)
+                validate(subreq.fileNumber).greater_than(0)
+                validate(subreq.recordNumber).less_or_equal_than(0x270F)
+                validate(
+                    subreq.recordNumber + subreq.recordLength
+                ).less_or_equal_than(0x2710)
+                total_subresp_length += (2 * subreq.recordLength) + 2
+                subreq = subreq.payload
+            validate(total_subresp_length).less_or_equal_than(253)
+        elif payload.funcCode == 0x15:
+            validate(payload.dataLength).greater_than(8).less_or_equal_than(
+                0xFB
+            ).equal(len(payload.payload))
+            subreq = payload.payload
+            while len(subreq):
+                validate(subreq.refType).equal(6)
+                validate(subreq.fileNumber).greater_than(0)
+                validate(subreq.recordNumber).less_or_equal_than(0x270F)
+                validate(
+                    subreq.recordNumber + subreq.recordLength
+                ).less_or_equal_than(0x2710)
+                validate(len(subreq.recordData)).equal(subreq.recordLength)
+                subreq = subreq.payload
+        elif payload.funcCode == 0x16:
+            pass
+        elif payload.funcCode == 0x17:
+            validate(payload.readQuantityRegisters).greater_than(
+                0
+            ).less_or_equal_than(0x7D)
+            validate(
+                payload.readStartingAddr + payload.readQuantityRegisters
+            ).less_or_equal_than(0x10000)
+            validate(payload.writeQuantityRegisters).greater_than(
+                0
+            ).less_or_equal_than(0x79)
+            validate(
+                payload.writeStartingAddr + payload.writeQuantityRegisters
+            ).less_or_equal_than(0x10000)
+            validate(payload.byteCount).equal(2 * payload.writeQuantityRegisters)
+            validate(len(payload.writeRegistersValue)).equal(
+                payload.writeQuantityRegisters
+            )
+        elif payload.funcCode == 0x18:
+            pass
+        else:
+            return False
+    except (ValueError, AttributeError):
+        # rule failed, or the frame could not be dissected into a modbus PDU
+        return False
+    return True
+
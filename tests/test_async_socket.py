@@ -0,0 +1,57 @@
+import socketserver
+import threading
+
+import pytest
+
+from baconfuzzer.devices import BaseDevice
+from baconfuzzer.io.async_socket import BaconAsyncSocketIO
+from baconfuzzer.message_formats.modbus.modbus import ModbusProtocol
+
+READ_COILS = bytes.fromhex("000100000006010100000001")
+
+
+class SilentHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # a target that hangs: takes every request, answers none
+        while self.request.recv(4096):
+            pass
+
+
+@pytest.fixture
+def silent_target():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SilentHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_stop_settles_the_messages_in_flight(silent_target, tmp_path, monkeypatch):
+    # the crash store lives in the working directory
+    monkeypatch.chdir(tmp_path)
+    config = {
+        "Destination IP": "127.0.0.1",
+        "Destination Port": silent_target,
+        "Concurrent Sessions": 4,
+        "timeout": 0.2,
+        "Adaptive Timeout": "No",
+    }
+    io_interface = BaconAsyncSocketIO(config, BaseDevice)
+    io_interface.configure(config)
+    protocol = ModbusProtocol()
+    replies = []
+    protocol.observe_responses(io_interface, lambda *reply: replies.append(reply))
+    try:
+        crashes = 0
+        for _ in range(4):
+            crashes += protocol.send_msg(
+                "Read Coils", None, READ_COILS, config, io_interface
+            )
+        # the job stops with the messages still in flight
+        crashes += protocol.finish(config, io_interface)
+        assert crashes == 4
+        assert [rxd for _, _, rxd, _ in replies] == [None] * 4
+    finally:
+        io_interface.teardown()
+        protocol.close()
@@ -0,0 +1,36 @@
+import pytest
+
+from baconfuzzer.message_formats.compiler import BuildPlan
+from baconfuzzer.message_formats.modbus.modbus import ModbusProtocol
+
+
+@pytest.fixture
+def checks(monkeypatch):
+    samples = []
+    check = BuildPlan.check
+
+    def counting_check(plan, samples_=64):
+        samples.append(samples_)
+        return check(plan, samples_)
+
+    monkeypatch.setattr(BuildPlan, "check", counting_check)
+    return samples
+
+
+def test_unchecked_plans_are_checked_when_a_job_asks(checks):
+    # a class of its own, so the plans aren't shared with other tests
+    protocol = type("Protocol", (ModbusProtocol,), {})()
+    try:
+        protocol.compile_msgs(0)
+        assert not checks
+        compiled = sum(plan is not None for plan in protocol.build_plans.values())
+        assert compiled
+        protocol.compile_msgs(8)
+        assert checks == [8] * compiled
+        # only the samples not checked yet
+        protocol.compile_msgs(16)
+        assert checks == [8] * compiled + [8] * compiled
+        protocol.compile_msgs(16)
+        assert len(checks) == 2 * compiled
+    finally:
+        protocol.close()
@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from baconfuzzer.message_formats.checksum import crc16_modbus, crc16_modbus_batch
+
+
+def crc16_bitwise(data: bytes) -> int:
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+@pytest.fixture
+def frames():
+    rng = random.Random(1)
+    # typical RTU request sizes (address + PDU), and an empty frame
+    return [b""] + [
+        bytes(rng.getrandbits(8) for _ in range(rng.randint(1, 40)))
+        for _ in range(1000)
+    ]
+
+
+@pytest.mark.parametrize(
+    "data, crc",
+    [
+        (b"123456789", 0x4B37),
+        # read 10 holding registers from unit 1: CRC bytes C5 CD on the wire
+        (bytes.fromhex("01030000000a"), 0xCDC5),
+        (b"", 0xFFFF),
+    ],
+)
+def test_known_vectors(data, crc):
+    assert crc16_modbus(data) == crc
+    assert crc16_bitwise(data) == crc
+    assert crc16_modbus_batch([data]) == [crc]
+
+
+def test_table_matches_bitwise(frames):
+    assert [crc16_modbus(f) for f in frames] == [crc16_bitwise(f) for f in frames]
+
+
+def test_batch_matches_bitwise(frames):
+    assert crc16_modbus_batch(frames) == [crc16_bitwise(f) for f in frames]
+
+
+def test_incremental(frames):
+    for frame in frames:
+        for split in range(len(frame) + 1):
+            prefix = crc16_modbus(frame[:split])
+            assert crc16_modbus(frame[split:], prefix) == crc16_bitwise(frame)
+    assert crc16_modbus_batch([b"\x03\x00"], crc16_modbus(b"\x01")) == [
+        crc16_bitwise(b"\x01\x03\x00")
+    ]
+
+
+def test_frame_with_crc_checksums_to_zero(frames):
+    for frame in frames:
+        assert crc16_modbus(frame + crc16_modbus(frame).to_bytes(2, "little")) == 0
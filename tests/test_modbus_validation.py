@@ -0,0 +1,89 @@
+"""
+Differential check of the compiled Modbus request validators against
+scapy_validate(), the reference, over a seeded corpus of valid and mutated frames
+"""
+import random
+import struct
+
+import pytest
+from scapy.compat import raw
+
+from baconfuzzer.message_formats.checksum import crc16_modbus
+from baconfuzzer.message_formats.modbus.constructive import VALID_PDU_GENERATORS
+from baconfuzzer.message_formats.modbus.modbus import ModbusProtocol
+from baconfuzzer.message_formats.modbus.pipelining import MBAP_HEADER
+from baconfuzzer.message_formats.modbus.validation import REQUEST_VALIDATORS
+
+from .modbus_reference import scapy_validate
+
+FRAMES = 5000
+SEED = 1
+
+
+@pytest.fixture(scope="module")
+def templates():
+    protocol = ModbusProtocol()
+    yield list(protocol.fuzzed_msgs.values())
+    protocol.close()
+
+
+def frame(pdu: bytes, interface: str) -> bytes:
+    if interface == "Serial":
+        adu = bytes((random.getrandbits(8),)) + pdu
+        return adu + struct.pack("H", crc16_modbus(adu))
+    mbap = MBAP_HEADER.pack(random.getrandbits(16), 0, len(pdu) + 1)
+    return mbap + bytes((random.getrandbits(8),)) + pdu
+
+
+def random_pdu(templates) -> bytes:
+    if random.random() < 0.5:
+        return raw(random.choice(templates))
+    return random.choice(list(VALID_PDU_GENERATORS.values()))()
+
+
+def mutate(data: bytes, interface: str) -> bytes:
+    data = bytearray(data)
+    header = 7 if interface == "TCP Socket" else 1
+    kind = random.randrange(7)
+    if kind == 0 and data:
+        data[random.randrange(len(data))] ^= 1 << random.randrange(8)
+    elif kind == 1 and len(data) > header:
+        # small values hit the counts, quantities and sub-function codes
+        i = random.randrange(header, len(data))
+        data[i] = random.choice((0, 1, 2, 3, 6, 7, 0xFF, random.getrandbits(8)))
+    elif kind == 2:
+        del data[random.randrange(len(data) + 1) :]
+    elif kind == 3:
+        data += bytes(random.getrandbits(8) for _ in range(random.randint(1, 4)))
+    elif kind == 4 and data:
+        del data[random.randrange(len(data))]
+    elif kind == 5 and interface == "TCP Socket" and len(data) >= 6:
+        length = max(0, len(data) - 6 + random.randint(-2, 2))
+        data[4:6] = length.to_bytes(2, "big")
+    else:
+        data = bytearray(random.getrandbits(8) for _ in range(random.randrange(12)))
+    return bytes(data)
+
+
+@pytest.mark.parametrize("interface", ["Serial", "TCP Socket"])
+def test_compiled_validator_matches_scapy(templates, interface):
+    # the PDU generators draw from the random module
+    random.seed(SEED)
+    validate_frame = REQUEST_VALIDATORS[interface]
+    valid = 0
+    mismatches = []
+    for _ in range(FRAMES):
+        data = frame(random_pdu(templates), interface)
+        for _ in range(random.choice((0, 0, 1, 2))):
+            data = mutate(data, interface)
+        try:
+            expected = scapy_validate(data, interface)
+        except Exception:
+            # too short for Scapy to dissect the header, so invalid
+            expected = False
+        valid += expected
+        if validate_frame(data) != expected:
+            mismatches.append((data.hex(), expected))
+    assert not mismatches, mismatches[:10]
+    # the corpus exercises both outcomes
+    assert 0 < valid < FRAMES
@@ -0,0 +1,79 @@
+import random
+import struct
+from types import SimpleNamespace
+
+import pytest
+
+from baconfuzzer.fuzzer.mutation import MutationEngine, Mutator, SeedCorpus
+from baconfuzzer.message_formats import create_protocol
+from baconfuzzer.message_formats.checksum import crc16_modbus
+from baconfuzzer.message_formats.modbus.modbus_serial_adu import ModbusSerialADURequest
+
+MSG_NAME = "Write Multiple Registers"
+
+
+@pytest.fixture(scope="module")
+def protocol():
+    protocol = create_protocol("modbus")
+    yield protocol
+    protocol.close()
+
+
+def serial_engine(protocol) -> MutationEngine:
+    template = ModbusSerialADURequest(address=1) / protocol.fuzzed_msgs[MSG_NAME]
+    corpus = SeedCorpus()
+    for _ in range(16):
+        corpus.add(MSG_NAME, template.build())
+    return MutationEngine(
+        protocol,
+        corpus,
+        {},
+        {"Unit Identifier": 1},
+        SimpleNamespace(protocol_interface="Serial"),
+    )
+
+
+def test_mutator_is_deterministic_and_bounded():
+    seed = bytes(range(32))
+    first = Mutator(max_size=64, rng=random.Random(1))
+    second = Mutator(max_size=64, rng=random.Random(1))
+    for _ in range(1000):
+        mutant = bytes(first.mutate(seed))
+        assert mutant == bytes(second.mutate(seed))
+        assert len(mutant) <= 64
+
+
+def test_fix_ups_restore_the_serial_crc(protocol):
+    engine = serial_engine(protocol)
+    for _ in range(1000):
+        mutant = engine.mutate(MSG_NAME)
+        if len(mutant) >= 3:
+            assert crc16_modbus(mutant) == 0
+
+
+def test_mutants_differ_from_seeds(protocol):
+    corpus = SeedCorpus()
+    seed = bytes.fromhex("01100000000204000a0102")
+    corpus.add(MSG_NAME, seed)
+    engine = MutationEngine(
+        protocol,
+        corpus,
+        {},
+        {},
+        SimpleNamespace(protocol_interface="Serial"),
+        fix_up=False,
+    )
+    mutants = [engine.mutate(MSG_NAME) for _ in range(1000)]
+    assert sum(mutant != seed for mutant in mutants) > 950
+
+
+def test_fix_ups_restore_the_mbap_length(protocol):
+    corpus = SeedCorpus()
+    corpus.add(MSG_NAME, bytes.fromhex("000100000009010f00000002010300"))
+    engine = MutationEngine(
+        protocol, corpus, {}, {}, SimpleNamespace(protocol_interface="TCP Socket")
+    )
+    for _ in range(1000):
+        mutant = engine.mutate(MSG_NAME)
+        if len(mutant) >= 6:
+            assert struct.unpack_from("!H", mutant, 4)[0] == len(mutant) - 6
@@ -0,0 +1,59 @@
+import socket
+
+import pytest
+
+from baconfuzzer.io.framing import ReceiveBuffer
+from baconfuzzer.message_formats.modbus.pipelining import (
+    MBAP_HEADER,
+    ModbusTCPPipeline,
+)
+
+
+class FakeInterface:
+    """
+    Hands out one end of a socket pair; the test plays the target on the other
+    """
+
+    def __init__(self):
+        self.targets = []
+
+    def acquire_connection(self):
+        sock, target = socket.socketpair()
+        self.targets.append(target)
+        return sock
+
+    def connection_buffer(self, sock):
+        return ReceiveBuffer()
+
+    def release_connection(self, sock, reusable=True):
+        sock.close()
+
+
+def request(trans_id: int) -> bytes:
+    return MBAP_HEADER.pack(trans_id, 0, 6) + bytes.fromhex("010300000001")
+
+
+@pytest.fixture
+def pipeline():
+    replies = []
+    io_interface = FakeInterface()
+    pipeline = ModbusTCPPipeline(
+        io_interface, 8, 1.0, lambda *reply: replies.append(reply)
+    )
+    yield pipeline, io_interface, replies
+    for target in io_interface.targets:
+        target.close()
+
+
+def test_requests_in_flight_are_settled_when_the_target_closes(pipeline):
+    pipeline, io_interface, replies = pipeline
+    for trans_id in range(3):
+        assert pipeline.send(None, request(trans_id), f"msg {trans_id}") == []
+    io_interface.targets[0].close()
+    assert pipeline.finish() == []
+    # settled as closed, like a closed connection without pipelining
+    assert [(name, rxd) for name, _, rxd, _ in replies] == [
+        ("msg 0", b""),
+        ("msg 1", b""),
+        ("msg 2", b""),
+    ]
@@ -0,0 +1,36 @@
+import pytest
+
+from baconfuzzer.io.rtt import AdaptiveTimeout
+
+
+def test_first_sample_seeds_the_estimate():
+    timeouts = AdaptiveTimeout(0.01, 5.0)
+    assert timeouts.timeout("Read Coils") == 5.0
+    timeouts.answered("Read Coils", 0.1)
+    # srtt + 4 * rttvar
+    assert timeouts.timeout("Read Coils") == pytest.approx(0.3)
+    assert timeouts.timeout("Read Coils", 1) == pytest.approx(0.6)
+
+
+def test_types_answered_only_on_a_resend_back_off():
+    timeouts = AdaptiveTimeout(0.01, 5.0)
+    timeouts.answered("Read Coils", 0.1)
+    job_rto = timeouts.timeout("Write Multiple Registers")
+    timeouts.answered("Write Multiple Registers", 0.5, attempt=1)
+    assert timeouts.timeout("Write Multiple Registers") == pytest.approx(2 * job_rto)
+    # samples of other types don't reset the back-off
+    timeouts.answered("Read Coils", 0.1)
+    job_rto = timeouts.timeout("Read Coils")
+    timeouts.answered("Write Multiple Registers", 0.5, attempt=1)
+    assert timeouts.timeout("Write Multiple Registers") == pytest.approx(4 * job_rto)
+    # until it is answered on a first attempt
+    timeouts.answered("Write Multiple Registers", 0.5)
+    assert timeouts.timeout("Write Multiple Registers") == pytest.approx(1.5)
+
+
+def test_back_off_stops_at_the_ceiling():
+    timeouts = AdaptiveTimeout(0.01, 1.0)
+    timeouts.answered("Read Coils", 0.1)
+    for _ in range(10):
+        timeouts.answered("Write Multiple Registers", 0.9, attempt=1)
+    assert timeouts.timeout("Write Multiple Registers") == 1.0
@@ -0,0 +1,47 @@
+import pytest
+
+from baconfuzzer.devices import BaseDevice
+from baconfuzzer.io.udp import BaconUDPIO
+from baconfuzzer.io.udp_echo import UDPEchoServer
+from baconfuzzer.message_formats.modbus.modbus import ModbusProtocol
+
+READ_COILS = bytes.fromhex("000100000006010100000001")
+
+
+@pytest.fixture
+def echo_target():
+    server = UDPEchoServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_stop_sends_the_partial_burst(echo_target, tmp_path, monkeypatch):
+    # the crash store lives in the working directory
+    monkeypatch.chdir(tmp_path)
+    ip, port = echo_target.address
+    config = {
+        "Destination IP": ip,
+        "Destination Port": port,
+        "Burst Size": 8,
+        "timeout": 1,
+        "Adaptive Timeout": "No",
+    }
+    io_interface = BaconUDPIO(config, BaseDevice)
+    io_interface.configure(config)
+    protocol = ModbusProtocol()
+    replies = []
+    protocol.observe_responses(io_interface, lambda *reply: replies.append(reply))
+    try:
+        for _ in range(3):
+            assert not protocol.send_msg(
+                "Read Coils", None, READ_COILS, config, io_interface
+            )
+        assert not replies
+        # the job stops before the burst is full
+        assert protocol.finish(config, io_interface) == 0
+        assert [bytes(rxd) for _, _, rxd, _ in replies] == [READ_COILS] * 3
+        assert echo_target.received == 3
+    finally:
+        io_interface.teardown()
+        protocol.close()